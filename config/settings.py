@@ -124,7 +124,85 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # Whitenoise configuration for serving static files
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Directory of the stored optimization runs (one sub directory per run id)
+SIMULATOR_RUN_DIR = os.environ.get('SIMULATOR_RUN_DIR', os.path.join(BASE_DIR, 'runs'))
+
+# Queue of the asynchronous solve jobs (SQLite) and number of local solve processes per web process.
+# With SIMULATOR_JOB_WORKERS=0 the web processes only enqueue, 'manage.py solve_worker' solves.
+SIMULATOR_JOB_DB = os.environ.get('SIMULATOR_JOB_DB', os.path.join(SIMULATOR_RUN_DIR, 'jobs.sqlite3'))
+SIMULATOR_JOB_WORKERS = int(os.environ.get('SIMULATOR_JOB_WORKERS', '1'))
+SIMULATOR_JOB_TIMEOUT = int(os.environ.get('SIMULATOR_JOB_TIMEOUT', '600'))   # seconds
+# Admission control: solves running in parallel per process and per host, maximum number of queued jobs
+# (more are rejected with 503 and Retry-After, 0: unbounded) and seconds a job may wait in the queue
+SIMULATOR_MAX_SOLVES_PER_PROCESS = int(os.environ.get('SIMULATOR_MAX_SOLVES_PER_PROCESS', '1'))
+SIMULATOR_MAX_SOLVES_PER_HOST = int(os.environ.get('SIMULATOR_MAX_SOLVES_PER_HOST', '2'))
+SIMULATOR_JOB_QUEUE_LIMIT = int(os.environ.get('SIMULATOR_JOB_QUEUE_LIMIT', '50'))
+SIMULATOR_JOB_QUEUE_DEADLINE = int(os.environ.get('SIMULATOR_JOB_QUEUE_DEADLINE', '300'))
+
+# Solve workers are replaced after this many jobs or above this resident memory (0: no limit)
+SIMULATOR_JOB_MAX_TASKS = int(os.environ.get('SIMULATOR_JOB_MAX_TASKS', '100'))
+SIMULATOR_JOB_MAX_MEMORY_MB = int(os.environ.get('SIMULATOR_JOB_MAX_MEMORY_MB', '0'))
+
+# Scenario of every region of the home page: [workbook (relative to simulator/data), sheet].
+# Only the German scenario exists so far, the other regions use it until they get their own sheets.
+SIMULATOR_REGIONS = {
+    'Germany': ['KonfigurationSzenarios.xlsx', 'SimpleSzenarioD'],
+    'India': ['KonfigurationSzenarios.xlsx', 'SimpleSzenarioD'],
+    'Europe': ['KonfigurationSzenarios.xlsx', 'SimpleSzenarioD'],
+    'Custom': ['KonfigurationSzenarios.xlsx', 'SimpleSzenarioD'],
+}
+
+# Import the solver stack and build these scenarios ([workbook, sheet], all regions if empty) when gunicorn
+# is ready (see gunicorn.conf.py), so the workers share them copy-on-write. With SIMULATOR_PREBUILD_RESULTS
+# the results of all regions which are not stored yet are solved then, too (off: it delays the start).
+SIMULATOR_PRELOAD = os.environ.get('SIMULATOR_PRELOAD', '') not in ('', '0', 'false', 'False')
+SIMULATOR_PRELOAD_SCENARIOS = []
+SIMULATOR_PREBUILD_RESULTS = os.environ.get('SIMULATOR_PREBUILD_RESULTS', '0') not in ('', '0', 'false', 'False')
+
+# Maximum import time of the web startup without preload, checked by 'manage.py check_import_budget'
+SIMULATOR_IMPORT_BUDGET_MS = float(os.environ.get('SIMULATOR_IMPORT_BUDGET_MS', '800'))
+
+# Result cache shared by all worker processes: SQLite index of the runs it stored, the least recently used
+# runs are removed from the run store beyond these bounds
+SIMULATOR_RESULT_CACHE = {
+    'PATH': os.environ.get('SIMULATOR_RESULT_CACHE_PATH', os.path.join(SIMULATOR_RUN_DIR, 'result_cache.sqlite3')),
+    'MAX_ENTRIES': int(os.environ.get('SIMULATOR_RESULT_CACHE_MAX_ENTRIES', '256')),
+    'MAX_BYTES': int(os.environ.get('SIMULATOR_RESULT_CACHE_MAX_BYTES', str(256 * 1024 * 1024))),
+}
+
+# Counters and histograms of the /metrics endpoint, shared by web and solve worker processes (SQLite)
+SIMULATOR_METRICS_DB = os.environ.get('SIMULATOR_METRICS_DB', os.path.join(SIMULATOR_RUN_DIR, 'metrics.sqlite3'))
+
+# Models of runs kept in memory per process for what-if re-solves (see simulator.what_if)
+SIMULATOR_WHAT_IF_MODELS = int(os.environ.get('SIMULATOR_WHAT_IF_MODELS', '4'))
+
+# Solver used for all optimizations, empty: choose automatically (see simulator.oemof_runner)
+SIMULATOR_SOLVER = os.environ.get('SIMULATOR_SOLVER', '')
+
+# Engine of the optimizations: 'oemof', 'direct' (sparse LP solved by HiGHS without solph and pyomo models,
+# see simulator.direct_lp) or 'validate' (both, differences of the direct LP are logged, oemof is used)
+SIMULATOR_ENGINE = os.environ.get('SIMULATOR_ENGINE', 'oemof')
+
+# Version of the deployed code (e.g. git commit), part of the run ids and ETags of results.
+# HEROKU_SLUG_COMMIT is set by the Heroku dyno metadata feature. Empty: hash the sources once per process.
+SIMULATOR_CODE_VERSION = os.environ.get('SIMULATOR_CODE_VERSION', os.environ.get('HEROKU_SLUG_COMMIT', ''))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Log messages of the simulator (preload, solve workers, phase timings) to the console as logfmt lines
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {'()': 'simulator.metrics.StructuredFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'structured'},
+    },
+    'loggers': {
+        'simulator': {'handlers': ['console'], 'level': os.environ.get('SIMULATOR_LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
@@ -22,4 +22,17 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.home, name="home"),          # Page 1
     path('results/', views.results, name="results"),  # Page 2
+    path('results/<slug:run_id>/', views.results_run, name="results_run"),
+    path('jobs/', views.submit, name="submit_job"),
+    path('jobs/<slug:job_id>/', views.job_detail, name="job"),
+    path('jobs/<slug:job_id>/status/', views.job_status, name="job_status"),
+    path('jobs/<slug:job_id>/events/', views.job_events, name="job_events"),
+    path('api/cache/', views.api_cache_stats, name="api_cache_stats"),
+    path('api/admission/', views.api_admission_stats, name="api_admission_stats"),
+    path('metrics', views.metrics_view, name="metrics"),
+    path('api/runs/<slug:run_id>/', views.api_run, name="api_run"),
+    path('api/runs/<slug:run_id>/what-if/', views.api_run_what_if, name="api_run_what_if"),
+    path('api/runs/<slug:run_id>/ranges/', views.api_run_validity_ranges, name="api_run_validity_ranges"),
+    path('api/runs/<slug:run_id>/losses/<slug:chain>/', views.api_run_chain, name="api_run_chain"),
+    path('api/runs/<slug:run_id>/<slug:section>/', views.api_run_section, name="api_run_section"),
 ]
@@ -0,0 +1,35 @@
+"""
+Gunicorn configuration (loaded automatically from the working directory)
+
+The ASGI application (config.asgi) runs in uvicorn workers and is loaded once in the master before the
+workers are forked; when_ready() preloads the solver stack and the configured scenarios then
+(SIMULATOR_PRELOAD), so the first request of a worker does not wait for it. Only gunicorn preloads,
+manage.py commands start without it. Cold start and the memory of every worker are logged.
+"""
+import os
+import time
+
+_started = time.time()
+
+preload_app = True
+worker_class = 'uvicorn.workers.UvicornWorker'   # ASGI: progress streams do not occupy a worker each
+os.environ.setdefault('SIMULATOR_PRELOAD', '1')
+
+
+def when_ready(server):
+    # the application is loaded (preload_app), the workers are not forked yet: they share the preloaded objects
+    from django.conf import settings
+
+    if settings.SIMULATOR_PRELOAD:
+        from simulator.worker_pool import preload
+        preload()
+    server.log.info('Cold start: ready to serve after %.2f s', time.time() - _started)
+
+
+def post_fork(server, worker):
+    from simulator.worker_pool import rss_mb
+    server.log.info('Worker %s forked, RSS %.0f MB (mostly shared with the master)', worker.pid, rss_mb())
+
+
+def child_exit(server, worker):
+    server.log.info('Worker %s exited', worker.pid)
@@ -0,0 +1,97 @@
+"""
+Admission control for solves
+
+A solve (pyomo model plus CBC process) needs a slot: one of settings.SIMULATOR_MAX_SOLVES_PER_PROCESS
+per process (semaphore) and one of settings.SIMULATOR_MAX_SOLVES_PER_HOST per host (flock on one of as
+many lock files, released by the OS if the process dies). Work beyond that waits in the job queue, which
+is bounded in length (SIMULATOR_JOB_QUEUE_LIMIT, jobs.QueueFull -> 503 with Retry-After) and in waiting
+time (SIMULATOR_JOB_QUEUE_DEADLINE, expired jobs fail without being solved). Synchronous solves (what-ifs)
+are not queued, they are rejected the same way if the queue is full or no slot becomes free in time.
+"""
+
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+SLOT_POLL_INTERVAL = 0.05   # seconds between attempts to get a host slot
+
+_process_slots = None
+_process_slots_lock = threading.Lock()
+
+
+def _settings(name, default):
+    return getattr(settings, name, default)
+
+
+def max_solves_per_host() -> int:
+    return max(1, _settings('SIMULATOR_MAX_SOLVES_PER_HOST', 2))
+
+
+def _process_semaphore():
+    global _process_slots
+    with _process_slots_lock:
+        if _process_slots is None:
+            _process_slots = threading.BoundedSemaphore(max(1, _settings('SIMULATOR_MAX_SOLVES_PER_PROCESS', 1)))
+    return _process_slots
+
+
+def _lock_dir():
+    lock_dir = os.path.join(settings.SIMULATOR_RUN_DIR, 'locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    return lock_dir
+
+
+@contextmanager
+def solve_slot(timeout=None):
+    """
+    Wait for a free solve slot of this process and of the host and hold it
+
+    Args:
+        timeout: seconds to wait at most, None: wait until a slot is free
+
+    Raises:
+        jobs.QueueFull: no slot became free within timeout seconds
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    semaphore = _process_semaphore()
+    if not semaphore.acquire(timeout=timeout):
+        raise _rejected()
+    try:
+        lock_files = [open(os.path.join(_lock_dir(), f'solve-slot-{i}.lock'), 'a')
+                      for i in range(max_solves_per_host())]
+        try:
+            while True:
+                for lock_file in lock_files:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    yield
+                    return   # the slot is released when its file is closed
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise _rejected()
+                time.sleep(SLOT_POLL_INTERVAL)
+        finally:
+            for lock_file in lock_files:
+                lock_file.close()
+    finally:
+        semaphore.release()
+
+
+def _rejected():
+    from .jobs import reject
+    return reject()
+
+
+def queue_limit() -> int:
+    """Maximum number of queued jobs, 0: unbounded"""
+    return _settings('SIMULATOR_JOB_QUEUE_LIMIT', 0)
+
+
+def queue_deadline() -> float:
+    """Seconds a job may wait in the queue before it fails without being solved, 0: no deadline"""
+    return _settings('SIMULATOR_JOB_QUEUE_DEADLINE', 0)
@@ -0,0 +1,228 @@
+"""
+Batch runs: solve every scenario sheet of a set of workbooks and store the runs
+
+Each scenario is solved in a process of its own, forked from the calling process after the solver stack
+is imported, at most `jobs` at a time; with batch > 1 a process solves that many scenarios as one LP (see
+batching.py). A process which exceeds the timeout is killed, so one scenario which does not solve does not
+block the batch. Scenarios already in the run store are not solved again (status cached), identical
+networks of other workbooks or of the same batch are served from the store (status deduplicated, see
+fingerprint.py). The batch bypasses
+the admission limits of the web jobs (settings.SIMULATOR_MAX_SOLVES_PER_HOST), its parallelism is `jobs`.
+"""
+
+import contextlib
+import fnmatch
+import glob
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+
+from .sweep import TOTALS
+
+SCENARIO_HEADINGS = ['Name', 'Type', 'Value']   # columns read by ExcelModelFactory
+SUMMARY_COLUMNS = ['workbook', 'sheet', 'status', 'run_id', 'seconds'] + TOTALS + ['error']
+
+
+def expand_workbooks(patterns) -> list:
+    """
+    Workbook files matching glob patterns, relative patterns which match nothing are also tried in
+    simulator/data
+
+    Raises:
+        ValueError: a pattern matches no file
+    """
+    from .scenario_catalog import DATA_DIR
+
+    workbooks = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or (
+            sorted(glob.glob(os.path.join(DATA_DIR, pattern))) if not os.path.isabs(pattern) else [])
+        matches = [path for path in matches if os.path.isfile(path)]
+        if not matches:
+            raise ValueError(f"No workbook matches '{pattern}'")
+        workbooks += [os.path.abspath(path) for path in matches if os.path.abspath(path) not in workbooks]
+    return workbooks
+
+
+def scenario_sheets(workbook) -> list:
+    """Names of the sheets of a workbook with the columns of a scenario (SCENARIO_HEADINGS)"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(filename=workbook, read_only=True, data_only=True)
+    try:
+        return [sheet.title for sheet in wb.worksheets
+                if set(SCENARIO_HEADINGS) <= set(next(sheet.iter_rows(max_row=1, values_only=True), ()))]
+    finally:
+        wb.close()
+
+
+def batch_tasks(workbook_patterns, sheet_patterns=('*',)) -> list:
+    """
+    Args:
+        workbook_patterns: glob patterns of workbooks, see expand_workbooks()
+        sheet_patterns: fnmatch patterns of sheet names
+
+    Returns:
+        list: (workbook path, sheet name) of all scenario sheets matching a sheet pattern
+    """
+    return [(workbook, sheet) for workbook in expand_workbooks(workbook_patterns)
+            for sheet in scenario_sheets(workbook)
+            if any(fnmatch.fnmatchcase(sheet, pattern) for pattern in sheet_patterns)]
+
+
+def _run_in_process(tasks, connection):
+    # target of a run process: solves and stores the scenarios of tasks which are not stored, several
+    # together as one LP (see batching.py), and sends (task, summary row) per scenario
+    from . import metrics
+
+    os.setpgrp()   # own process group: a timeout also kills the solver process started by this one
+    try:
+        _solve_and_store(tasks, connection)
+    finally:
+        metrics.flush()   # the process ends by os._exit(), which skips atexit
+        connection.close()
+
+
+def _solve_and_store(tasks, connection):
+    # the work of _run_in_process()
+    from .batching import solve_batch
+    from .oemof_runner import run_oemof_scenario, solver_name
+    from .run_store import load_section, make_run_id, run_exists, run_with_fingerprint, save_run
+
+    def row(run_id, status):
+        summary = load_section(run_id, 'summary')
+        return dict({total: summary.get(total) for total in TOTALS}, status=status, run_id=run_id)
+
+    def failed(e):
+        return {'status': 'failed', 'error': str(e) or e.__class__.__name__}
+
+    unsolved = []   # (task, run id)
+    for task in tasks:
+        try:
+            run_id = make_run_id(*task, solver_name())
+            if run_exists(run_id):
+                connection.send((task, row(run_id, 'cached')))
+            else:
+                unsolved.append((task, run_id))
+        except Exception as e:
+            connection.send((task, failed(e)))
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):   # no solver log
+        if len(unsolved) > 1:
+            outcomes = solve_batch([(*task, {}) for task, _ in unsolved])
+        else:
+            outcomes = []
+            for task, _ in unsolved:
+                try:
+                    outcomes.append(run_oemof_scenario(*task))
+                except Exception as e:
+                    outcomes.append(e)
+
+    solved = set()   # fingerprints of the networks solved by this process
+    for (task, run_id), data in zip(unsolved, outcomes):
+        try:
+            if isinstance(data, Exception):
+                raise data
+            # a network stored before, by another scenario, was not solved again (see _stored_result())
+            fingerprint = data.get('fingerprint')
+            deduplicated = fingerprint in solved or run_with_fingerprint(fingerprint) is not None
+            save_run(run_id, data)
+            solved.add(fingerprint)
+            connection.send((task, row(run_id, 'deduplicated' if deduplicated else 'solved')))
+        except Exception as e:
+            connection.send((task, failed(e)))
+
+
+def run_batch(tasks, jobs=None, timeout=None, batch=1):
+    """
+    Solve and store scenarios in parallel processes
+
+    Args:
+        tasks: list of (workbook, sheet), see batch_tasks()
+        jobs: number of processes solving at the same time, default: number of CPUs
+        timeout: seconds after which a process is killed, None: no limit
+        batch: number of scenarios a process solves together as one LP (see batching.py), the timeout
+            applies to all of them
+
+    Returns:
+        iterator of (row, number of scenarios done, number of scenarios) in completion order, row:
+        dict with the SUMMARY_COLUMNS, status solved, deduplicated, cached, failed or timeout
+    """
+    from .oemof_runner import solver_name
+    from .scenario_catalog import DATA_DIR
+
+    import pyomo.environ  # noqa: F401, imported once and shared by the forked processes
+    from .model.model_factory import ExcelModelFactory  # noqa: F401
+    solver_name()
+
+    context = multiprocessing.get_context('fork')
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    batch = max(1, batch)
+    pending = [list(tasks[start:start + batch]) for start in range(0, len(tasks), batch)]
+    running = {}   # receiving end of the pipe -> (process, tasks without a row yet, start time)
+    done = 0
+
+    def finished(task, started, row):
+        workbook, sheet = task
+        if os.path.dirname(workbook) == os.path.abspath(DATA_DIR):
+            workbook = os.path.basename(workbook)
+        return dict(row, workbook=workbook, sheet=sheet, seconds=round(time.monotonic() - started, 3))
+
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                chunk = pending.pop(0)
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=_run_in_process, args=(chunk, sender), daemon=True)
+                process.start()
+                sender.close()   # the receiver sees EOF if the process dies without all rows
+                running[receiver] = (process, chunk, time.monotonic())
+
+            wait = None
+            if timeout:
+                wait = max(0.0, min(started + timeout for _, _, started in running.values()) - time.monotonic())
+            rows = []
+            for receiver in multiprocessing.connection.wait(list(running), wait):
+                process, chunk, started = running[receiver]
+                try:
+                    task, row = receiver.recv()
+                    chunk.remove(task)
+                    rows.append(finished(task, started, row))
+                    if chunk:
+                        continue
+                except EOFError:
+                    process.join()
+                    rows += [finished(task, started, {'status': 'failed',
+                                                      'error': f"Process exited with code {process.exitcode}"})
+                             for task in chunk]
+                del running[receiver]
+                receiver.close()
+                process.join()
+
+            if timeout:
+                for receiver, (process, chunk, started) in list(running.items()):
+                    if time.monotonic() - started >= timeout:
+                        _kill(process)
+                        receiver.close()
+                        del running[receiver]
+                        rows += [finished(task, started, {'status': 'timeout',
+                                                          'error': f"Not solved within {timeout:g} s"})
+                                 for task in chunk]
+
+            for row in rows:
+                done += 1
+                yield row, done, len(tasks)
+    finally:   # interrupted: no scenario keeps solving
+        for process, _, _ in running.values():
+            _kill(process)
+
+
+def _kill(process):
+    # the process and the solver it started (see _run_in_process)
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:   # not yet in its own process group
+        process.kill()
+    process.join()
@@ -0,0 +1,163 @@
+"""
+Batch solves: many small scenarios stacked into one block-diagonal LP
+
+The LP of a workbook scenario is a single timestep with a few dozen variables, solving it takes less time
+than starting the solver and writing its problem file. solve_batch() builds the solph models of every
+scenario as usual (one per connected component), nests them as blocks of one pyomo model (so their
+variables and constraints are namespaced by the block, scenario_0.flow[...], scenario_1.flow[...]) with
+the sum of their objectives as objective and solves that once. The blocks share no variable, so the LP is
+block diagonal and its optimum is the optimum of every scenario, with the same duals. The models are
+detached again and their results extracted one by one, as run_oemof_scenario() does.
+
+If the batch LP is not optimal (one infeasible or unbounded scenario makes the whole LP so) every
+scenario is solved on its own, so the result of each is the same as that of run_oemof_scenario().
+Building the models and extracting the results still take their time per scenario, batching saves the
+solver call and its overhead per scenario. The direct engine (see direct_lp.py) has no such overhead, with
+it the scenarios are solved one by one.
+"""
+
+import logging
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _built(file_path, sheet_name, overrides):
+    # factory, run context and fingerprint of one scenario of the batch
+    from .fingerprint import fingerprint
+    from .model.model_factory import ExcelModelFactory, load_sheet
+    from .oemof_runner import RunContext, solver_name
+
+    context = RunContext(file_path, sheet_name, overrides)
+    context.phases.start('load_workbook')
+    load_sheet(file_path, sheet_name)
+    context.phases.start('build_model')
+    factory = ExcelModelFactory(file_path, sheet_name, context.overrides)
+    scenario_fingerprint = fingerprint(factory.energy_system, factory.value_collection, solver_name())
+    context.phases.stop()
+    return factory, context, scenario_fingerprint
+
+
+def _solve_stacked(models, tee):
+    """
+    Solve models as blocks of one LP
+
+    Returns:
+        str: solver used, None if the LP is not optimal (the models are not solved then)
+    """
+    import pyomo.environ as po
+    from pyomo.opt import SolverFactory, TerminationCondition
+    from .oemof_runner import solver_candidates
+
+    batch = po.ConcreteModel()
+    batch.dual = po.Suffix(direction=po.Suffix.IMPORT)
+    batch.rc = po.Suffix(direction=po.Suffix.IMPORT)
+    objectives = [next(model.component_objects(po.Objective, active=True)) for model in models]
+    for k, (model, objective) in enumerate(zip(models, objectives)):
+        objective.deactivate()
+        batch.add_component(f'scenario_{k}', model)
+    batch.objective = po.Objective(expr=sum(objective.expr for objective in objectives))
+
+    try:
+        for solver in solver_candidates():
+            solver = solver or 'cbc'   # solph's default solver
+            try:
+                results = SolverFactory(solver).solve(batch, tee=tee, load_solutions=False)
+            except Exception as e:
+                logger.warning("solver failed", extra={'solver': solver, 'error': e})
+                continue
+            if results.solver.termination_condition != TerminationCondition.optimal:
+                logger.info("batch not optimal", extra={'solver': solver, 'scenarios': len(models),
+                                                        'termination': str(results.solver.termination_condition)})
+                return None
+            batch.solutions.load_from(results)
+            batch.solver_results = results
+            metrics.record_solve(batch, solver)
+            for model in models:   # the suffixes of the batch to those of the scenario models
+                model.solver_results = results
+                for suffix, kind in (('dual', po.Constraint), ('rc', po.Var)):
+                    source, target = getattr(batch, suffix), getattr(model, suffix)
+                    target.update((component, source[component])
+                                  for component in model.component_data_objects(kind) if component in source)
+            return solver
+        raise Exception("No suitable solver found for the batch")
+    finally:
+        for model, objective in zip(models, objectives):
+            batch.del_component(model)
+            objective.activate()
+
+
+def solve_batch(scenarios, tee=False):
+    """
+    Solve scenarios together in one LP
+
+    Args:
+        scenarios: list of (workbook, sheet, overrides)
+        tee: show the solver log
+
+    Returns:
+        list: per scenario the result of run_oemof_scenario() or the exception solving it raised
+    """
+    from .oemof_runner import (receive_duals, run_oemof_scenario, scenario_reference, simulation_engine,
+                               solve_models, summarize_results, _stored_result)
+
+    if simulation_engine() == 'direct':   # solved in memory, there is no solver start to share
+        outcomes = []
+        for file_path, sheet_name, overrides in scenarios:
+            try:
+                outcomes.append(run_oemof_scenario(file_path, sheet_name, overrides))
+            except Exception as e:
+                outcomes.append(e)
+        return outcomes
+
+    outcomes = [None] * len(scenarios)
+    built = {}   # fingerprint -> (factory, phases, positions in scenarios)
+    for position, (file_path, sheet_name, overrides) in enumerate(scenarios):
+        try:
+            factory, context, scenario_fingerprint = _built(file_path, sheet_name, overrides)
+        except Exception as e:
+            outcomes[position] = e
+            continue
+        if scenario_fingerprint in built:   # the same network twice in the batch is solved once
+            built[scenario_fingerprint][2].append(position)
+            continue
+        data = _stored_result(scenario_fingerprint)
+        if data is not None:
+            metrics.inc('simulator_deduplicated_solves_total')
+            outcomes[position] = dict(data, scenario=scenario_reference(file_path, sheet_name, overrides))
+            continue
+        for model in factory.component_models():
+            receive_duals(model)
+        built[scenario_fingerprint] = (factory, context.phases, [position])
+
+    solved = {}   # fingerprint -> solver used, or the exception
+    if built:
+        solver_used = _solve_stacked([model for factory, _, _ in built.values()
+                                      for model in factory.component_models()], tee)
+        for scenario_fingerprint, (factory, _, _) in built.items():
+            if solver_used is not None:
+                solved[scenario_fingerprint] = solver_used
+                continue
+            try:   # one scenario spoiled the batch: each on its own
+                solved[scenario_fingerprint] = solve_models(factory.component_models(), tee=tee)
+                for model in factory.component_models():
+                    metrics.record_solve(model, solved[scenario_fingerprint])
+            except Exception as e:
+                solved[scenario_fingerprint] = e
+
+    for scenario_fingerprint, (factory, phases, positions) in built.items():
+        data = solved[scenario_fingerprint]
+        if not isinstance(data, Exception):
+            try:
+                models = factory.component_models()
+                data = summarize_results(models if len(models) > 1 else models[0], factory.value_collection,
+                                         data, phases)
+                data["fingerprint"] = scenario_fingerprint
+            except Exception as e:
+                data = e
+        for position in positions:
+            file_path, sheet_name, overrides = scenarios[position]
+            outcomes[position] = data if isinstance(data, Exception) else \
+                dict(data, scenario=scenario_reference(file_path, sheet_name, overrides))
+    return outcomes
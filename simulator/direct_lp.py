@@ -0,0 +1,351 @@
+"""
+Direct LP engine: the energy system of a workbook compiled straight into a sparse LP solved by HiGHS
+
+The networks of the workbooks only use buses, sources, sinks and transformers with fixed or bounded flows
+and conversion factors. DirectLP writes the LP solph would build for them, one column per flow and time
+step, one row per bus balance and per transformer input/output pair, as a column-wise (CSC) matrix and
+passes it to HiGHS in memory, so neither the solph model nor the pyomo expressions and the LP file are
+built. results() and sensitivity() return what oemof.solph.processing.results() and
+oemof_runner.extract_sensitivity() return for the solph model, so oemof_runner.summarize() turns them
+into the usual result.
+
+Most flows are determined by the equations alone: fixed source and sink flows propagate through the buses
+and transformers, every flow which is the only unknown one of an equation is computed in topological
+order (DirectLP.propagate()). Only the rest, the flows with a free parameter and the transformer flows
+between them, go to HiGHS; if nothing is left (a fully determined network) no LP is solved at all.
+
+Networks with cost free cycles (e.g. the '_rest' source and sink of a bus) have several optimal solutions,
+HiGHS and the solver of the oemof engine may pick different ones. compare() then finds differences
+although objective() of both is the same.
+
+Other node types or flow options are not supported and raise ValueError, the scenario is then solved
+with oemof (see oemof_runner.run_oemof_scenario()). compare() checks the results of both engines.
+"""
+
+import math
+
+import numpy as np
+
+SOLVER = 'direct_highs'     # solver name of the results of this engine
+CLOSED_FORM = 'closed_form' # solver name of results which needed no LP solve (see DirectLP.propagate())
+TOLERANCE = 1e-6            # relative difference up to which compare() takes results as equal
+PRIMAL_TOLERANCE = 1e-9     # relative violation of a bound or equation up to which propagate() accepts it
+
+SUPPORTED_NODES = ('Bus', 'Source', 'Sink', 'Transformer', 'Converter')
+
+
+class DirectLP:
+    """
+    LP of an energy system as solph would build it
+
+    Args:
+        energy_system: solph energy system as built by ExcelModelFactory
+
+    Raises:
+        ValueError: the energy system uses nodes or flow options the direct LP does not support
+    """
+
+    def __init__(self, energy_system):
+        self.energy_system = energy_system
+        self.timesteps = len(energy_system.timeincrement)
+        self.flows = list(energy_system.flows().items())   # [((source node, target node), Flow)]
+        self.__check()
+
+        timesteps = range(self.timesteps)
+        column = {key: n * self.timesteps for n, (key, _) in enumerate(self.flows)}   # of time step 0
+        n = len(self.flows) * self.timesteps
+        self.cost = np.zeros(n)
+        self.lower = np.zeros(n)
+        self.upper = np.full(n, math.inf)
+        self.fixed = np.zeros(n, dtype=bool)
+        for (key, flow), first in zip(self.flows, column.values()):
+            for t in timesteps:
+                # bounds and costs as solph's Model._add_parent_block_variables() and SimpleFlowBlock
+                self.cost[first + t] = flow.variable_costs[t] * energy_system.timeincrement[t]
+                if flow.nominal_value is None:
+                    continue
+                if flow.fix[0] is not None:
+                    self.lower[first + t] = self.upper[first + t] = flow.fix[t] * flow.nominal_value
+                    self.fixed[first + t] = True
+                else:
+                    self.lower[first + t] = flow.min[t] * flow.nominal_value
+                    self.upper[first + t] = flow.max[t] * flow.nominal_value
+
+        rows, columns, values = [], [], []
+        self.balances = []   # (bus, t) per row of a bus balance, these rows come first
+        for node in energy_system.nodes:
+            if type(node).__name__ == 'Bus':
+                for t in timesteps:
+                    row = len(self.balances)
+                    self.balances.append((node, t))
+                    for i in node.inputs:   # inflows - outflows == 0
+                        rows.append(row), columns.append(column[i, node] + t), values.append(1.0)
+                    for o in node.outputs:
+                        rows.append(row), columns.append(column[node, o] + t), values.append(-1.0)
+        row = len(self.balances)
+        for node in energy_system.nodes:
+            if type(node).__name__ in ('Transformer', 'Converter'):
+                for i in node.inputs:
+                    for o in node.outputs:
+                        for t in timesteps:   # flow[i, n] * factor[o] - flow[n, o] * factor[i] == 0
+                            rows += [row, row]
+                            columns += [column[i, node] + t, column[node, o] + t]
+                            values += [node.conversion_factors[o][t], -node.conversion_factors[i][t]]
+                            row += 1
+        self.rows = row
+        rows, columns, values = np.array(rows, dtype=np.int32), np.array(columns, dtype=np.int32), \
+            np.array(values, dtype=float)
+        self.matrix = _csc(rows, columns, values, len(self.cost))
+        self.row_matrix = _csc(columns, rows, values, self.rows)   # row-wise: (start, column, value)
+        self.__propagation = None
+
+    def __check(self):
+        for node in self.energy_system.nodes:
+            if type(node).__name__ not in SUPPORTED_NODES:
+                raise ValueError(f"{type(node).__name__} {node} is not supported by the direct LP")
+            if type(node).__name__ == 'Bus' and not getattr(node, 'balanced', True):
+                raise ValueError(f"Unbalanced bus {node} is not supported by the direct LP")
+        for (i, o), flow in self.flows:
+            if getattr(flow, 'nonconvex', None) or getattr(flow, 'investment', None) or \
+                    getattr(flow, 'bidirectional', False):
+                raise ValueError(f"Flow {i} -> {o} uses options not supported by the direct LP")
+
+    def propagate(self):
+        """
+        Flows determined by the equations alone: the fixed flows and, in topological order, every flow which
+        is the only unknown one of a bus balance or transformer relation (any feasible solution has these
+        values, whatever the costs)
+
+        Returns:
+            dict: 'values' and 'known' per column, 'order': [(row, column determined by it)]
+
+        Raises:
+            ValueError: a determined flow is out of its bounds or an equation without unknown flows does not
+                hold, the LP is infeasible
+        """
+        if self.__propagation is not None:
+            return self.__propagation
+
+        start, index, value = self.row_matrix
+        column_start, column_index, _ = self.matrix
+        known = self.lower == self.upper
+        values = np.where(known, self.lower, 0.0)
+        unknown = np.array([np.count_nonzero(~known[index[start[r]:start[r + 1]]]) for r in range(self.rows)])
+        order = []
+        pending = [r for r in range(self.rows) if unknown[r] == 1]
+        while pending:
+            r = pending.pop()
+            if unknown[r] != 1:
+                continue
+            entries = slice(start[r], start[r + 1])
+            columns, coefficients = index[entries], value[entries]
+            j = columns[~known[columns]][0]
+            a = coefficients[columns == j].sum()
+            if a == 0:
+                continue   # the flow does not take part in the equation
+            rest = columns != j
+            values[j] = -(coefficients[rest] @ values[columns[rest]]) / a
+            tolerance = PRIMAL_TOLERANCE * max(1.0, abs(values[j]))
+            if values[j] < self.lower[j] - tolerance or values[j] > self.upper[j] + tolerance:
+                raise ValueError(f"Infeasible: {self.__column_name(j)} is determined as {values[j]:g}, out of its "
+                                 f"bounds")
+            values[j] = min(max(values[j], self.lower[j]), self.upper[j])
+            known[j] = True
+            order.append((r, j))
+            for r2 in column_index[column_start[j]:column_start[j + 1]]:
+                unknown[r2] -= 1
+                if unknown[r2] == 1:
+                    pending.append(r2)
+
+        determining = {r for r, _ in order}
+        for r in range(self.rows):   # equations without unknown flows must hold
+            if unknown[r] == 0 and r not in determining:
+                entries = slice(start[r], start[r + 1])
+                terms = value[entries] * values[index[entries]]
+                if abs(terms.sum()) > PRIMAL_TOLERANCE * max(1.0, np.abs(terms).max(initial=0.0)):
+                    raise ValueError(f"Infeasible: the fixed flows of {self.__row_name(r)} do not balance")
+
+        self.__propagation = {'values': values, 'known': known, 'order': order}
+        return self.__propagation
+
+    def __column_name(self, column):
+        (i, o), _ = self.flows[column // self.timesteps]
+        return f"flow {i} -> {o}"
+
+    def __row_name(self, row):
+        if row < len(self.balances):
+            return f"bus {self.balances[row][0]}"
+        return "a transformer"
+
+    def determined(self) -> bool:
+        """All flows are determined by propagate(), no LP has to be solved"""
+        return bool(self.propagate()['known'].all())
+
+    def solve(self):
+        """
+        Solve the LP: the flows determined by propagate() without a solver, the rest with HiGHS
+
+        The duals of the equations which determined a flow follow backwards from the flow being basic (its
+        reduced cost is 0), those of equations without unknown flows are 0.
+
+        Returns:
+            dict: 'values' and 'reduced_costs' per column, 'duals' per row, 'solver': SOLVER, or
+                CLOSED_FORM if all flows are determined, 'lp_columns': number of columns solved by HiGHS
+
+        Raises:
+            ValueError: the LP is not optimal (infeasible or unbounded)
+        """
+        propagation = self.propagate()
+        values, known, order = propagation['values'].copy(), propagation['known'], propagation['order']
+        duals = np.zeros(self.rows)
+
+        free = np.flatnonzero(~known)
+        if len(free):
+            start, index, value = self.row_matrix
+            determining = {r for r, _ in order}
+            rows = [r for r in range(self.rows) if r not in determining and
+                    (~known[index[start[r]:start[r + 1]]]).any()]
+            rhs = np.array([-(value[start[r]:start[r + 1]] @ values[index[start[r]:start[r + 1]]]) for r in rows])
+            solution = self.__solve_highs(free, rows, rhs)
+            values[free] = solution.col_value
+            duals[rows] = solution.row_dual
+
+        column_start, column_index, column_value = self.matrix
+        for r, j in reversed(order):   # c_j - sum of a_rj * y_r over the rows of column j == 0
+            entries = slice(column_start[j], column_start[j + 1])
+            rows, coefficients = column_index[entries], column_value[entries]
+            own = rows == r
+            duals[r] = (self.cost[j] - coefficients[~own] @ duals[rows[~own]]) / coefficients[own].sum()
+
+        reduced_costs = self.cost.copy()
+        for j in range(len(self.cost)):
+            entries = slice(column_start[j], column_start[j + 1])
+            reduced_costs[j] -= column_value[entries] @ duals[column_index[entries]]
+
+        return {
+            'values': values,
+            'reduced_costs': reduced_costs,
+            'duals': duals,
+            'solver': SOLVER if len(free) else CLOSED_FORM,
+            'lp_columns': len(free),
+        }
+
+    def __solve_highs(self, columns, rows, rhs):
+        # the LP of the columns which are not determined, restricted to the rows they take part in
+        import highspy
+
+        column_start, column_index, column_value = self.matrix
+        row_position = np.full(self.rows, -1)
+        row_position[rows] = np.arange(len(rows))
+        start, index, value = [0], [], []
+        for j in columns:
+            entries = slice(column_start[j], column_start[j + 1])
+            inside = row_position[column_index[entries]] >= 0
+            index += list(row_position[column_index[entries]][inside])
+            value += list(column_value[entries][inside])
+            start.append(len(index))
+
+        lp = highspy.HighsLp()
+        lp.num_col_ = len(columns)
+        lp.num_row_ = len(rows)
+        lp.col_cost_ = self.cost[columns]
+        lp.col_lower_ = self.lower[columns]
+        lp.col_upper_ = np.where(np.isinf(self.upper[columns]), highspy.kHighsInf, self.upper[columns])
+        lp.row_lower_ = rhs
+        lp.row_upper_ = rhs
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        lp.a_matrix_.start_ = np.array(start, dtype=np.int32)
+        lp.a_matrix_.index_ = np.array(index, dtype=np.int32)
+        lp.a_matrix_.value_ = np.array(value, dtype=float)
+
+        highs = highspy.Highs()
+        highs.setOptionValue('output_flag', False)
+        highs.passModel(lp)
+        highs.run()
+        status = highs.getModelStatus()
+        if status != highspy.HighsModelStatus.kOptimal:
+            raise ValueError(f"The direct LP is not optimal: {highs.modelStatusToString(status)}")
+        return highs.getSolution()
+
+    def results(self, solution):
+        """Flow results of a solution in the form of oemof.solph.processing.results()"""
+        import pandas as pd
+
+        index = self.energy_system.timeindex
+        results = {}
+        for n, (key, _) in enumerate(self.flows):
+            values = list(solution['values'][n * self.timesteps:(n + 1) * self.timesteps])
+            sequences = pd.DataFrame({'flow': values + [math.nan] * (len(index) - self.timesteps)}, index=index)
+            sequences.columns.name = 'variable_name'
+            results[key] = {'sequences': sequences, 'scalars': pd.Series(dtype=float)}
+        return results
+
+    def sensitivity(self, solution):
+        """Shadow prices and reduced costs of a solution, see oemof_runner.extract_sensitivity()"""
+        shadow_prices = {}
+        for (bus, _), dual in zip(self.balances, solution['duals']):
+            shadow_prices.setdefault(str(bus), []).append(float(dual))
+
+        reduced_costs = {}
+        for n, ((i, o), _) in enumerate(self.flows):
+            if str(i).startswith('Src_'):
+                for c in range(n * self.timesteps, (n + 1) * self.timesteps):
+                    reduced_costs.setdefault(f"{i} -> {o}", []).append(
+                        None if self.fixed[c] else float(solution['reduced_costs'][c]))
+
+        return {
+            "shadow_prices": dict(sorted(shadow_prices.items())),
+            "reduced_costs": dict(sorted(reduced_costs.items())),
+        }
+
+
+def _csc(rows, columns, values, n):
+    # column-wise sparse matrix of (row, column, value) entries: (start, index, value) as HiGHS takes it
+    order = np.lexsort((rows, columns))
+    start = np.zeros(n + 1, dtype=np.int32)
+    np.cumsum(np.bincount(columns, minlength=n), out=start[1:])
+    return start, rows[order], values[order]
+
+
+def objective(energy_system, flows) -> float:
+    """
+    Objective (total variable costs) of flow values, as solph's objective
+
+    Args:
+        flows: '<from> -> <to>': values per time step, e.g. result['time_series']['flows']
+    """
+    total = 0.0
+    for (i, o), flow in energy_system.flows().items():
+        for t, value in enumerate(flows.get(f"{i} -> {o}", [])):
+            total += flow.variable_costs[t] * energy_system.timeincrement[t] * value
+    return total
+
+
+def compare(expected, actual, tolerance=TOLERANCE) -> list:
+    """
+    Differences between two results of run_oemof_scenario() (e.g. of the oemof and the direct engine)
+
+    Numbers are compared relative to their magnitude, the solver names and the scenario are ignored.
+
+    Returns:
+        list: 'path: expected != actual' per difference, empty if the results agree
+    """
+    differences = []
+
+    def walk(path, a, b):
+        if isinstance(a, dict) and isinstance(b, dict):
+            for key in sorted(set(a) | set(b), key=str):
+                walk(f"{path}.{key}" if path else str(key), a.get(key), b.get(key))
+        elif isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)) and len(a) == len(b):
+            for k, (x, y) in enumerate(zip(a, b)):
+                walk(f"{path}[{k}]", x, y)
+        elif isinstance(a, (int, float)) and isinstance(b, (int, float)) and \
+                not isinstance(a, bool) and not isinstance(b, bool):
+            if not math.isclose(a, b, rel_tol=tolerance, abs_tol=tolerance):
+                differences.append(f"{path}: {a!r} != {b!r}")
+        elif a != b:
+            differences.append(f"{path}: {a!r} != {b!r}")
+
+    walk('', {key: value for key, value in expected.items() if key not in ('solver', 'scenario', 'fingerprint')},
+         {key: value for key, value in actual.items() if key not in ('solver', 'scenario', 'fingerprint')})
+    return differences
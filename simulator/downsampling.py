@@ -0,0 +1,162 @@
+"""
+Server side downsampling of result time series for the charts in results.html
+
+Flow series are reduced with largest-triangle-three-buckets (LTTB), which keeps the visual shape of the
+curve. Every downsampled series additionally carries a min/max envelope per bucket, so peaks that LTTB
+drops are still visible as a band around the line. Storage levels use the same routine.
+"""
+
+import bisect
+
+import numpy as np
+
+DEFAULT_CHART_WIDTH = 1200   # px, used if the browser does not tell us its chart width
+MIN_POINTS = 50              # never reduce below this number of points
+MAX_POINTS = 4000            # never ship more than this number of points per series
+POINTS_PER_PIXEL = 1         # one point per horizontal pixel is the visual limit of a line chart
+
+
+def target_points(width) -> int:
+    """
+    Number of points a chart of the given width (in px) can display
+
+    Args:
+        width: chart width in pixels (int or numeric string), None for default width
+    """
+    try:
+        width = int(width)
+    except (TypeError, ValueError):
+        width = DEFAULT_CHART_WIDTH
+    return max(MIN_POINTS, min(MAX_POINTS, width * POINTS_PER_PIXEL))
+
+
+def lttb_indices(y, threshold: int) -> np.ndarray:
+    """
+    Indices of the points selected by the largest-triangle-three-buckets algorithm
+
+    The x values are taken as equidistant (index position), which holds for the oemof time index.
+    The first and the last point are always kept.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=float)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    # bucket edges for the n-2 inner points, split into threshold-2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        # average point of the next bucket (or the last point for the last bucket):
+        if i + 2 < len(edges):
+            next_start, next_stop = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_stop = n - 1, n
+        avg_x = x[next_start:next_stop].mean()
+        avg_y = y[next_start:next_stop].mean()
+
+        # triangle area between selected point a, candidate points and next average
+        areas = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def min_max_envelope(y, buckets: int):
+    """
+    Minimum and maximum of y for each of the given number of equally sized buckets
+
+    Returns:
+        tuple: (bucket start indices, minima, maxima) as numpy arrays
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if buckets >= n:
+        idx = np.arange(n)
+        return idx, y.copy(), y.copy()
+
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    starts = edges[:-1]
+    minima = np.minimum.reduceat(y, starts)
+    maxima = np.maximum.reduceat(y, starts)
+    return starts, minima, maxima
+
+
+def downsample_series(index, values, width=None, start=None, end=None) -> dict:
+    """
+    Downsample one time series for a chart of the given width
+
+    Args:
+        index: list of time stamps (ISO strings) of the full series
+        values: list of values of the full series
+        width: chart width in px, determines the number of points shipped
+        start: optional first time stamp (inclusive) of the requested range (zoom)
+        end: optional last time stamp (inclusive) of the requested range (zoom)
+
+    Returns:
+        dict: JSON serializable payload with x, y and the min/max envelope
+    """
+    index = list(index)
+    values = np.asarray(values, dtype=float)
+
+    # restrict to requested range, ISO time stamps compare lexicographically:
+    start = str(start).replace(' ', 'T') if start else None
+    end = str(end).replace(' ', 'T') if end else None
+    lo = bisect.bisect_left(index, start) if start else 0
+    hi = bisect.bisect_right(index, end) if end else len(index)
+    index = index[lo:hi]
+    values = values[lo:hi]
+
+    points = target_points(width)
+    full_resolution = len(values) <= points
+    if full_resolution:
+        return {
+            "x": index,
+            "y": values.tolist(),
+            "envelope_x": index,
+            "min": values.tolist(),
+            "max": values.tolist(),
+            "points": len(values),
+            "total_points": len(values),
+            "full_resolution": True,
+        }
+
+    selected = lttb_indices(values, points)
+    starts, minima, maxima = min_max_envelope(values, points)
+    return {
+        "x": [index[i] for i in selected],
+        "y": values[selected].tolist(),
+        "envelope_x": [index[i] for i in starts],
+        "min": minima.tolist(),
+        "max": maxima.tolist(),
+        "points": len(selected),
+        "total_points": len(values),
+        "full_resolution": False,
+    }
+
+
+def downsample_time_series(time_series: dict, width=None, start=None, end=None, names=None) -> dict:
+    """
+    Downsample all flow and storage level series of a result's 'time_series' entry
+
+    Args:
+        time_series: dict with 'index', 'flows' and 'storage' as returned by run_oemof_scenario
+        names: optional list of series names to restrict the payload to
+    """
+    payload = {"flows": {}, "storage": {}}
+    if not time_series:
+        return payload
+
+    index = time_series.get("index", [])
+    for group in ("flows", "storage"):
+        for name, values in time_series.get(group, {}).items():
+            if names and name not in names:
+                continue
+            payload[group][name] = downsample_series(index, values, width, start, end)
+    return payload
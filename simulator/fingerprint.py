@@ -0,0 +1,69 @@
+"""
+Canonical fingerprint of a built scenario
+
+Different workbook versions and sheets often describe the same network. The fingerprint is computed from
+what the solve actually sees: the nodes of the energy system, every flow with its numeric parameters,
+the conversion factors of the transformers, the source and sink values of the energy balance before the
+optimization and the time index, together with the solver and the code version. Everything is sorted
+and numbers are written in their shortest exact form, so the order of the rows, whitespace in cells and
+rows which do not become part of the model do not change it. Runs with the same fingerprint have the same
+results (apart from the scenario they were solved from), see run_store.run_with_fingerprint().
+"""
+
+import hashlib
+import json
+
+FLOW_PARAMETERS = ['fix', 'min', 'max', 'variable_costs']   # sequences of a flow set by ExcelModelFactory
+
+
+def _number(value):
+    return None if value is None else repr(float(value))
+
+
+def network(energy_system, value_collection) -> dict:
+    """
+    Canonical description of a built energy system
+
+    Args:
+        energy_system: solph energy system as built by ExcelModelFactory
+        value_collection: values the energy system was built from
+
+    Returns:
+        dict: JSON serializable, lists in canonical order
+    """
+    timesteps = range(len(energy_system.timeincrement))   # the TIMESTEPS of its model
+    canonical = lambda entries: sorted(entries, key=json.dumps)
+
+    nodes = canonical([type(node).__name__, str(node.label)] for node in energy_system.nodes)
+    flows = canonical(
+        [str(i.label), str(o.label), _number(flow.nominal_value)] +
+        [[_number(getattr(flow, name)[t]) for t in timesteps] for name in FLOW_PARAMETERS]
+        for (i, o), flow in energy_system.flows().items())
+    conversions = canonical(
+        [str(node.label), str(bus.label), [_number(factor[t]) for t in timesteps]]
+        for node in energy_system.nodes for bus, factor in getattr(node, 'conversion_factors', {}).items())
+    values = canonical([vid, _number(value.value)] for vid, value in value_collection.values.items()
+                       if vid.startswith(('Src_', 'Snk_')))   # the totals before the optimization
+    return {
+        'timeindex': [str(t) for t in energy_system.timeindex],
+        'nodes': nodes,
+        'flows': flows,
+        'conversions': conversions,
+        'values': values,
+    }
+
+
+def fingerprint(energy_system, value_collection, solver) -> str:
+    """
+    Fingerprint of a built energy system, see network()
+
+    Args:
+        solver: name of the solver the model is solved with (see oemof_runner.solver_name())
+
+    Returns:
+        str: 32 hex digits
+    """
+    from .run_store import code_version
+
+    content = {'network': network(energy_system, value_collection), 'solver': solver, 'code': code_version()}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, separators=(',', ':')).encode()).hexdigest()[:32]
@@ -0,0 +1,430 @@
+"""
+Asynchronous solve jobs
+
+Jobs are queued in a SQLite database (settings.SIMULATOR_JOB_DB), so every gunicorn worker and every
+solve worker process sees the same queue. Submitting a job inserts a row and wakes up the pre-warmed
+worker pool of the web process (settings.SIMULATOR_JOB_WORKERS processes, see worker_pool.py). A worker
+claims the oldest queued job, solves it and stores the result in the run store. Alternatively the web
+processes only enqueue (SIMULATOR_JOB_WORKERS = 0) and 'manage.py solve_worker' executes the jobs.
+"""
+
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+EVENT_RETENTION = 24 * 3600   # seconds the progress events of a job are kept
+EVENT_FLUSH_INTERVAL = 0.5    # seconds further events of the same phase are buffered at most
+EVENT_BATCH = 100             # buffered events written at once at the latest
+
+_schemas = set()   # job databases whose tables exist, created once per process
+_schemas_lock = threading.Lock()
+_event_buffers = {}   # job id -> {'events': unwritten events, 'phase': of the last event, 'written': time}
+_event_buffers_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    """The job queue is at its limit (see admission.py), retry after retry_after seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many queued solves, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+def job_db() -> str:
+    return str(getattr(settings, 'SIMULATOR_JOB_DB', os.path.join(settings.SIMULATOR_RUN_DIR, 'jobs.sqlite3')))
+
+
+def _connect():
+    path = job_db()
+    con = sqlite3.connect(path, timeout=30, isolation_level=None) if path in _schemas else _create(path)
+    con.row_factory = sqlite3.Row
+    return con
+
+
+def _create(path):
+    # connection to a job database whose tables are created first
+    with _schemas_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        con = sqlite3.connect(path, timeout=30, isolation_level=None)   # autocommit, explicit transactions
+        con.execute('PRAGMA journal_mode=WAL')   # readers (status polling) do not block the workers, persistent
+        con.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                           id TEXT PRIMARY KEY,
+                           status TEXT NOT NULL,
+                           params TEXT NOT NULL,
+                           run_id TEXT NOT NULL,
+                           error TEXT,
+                           created REAL NOT NULL,
+                           started REAL,
+                           finished REAL)''')
+        con.execute('CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created)')
+        con.execute('CREATE INDEX IF NOT EXISTS jobs_run_id ON jobs (run_id)')
+        con.execute('''CREATE TABLE IF NOT EXISTS job_events (
+                           seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                           job_id TEXT NOT NULL,
+                           phase TEXT NOT NULL,
+                           message TEXT NOT NULL,
+                           created REAL NOT NULL)''')
+        con.execute('CREATE INDEX IF NOT EXISTS job_events_job_id ON job_events (job_id, seq)')
+        con.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        _schemas.add(path)
+    return con
+
+
+def submit_job(params: dict) -> str:
+    """
+    Enqueue a solve of the scenario described by params
+
+    Args:
+        params: dict with 'workbook', 'sheet' and optional 'region' (label only) and 'overrides' (value id -> value)
+
+    Returns:
+        str: job id; if the run is already stored the job is created as done, if the same scenario is
+            already queued or running, the id of that job is returned
+
+    Raises:
+        QueueFull: settings.SIMULATOR_JOB_QUEUE_LIMIT jobs are queued already
+    """
+    from .admission import queue_limit
+    from .oemof_runner import solver_name
+    from .run_store import make_run_id, run_exists
+
+    run_id = make_run_id(params['workbook'], params['sheet'], solver_name(), params.get('overrides'))
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    status = DONE if run_exists(run_id) else QUEUED
+
+    con = _connect()
+    try:
+        con.execute('BEGIN IMMEDIATE')
+        _expire(con, now)   # stuck jobs neither coalesce nor count against the limit
+        # coalesce identical submissions: all callers wait for the same job
+        row = con.execute('SELECT id FROM jobs WHERE run_id = ? AND status IN (?, ?) ORDER BY created LIMIT 1',
+                          (run_id, QUEUED, RUNNING)).fetchone() if status == QUEUED else None
+        if row is not None:
+            job_id = row['id']
+            status = RUNNING   # already woken up a worker
+        elif status == QUEUED and queue_limit() and _queued(con) >= queue_limit():
+            _count(con, 'rejected')   # shed load: fail fast instead of queueing without bound
+            status = None
+            retry_after = _retry_after(con)
+        else:
+            if status == QUEUED:
+                _count(con, 'admitted')
+            con.execute('INSERT INTO jobs (id, status, params, run_id, created, finished) VALUES (?, ?, ?, ?, ?, ?)',
+                        (job_id, status, json.dumps(params), run_id, now, now if status == DONE else None))
+        con.execute('COMMIT')
+    except Exception:
+        con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
+
+    if status is None:
+        raise QueueFull(retry_after)
+    if status == QUEUED:
+        _wake_worker()
+    return job_id
+
+
+def admit():
+    """
+    Admission of a synchronous solve (what-if), which does not queue but is shed like a submitted job
+
+    Raises:
+        QueueFull: settings.SIMULATOR_JOB_QUEUE_LIMIT jobs are queued already
+    """
+    from .admission import queue_limit
+
+    if not queue_limit():
+        return
+    con = _connect()
+    try:
+        full = _queued(con) >= queue_limit()
+    finally:
+        con.close()
+    if full:
+        raise reject()
+
+
+def reject() -> QueueFull:
+    """Count a rejected solve, returns the QueueFull to raise"""
+    con = _connect()
+    try:
+        _count(con, 'rejected')
+        retry_after = _retry_after(con)
+    finally:
+        con.close()
+    return QueueFull(retry_after)
+
+
+def get_job(job_id):
+    """
+    Returns:
+        dict: job row (id, status, params, run_id, error, created, started, finished) or None
+    """
+    con = _connect()
+    try:
+        row = con.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    finally:
+        con.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    return job
+
+
+def queue_position(job_id) -> int:
+    """Number of queued jobs ahead of the given job"""
+    con = _connect()
+    try:
+        row = con.execute('''SELECT COUNT(*) FROM jobs WHERE status = ? AND created <
+                                 (SELECT created FROM jobs WHERE id = ?)''', (QUEUED, job_id)).fetchone()
+    finally:
+        con.close()
+    return row[0]
+
+
+def claim_next_job():
+    """
+    Atomically take the oldest queued job and mark it running, expired jobs are failed first (see expire_jobs())
+
+    Returns:
+        dict: claimed job or None if the queue is empty
+    """
+    now = time.time()
+    con = _connect()
+    try:
+        con.execute('BEGIN IMMEDIATE')   # write lock: only one process claims at a time
+        _expire(con, now)
+        row = con.execute('SELECT * FROM jobs WHERE status = ? ORDER BY created LIMIT 1', (QUEUED,)).fetchone()
+        if row is not None:
+            con.execute('UPDATE jobs SET status = ?, started = ? WHERE id = ?', (RUNNING, now, row['id']))
+        con.execute('COMMIT')
+    except Exception:
+        con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
+
+    if row is None:
+        return None
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    job['status'] = RUNNING
+    return job
+
+
+def expire_jobs() -> int:
+    """
+    Mark jobs running longer than settings.SIMULATOR_JOB_TIMEOUT (worker died) and jobs queued longer than
+    settings.SIMULATOR_JOB_QUEUE_DEADLINE (nobody waits for them anymore) failed
+
+    Called by the worker pool's supervisor, so jobs expire while every worker is busy, too.
+
+    Returns:
+        int: number of expired jobs
+    """
+    con = _connect()
+    try:
+        con.execute('BEGIN IMMEDIATE')
+        expired = _expire(con, time.time())
+        con.execute('COMMIT')
+    except Exception:
+        con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
+    return expired
+
+
+def _expire(con, now) -> int:
+    # expire_jobs() within a transaction of con
+    from .admission import queue_deadline
+
+    timeout = getattr(settings, 'SIMULATOR_JOB_TIMEOUT', 600)
+    expired = con.execute('UPDATE jobs SET status = ?, error = ?, finished = ? WHERE status = ? AND started < ?',
+                          (FAILED, 'Solve timed out or worker died', now, RUNNING, now - timeout)).rowcount
+    if queue_deadline():
+        late = [row['id'] for row in con.execute('SELECT id FROM jobs WHERE status = ? AND created < ?',
+                                                  (QUEUED, now - queue_deadline()))]
+        for job_id in late:
+            error = 'Waited too long in the queue, please retry'
+            con.execute('UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?',
+                        (FAILED, error, now, job_id))
+            con.execute('INSERT INTO job_events (job_id, phase, message, created) VALUES (?, ?, ?, ?)',
+                        (job_id, FAILED, error, now))
+        if late:
+            _count(con, 'expired', len(late))
+        expired += len(late)
+    return expired
+
+
+def _count(con, name, increment=1):
+    con.execute('''INSERT INTO counters (name, value) VALUES (?, ?)
+                   ON CONFLICT(name) DO UPDATE SET value = value + excluded.value''', (name, increment))
+
+
+def _queued(con) -> int:
+    return con.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (QUEUED,)).fetchone()[0]
+
+
+def _retry_after(con) -> int:
+    # time to work off the queue: recent mean solve time * queued jobs / solves in parallel
+    from .admission import max_solves_per_host
+
+    mean = con.execute('''SELECT AVG(finished - started) FROM (SELECT finished, started FROM jobs
+                             WHERE status = ? AND started IS NOT NULL ORDER BY finished DESC LIMIT 20)''',
+                       (DONE,)).fetchone()[0] or 5.0
+    return max(1, int(mean * (_queued(con) + 1) / max_solves_per_host() + 0.5))
+
+
+def admission_stats() -> dict:
+    """Queue depth, running jobs and admission counters (admitted, rejected, expired)"""
+    con = _connect()
+    try:
+        counters = dict(con.execute('SELECT name, value FROM counters').fetchall())
+        running = con.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (RUNNING,)).fetchone()[0]
+        oldest = con.execute('SELECT MIN(created) FROM jobs WHERE status = ?', (QUEUED,)).fetchone()[0]
+        queued = _queued(con)
+    finally:
+        con.close()
+    return {
+        "queued": queued,
+        "running": running,
+        "oldest_queued_seconds": time.time() - oldest if oldest is not None else 0,
+        "admitted": counters.get('admitted', 0),
+        "rejected": counters.get('rejected', 0),
+        "expired": counters.get('expired', 0),
+    }
+
+
+def finish_job(job_id, error=None):
+    now = time.time()
+    with _event_buffers_lock:
+        events = _event_buffers.pop(job_id, {'events': []})['events']
+    con = _connect()
+    try:
+        con.execute('BEGIN IMMEDIATE')
+        _write_events(con, events)
+        con.execute('UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?',
+                    (FAILED if error else DONE, error, now, job_id))
+        con.execute('INSERT INTO job_events (job_id, phase, message, created) VALUES (?, ?, ?, ?)',
+                    (job_id, FAILED if error else DONE, error or '', now))
+        con.execute('DELETE FROM job_events WHERE created < ?', (now - EVENT_RETENTION,))
+        con.execute('COMMIT')
+    except Exception:
+        con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
+
+
+def record_event(job_id, phase, message=''):
+    """
+    Progress of a running job (phase and e.g. a line of the solver output), streamed by progress.py
+
+    The first event of a phase is written at once, further events of the same phase (the lines of the solver
+    log) are buffered and written together: once EVENT_FLUSH_INTERVAL seconds have passed since the last
+    write or EVENT_BATCH events are buffered, with the next phase and when the job finishes.
+    """
+    now = time.time()
+    with _event_buffers_lock:
+        buffer = _event_buffers.setdefault(job_id, {'events': [], 'phase': None, 'written': now})
+        buffer['events'].append((job_id, phase, message, now))
+        if phase == buffer['phase'] and len(buffer['events']) < EVENT_BATCH and \
+                now - buffer['written'] < EVENT_FLUSH_INTERVAL:
+            return
+        buffer['phase'] = phase
+        buffer['written'] = now
+        con = _connect()
+        try:
+            _write_events(con, buffer['events'])
+        finally:
+            con.close()
+        buffer['events'] = []
+
+
+def _write_events(con, events):
+    if events:
+        con.executemany('INSERT INTO job_events (job_id, phase, message, created) VALUES (?, ?, ?, ?)', events)
+
+
+def events_since(seq, job_ids=None):
+    """
+    Progress events after the event number seq, of the given jobs or of all jobs
+
+    Returns:
+        list: dicts with seq, job_id, phase and message, oldest first
+    """
+    query = 'SELECT seq, job_id, phase, message FROM job_events WHERE seq > ?'
+    args = [seq]
+    if job_ids is not None:
+        job_ids = list(job_ids)
+        query += f" AND job_id IN ({', '.join('?' * len(job_ids))})"
+        args += job_ids
+    con = _connect()
+    try:
+        rows = con.execute(query + ' ORDER BY seq', args).fetchall()
+    finally:
+        con.close()
+    return [dict(row) for row in rows]
+
+
+def execute_job(job):
+    """
+    Solve the scenario of a claimed job, its result is stored in the run store by the result cache
+    """
+    from .result_cache import cached_run_oemof_scenario
+    from .run_store import run_exists
+
+    try:
+        if not run_exists(job['run_id']):   # another job may have solved the same scenario meanwhile
+            params = job['params']
+            cached_run_oemof_scenario(params['workbook'], params['sheet'], params.get('overrides'),
+                                      functools.partial(record_event, job['id']))
+    except Exception as e:
+        finish_job(job['id'], error=str(e) or e.__class__.__name__)
+        return False
+    finish_job(job['id'])
+    return True
+
+
+def work_off_queue() -> int:
+    """
+    Execute queued jobs until the queue is empty
+
+    Returns:
+        int: number of jobs executed
+    """
+    count = 0
+    job = claim_next_job()
+    while job is not None:
+        execute_job(job)
+        count += 1
+        job = claim_next_job()
+    return count
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def _wake_worker():
+    from .worker_pool import get_pool
+
+    pool = get_pool()
+    if pool is not None:   # otherwise the jobs are executed by 'manage.py solve_worker'
+        pool.notify()
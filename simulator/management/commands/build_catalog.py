@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from simulator.scenario_catalog import prebuild
+
+
+class Command(BaseCommand):
+    help = 'Solve and store the results of all regions of the scenario catalog which are not stored yet'
+
+    def handle(self, *args, **options):
+        for region, run_id, solved in prebuild():
+            self.stdout.write(f'{region}: {run_id} ({"solved" if solved else "stored"})')
@@ -0,0 +1,54 @@
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# what a web process imports until it can serve the home page: ASGI application of the Procfile and URLconf (views)
+STARTUP_CODE = 'import config.asgi; from django.urls import get_resolver; get_resolver().url_patterns'
+
+# the optimization stack, must only be imported when a scenario is solved
+HEAVY_MODULES = ('numpy', 'pandas', 'oemof', 'pyomo', 'sympy', 'openpyxl', 'highspy')
+
+
+def parse_importtime(report):
+    """
+    Parse the stderr output of 'python -X importtime'
+
+    Returns:
+        list: (module, self microseconds, cumulative microseconds) in import order
+    """
+    imports = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        timing, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((module.strip(), int(timing), int(cumulative)))
+    return imports
+
+
+class Command(BaseCommand):
+    help = 'Measure the import time of the web startup (config.asgi and URLconf) and fail above a budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget-ms', type=float, default=getattr(settings, 'SIMULATOR_IMPORT_BUDGET_MS', 800),
+                            help='maximum total import time in milliseconds')
+        parser.add_argument('--top', type=int, default=15, help='number of slowest imports to report')
+
+    def handle(self, *args, **options):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_CODE],
+                                 cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if process.returncode != 0:
+            raise CommandError(f'Startup failed:\n{process.stderr[-2000:]}')
+
+        imports = parse_importtime(process.stderr)
+        total_ms = sum(timing for _, timing, _ in imports) / 1000
+        self.stdout.write(f'{len(imports)} modules imported in {total_ms:.0f} ms (budget {options["budget_ms"]:.0f} ms)')
+        for module, _, cumulative in sorted(imports, key=lambda i: -i[2])[:options['top']]:
+            self.stdout.write(f'{cumulative / 1000:8.1f} ms  {module}')
+
+        heavy = sorted({module for module, _, _ in imports if module.split('.')[0] in HEAVY_MODULES})
+        if heavy:
+            raise CommandError(f'Optimization stack imported at startup: {", ".join(heavy[:10])}')
+        if total_ms > options['budget_ms']:
+            raise CommandError(f'Import time {total_ms:.0f} ms exceeds the budget of {options["budget_ms"]:.0f} ms')
@@ -0,0 +1,79 @@
+import json
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simulator.monte_carlo import parse_distribution, run_monte_carlo
+from simulator.run_store import to_json
+from simulator.scenario_catalog import regions, scenario_for, DEFAULT_REGION
+
+REPORT_INTERVAL = 5.0   # seconds between progress lines
+SHOWN_METRICS = ['summary.overall_efficiency', 'summary.loss_percentage', 'summary.total_calculated_losses',
+                 'summary.final_useful_demand']
+
+
+class Command(BaseCommand):
+    help = 'Sample uncertain inputs of a scenario, solve every sample and summarize the loss breakdown'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dist', action='append', required=True, metavar='NAME=KIND:P1:P2[:P3]',
+                            help='distribution of a simple value: uniform:LOW:HIGH, normal:MEAN:STD, '
+                                 'triangular:LOW:MODE:HIGH or lognormal:MU:SIGMA; repeat for more values')
+        parser.add_argument('--samples', type=int, default=1000, help='number of samples')
+        parser.add_argument('--method', choices=['lhs', 'random'], default='lhs',
+                            help='Latin hypercube (default) or plain random sampling')
+        parser.add_argument('--seed', type=int, default=None, help='seed of the random numbers')
+        parser.add_argument('--region', default=DEFAULT_REGION, help='region of the scenario catalog')
+        parser.add_argument('--workbook', help='workbook instead of the one of the region (requires --sheet)')
+        parser.add_argument('--sheet', help='sheet of --workbook')
+        parser.add_argument('--processes', type=int, default=None, help='solve processes (default: CPUs)')
+        parser.add_argument('--output', help='JSON file receiving the complete summary')
+
+    def handle(self, *args, **options):
+        try:
+            distributions = [parse_distribution(spec) for spec in options['dist']]
+        except ValueError as e:
+            raise CommandError(e)
+        if options['workbook']:
+            if not options['sheet']:
+                raise CommandError('--workbook requires --sheet')
+            workbook, sheet = options['workbook'], options['sheet']
+        elif options['region'] in regions():
+            scenario = scenario_for(options['region'])
+            workbook, sheet = scenario['workbook'], scenario['sheet']
+        else:
+            raise CommandError(f"Unknown region: {options['region']}")
+
+        log_level = logging.INFO if options['verbosity'] > 1 else logging.WARNING
+        summary = None
+        started = last_report = time.monotonic()
+        try:
+            for summary, done in run_monte_carlo(workbook, sheet, distributions, options['samples'],
+                                                 options['method'], options['seed'], options['processes'],
+                                                 log_level=log_level, report_interval=REPORT_INTERVAL):
+                now = time.monotonic()
+                if now - last_report >= REPORT_INTERVAL or done == options['samples']:
+                    self.stdout.write(f"{done}/{options['samples']} samples, {summary['failed']} failed, "
+                                      f"{done / (now - started):.1f} samples/s")
+                    last_report = now
+        except ValueError as e:
+            raise CommandError(e)
+        if summary is None:
+            return
+
+        for name in ['sources_before', 'sinks_before']:
+            self._write_summary(name, summary['inputs'][name])
+        for name in SHOWN_METRICS:
+            if name in summary['metrics']:
+                self._write_summary(name, summary['metrics'][name])
+        for error in summary['errors']:
+            self.stderr.write(f'Failed sample: {error}')
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(summary, f, default=to_json, indent=1)
+            self.stdout.write(f"Summary of {len(summary['metrics'])} metrics written to {options['output']}")
+
+    def _write_summary(self, name, stats):
+        quantiles = '  '.join(f'p{float(p) * 100:g}={value:.6g}' for p, value in stats['quantiles'].items())
+        self.stdout.write(f"{name}: mean={stats['mean']:.6g} std={stats['std']:.6g}  {quantiles}")
@@ -0,0 +1,64 @@
+import csv
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from simulator.batch import SUMMARY_COLUMNS, batch_tasks, run_batch
+from simulator.scenario_catalog import DATA_DIR
+
+
+class Command(BaseCommand):
+    help = ('Solve and store every scenario sheet of the given workbooks in parallel processes and print a '
+            'summary table; scenarios which are stored already are not solved again')
+
+    def add_arguments(self, parser):
+        parser.add_argument('workbooks', nargs='*', default=[os.path.join(DATA_DIR, '*.xlsx')],
+                            metavar='WORKBOOK', help='workbook or glob pattern (default: all of simulator/data)')
+        parser.add_argument('--sheet', action='append', metavar='PATTERN',
+                            help='sheet name or pattern (e.g. "SimpleSzenario*"); repeat for several, default: all')
+        parser.add_argument('--jobs', type=int, default=0, help='scenarios solved at the same time (default: CPUs)')
+        parser.add_argument('--timeout', type=float, default=getattr(settings, 'SIMULATOR_JOB_TIMEOUT', 600),
+                            help='seconds after which a scenario is given up (0: no limit)')
+        parser.add_argument('--batch', type=int, default=1, metavar='N',
+                            help='scenarios solved together as one LP by a process (default: 1)')
+        parser.add_argument('--summary', metavar='CSV', help='also write the summary table to this CSV file')
+
+    def handle(self, *args, **options):
+        try:
+            tasks = batch_tasks(options['workbooks'], options['sheet'] or ['*'])
+        except ValueError as e:
+            raise CommandError(e)
+        if not tasks:
+            raise CommandError('No scenario sheets found')
+
+        started = time.monotonic()
+        rows = []
+        for row, done, total in run_batch(tasks, options['jobs'] or None, options['timeout'] or None,
+                                          options['batch']):
+            rows.append(row)
+            self.stdout.write(f"[{done}/{total}] {row['workbook']} {row['sheet']}: {row['status']} "
+                              f"({row['seconds']:.1f} s)")
+        rows.sort(key=lambda row: (row['workbook'], row['sheet']))
+
+        self.stdout.write('')
+        self.stdout.write(self.table(rows))
+        failed = sum(row['status'] in ('failed', 'timeout') for row in rows)
+        self.stdout.write(f'{len(rows)} scenario(s) in {time.monotonic() - started:.1f} s, {failed} failed')
+        if options['summary']:
+            with open(options['summary'], 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, SUMMARY_COLUMNS, restval='')
+                writer.writeheader()
+                writer.writerows(rows)
+
+    @staticmethod
+    def table(rows):
+        # aligned text table of the summary columns, numbers rounded
+        cell = lambda value: (f'{value:,.0f}' if isinstance(value, (int, float)) and not isinstance(value, bool)
+                              else '' if value is None else str(value))
+        columns = [column for column in SUMMARY_COLUMNS if column not in ('seconds', 'error')]
+        cells = [columns] + [[cell(row.get(column)) for column in columns] for row in rows]
+        widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+        return '\n'.join('  '.join(value.ljust(width) for value, width in zip(line, widths)).rstrip()
+                         for line in cells)
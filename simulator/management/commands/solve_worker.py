@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from simulator.jobs import work_off_queue
+from simulator.worker_pool import WorkerPool
+
+
+class Command(BaseCommand):
+    help = 'Execute queued solve jobs (use with SIMULATOR_JOB_WORKERS=0 in the web processes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='number of worker processes')
+        parser.add_argument('--poll', type=float, default=1.0, help='seconds between checks of an empty queue')
+        parser.add_argument('--max-tasks', type=int, default=getattr(settings, 'SIMULATOR_JOB_MAX_TASKS', 0),
+                            help='jobs after which a worker is replaced (0: never)')
+        parser.add_argument('--max-memory', type=int, default=getattr(settings, 'SIMULATOR_JOB_MAX_MEMORY_MB', 0),
+                            help='resident memory in MB above which a worker is replaced (0: no limit)')
+        parser.add_argument('--once', action='store_true', help='work off the queue once and exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            count = work_off_queue()
+            self.stdout.write(f'{count} job(s) executed')
+            return
+
+        pool = WorkerPool(options['processes'], options['poll'], options['max_tasks'], options['max_memory'])
+        pool.supervise()
+        self.stdout.write(f'{pool.size} solve worker(s) started')
+        pool.run_forever()
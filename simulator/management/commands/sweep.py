@@ -0,0 +1,61 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from simulator.scenario_catalog import regions, scenario_for, DEFAULT_REGION
+from simulator.sweep import columnar_path, parse_parameter, run_sweep
+
+REPORT_INTERVAL = 5.0   # seconds between progress lines
+
+
+class Command(BaseCommand):
+    help = ('Solve a scenario for a grid of parameter values and write one CSV row per point and a .npz file '
+            'with a column per value; an existing output file is continued, failed points are solved again')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='CSV file with the results, continued if it exists')
+        parser.add_argument('--param', action='append', required=True, metavar='NAME=VALUES',
+                            help='sweep parameter, NAME=START:STOP:COUNT or NAME=V1,V2,...; repeat for a grid')
+        parser.add_argument('--region', default=DEFAULT_REGION, help='region of the scenario catalog')
+        parser.add_argument('--workbook', help='workbook instead of the one of the region (requires --sheet)')
+        parser.add_argument('--sheet', help='sheet of --workbook')
+        parser.add_argument('--processes', type=int, default=None, help='solve processes (default: CPUs)')
+        parser.add_argument('--batch', type=int, default=1, metavar='N',
+                            help='points solved together as one LP (default: 1, every point on its own)')
+
+    def handle(self, *args, **options):
+        try:
+            parameters = [parse_parameter(spec) for spec in options['param']]
+        except ValueError as e:
+            raise CommandError(e)
+        if options['workbook']:
+            if not options['sheet']:
+                raise CommandError('--workbook requires --sheet')
+            workbook, sheet = options['workbook'], options['sheet']
+        elif options['region'] in regions():
+            scenario = scenario_for(options['region'])
+            workbook, sheet = scenario['workbook'], scenario['sheet']
+        else:
+            raise CommandError(f"Unknown region: {options['region']}")
+
+        log_level = logging.INFO if options['verbosity'] > 1 else logging.WARNING
+        failed = 0
+        started = last_report = time.monotonic()
+        first_done = None
+        try:
+            for row, done, total in run_sweep(workbook, sheet, parameters, options['output'],
+                                              options['processes'], log_level, options['batch']):
+                if first_done is None:
+                    first_done = done - 1
+                failed += row['status'] != 'ok'
+                now = time.monotonic()
+                if now - last_report >= REPORT_INTERVAL or done == total:
+                    rate = (done - first_done) / (now - started)
+                    self.stdout.write(f'{done}/{total} points, {failed} failed, {rate:.1f} points/s')
+                    last_report = now
+        except ValueError as e:
+            raise CommandError(e)
+        if first_done is None:
+            self.stdout.write('All points are solved already')
+        self.stdout.write(f"Columns of all points written to {columnar_path(options['output'])}")
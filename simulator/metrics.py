@@ -0,0 +1,311 @@
+"""
+Metrics of the simulation pipeline in the Prometheus text format
+
+Web and solve worker processes record into one SQLite database (settings.SIMULATOR_METRICS_DB), so the
+/metrics endpoint of any web process reports the whole host. Counters and histograms only, a histogram
+is stored as one counter per bucket plus _sum and _count and made cumulative when rendered.
+
+Samples are added up in memory and written every FLUSH_INTERVAL seconds by a timer thread of the process
+(and before rendering and at exit) through one connection per process, so recording a sample, e.g. the
+render time of every results page, does not write to the database.
+"""
+
+import atexit
+import bisect
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000, 300000, 1000000)
+FLUSH_INTERVAL = 5.0   # seconds samples are buffered in the process at most
+FLUSH_THREAD = 'simulator-metrics-flush'   # name of the timer threads writing the samples
+
+# name -> (type, help, upper bounds of the buckets of a histogram)
+METRICS = {
+    'simulator_phase_seconds': ('histogram', 'Duration of the phases of a simulation and of rendering results',
+                                SECONDS_BUCKETS),
+    'simulator_solves_total': ('counter', 'Solves by solver, status and termination condition', None),
+    'simulator_deduplicated_solves_total': ('counter', 'Solves skipped, a run of the same network was stored', None),
+    'simulator_engine_validations_total': ('counter', 'Direct LP results checked against oemof, by result', None),
+    'simulator_model_variables': ('histogram', 'Number of variables of the solved models', SIZE_BUCKETS),
+    'simulator_model_constraints': ('histogram', 'Number of constraints of the solved models', SIZE_BUCKETS),
+    'simulator_model_nonzeros': ('histogram', 'Number of nonzeros of the constraint matrix of the solved models',
+                                 SIZE_BUCKETS),
+}
+
+
+def metrics_db() -> str:
+    return str(getattr(settings, 'SIMULATOR_METRICS_DB', os.path.join(settings.SIMULATOR_RUN_DIR, 'metrics.sqlite3')))
+
+
+_pending = {}   # (name, labels, le) -> value to add, not written yet
+_flush_timer = None
+_connection = None   # (path, connection) of this process
+_forked_connections = []   # inherited from the parent: never used nor closed by the child
+_lock = threading.Lock()
+
+
+def _connect():
+    # connection of this process, the table is created when it is opened, call with _lock held
+    global _connection
+    path = metrics_db()
+    if _connection is None or _connection[0] != path:
+        if _connection is not None:
+            _connection[1].close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        con = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('''CREATE TABLE IF NOT EXISTS samples (
+                           name TEXT NOT NULL,
+                           labels TEXT NOT NULL,
+                           le TEXT NOT NULL,
+                           value REAL NOT NULL,
+                           PRIMARY KEY (name, labels, le))''')
+        _connection = (path, con)
+    return _connection[1]
+
+
+def _labels(labels: dict) -> str:
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items()))
+
+
+def _add(*samples):
+    # (name, labels, le, value) to add, together: a histogram is written with its _count
+    with _lock:
+        for name, labels, le, value in samples:
+            _pending[name, labels, le] = _pending.get((name, labels, le), 0) + value
+        if _flush_timer is None:
+            _schedule_flush()
+
+
+def _schedule_flush():
+    # call with _lock held
+    global _flush_timer
+    _flush_timer = threading.Timer(FLUSH_INTERVAL, flush)
+    _flush_timer.name = FLUSH_THREAD
+    _flush_timer.daemon = True
+    _flush_timer.start()
+
+
+def flush():
+    """Write the buffered samples of this process"""
+    global _flush_timer
+    with _lock:
+        if _flush_timer is not None:
+            _flush_timer.cancel()   # no-op when called by the timer itself
+            _flush_timer = None
+        if not _pending:
+            return
+        rows = [(name, labels, le, value) for (name, labels, le), value in _pending.items()]
+        try:
+            con = _connect()
+            con.execute('BEGIN')
+            con.executemany('''INSERT INTO samples (name, labels, le, value) VALUES (?, ?, ?, ?)
+                               ON CONFLICT(name, labels, le) DO UPDATE SET value = value + excluded.value''', rows)
+            con.execute('COMMIT')
+        except sqlite3.Error as e:   # e.g. locked for longer than the timeout: kept for the next flush
+            if _connection is not None and _connection[1].in_transaction:
+                _connection[1].execute('ROLLBACK')
+            logger.warning('metrics not written', extra={'error': e, 'samples': len(rows)})
+            _schedule_flush()
+            return
+        _pending.clear()
+
+
+def _forget_parent():
+    # in a forked child: the samples of the parent are written by the parent, its connection is not shared
+    global _flush_timer, _connection, _lock
+    _lock = threading.Lock()
+    _pending.clear()
+    _flush_timer = None
+    if _connection is not None:
+        _forked_connections.append(_connection)
+        _connection = None
+
+
+def flush_thread(thread) -> bool:
+    """
+    Whether thread is a timer writing the samples: forking while it runs is safe, the child forgets the
+    samples and the connection of the parent (see fork_guard())
+    """
+    return thread.name == FLUSH_THREAD
+
+
+@contextmanager
+def fork_guard():
+    """
+    Block to fork processes in: no flush of this process writes to the database meanwhile, so a child does not
+    inherit a connection in the middle of a write
+    """
+    with _lock:
+        yield
+
+
+atexit.register(flush)
+os.register_at_fork(after_in_child=_forget_parent)
+
+
+def inc(name, value=1, **labels):
+    """Increment a counter"""
+    _add((name, _labels(labels), '', value))
+
+
+def observe(name, value, **labels):
+    """Record a value of a histogram"""
+    buckets = METRICS[name][2]
+    index = bisect.bisect_left(buckets, value)
+    le = repr(float(buckets[index])) if index < len(buckets) else '+Inf'
+    label_text = _labels(labels)
+    _add((name + '_bucket', label_text, le, 1), (name + '_sum', label_text, '', value),
+         (name + '_count', label_text, '', 1))
+
+
+class PhaseTimer:
+    """
+    Times consecutive phases: start() ends the running phase, records its duration and logs it
+
+        phases = PhaseTimer(workbook=..., sheet=...)
+        phases.start('build_model')
+        ...
+        phases.start('solve')
+        ...
+        phases.stop()
+    """
+
+    def __init__(self, **context):
+        self.context = context   # logged with every phase, not a label (unbounded values)
+        self.phase = None
+        self.started = None
+        self.durations = {}
+
+    def start(self, phase):
+        self.stop()
+        self.phase = phase
+        self.started = time.perf_counter()
+
+    def stop(self):
+        if self.phase is None:
+            return
+        seconds = time.perf_counter() - self.started
+        self.durations[self.phase] = self.durations.get(self.phase, 0) + seconds
+        observe('simulator_phase_seconds', seconds, phase=self.phase)
+        logger.info('phase finished', extra=dict(self.context, phase=self.phase, seconds=round(seconds, 4)))
+        self.phase = None
+
+
+def model_size(model) -> dict:
+    """Number of variables, constraints and nonzeros of a pyomo model"""
+    from pyomo.core import Constraint
+    from pyomo.core.expr.visitor import identify_variables
+
+    constraints = list(model.component_data_objects(Constraint, active=True))
+    return {
+        'variables': model.nvariables(),
+        'constraints': len(constraints),
+        'nonzeros': sum(sum(1 for _ in identify_variables(c.body, include_fixed=False)) for c in constraints),
+    }
+
+
+def record_solve(model, solver):
+    """Model size and solver status of a solved solph model"""
+    size = model_size(model)
+    for key, value in size.items():
+        observe(f'simulator_model_{key}', value)
+    solver_info = model.solver_results['Solver'][0]
+    status, termination = str(solver_info['Status']), str(solver_info['Termination condition'])
+    inc('simulator_solves_total', solver=solver, status=status, termination=termination)
+    logger.info('model solved', extra=dict(size, solver=solver, status=status, termination=termination))
+
+
+def _format(name, labels, value):
+    return f'{name}{{{labels}}} {value:g}' if labels else f'{name} {value:g}'
+
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+    flush()
+    with _lock:
+        rows = _connect().execute('SELECT name, labels, le, value FROM samples ORDER BY name, labels').fetchall()
+
+    samples = {}
+    for name, labels, le, value in rows:
+        samples.setdefault(name, {}).setdefault(labels, {})[le] = value
+
+    lines = []
+    for name, (kind, help_text, bounds) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == 'counter':
+            for labels, values in samples.get(name, {}).items():
+                lines.append(_format(name, labels, values['']))
+            continue
+        for labels, buckets in samples.get(name + '_bucket', {}).items():
+            cumulative = 0
+            for le in [repr(float(bound)) for bound in bounds] + ['+Inf']:
+                cumulative += buckets.get(le, 0)
+                lines.append(_format(name + '_bucket', ','.join(filter(None, [labels, f'le="{le}"'])), cumulative))
+            lines.append(_format(name + '_sum', labels, samples[name + '_sum'][labels]['']))
+            lines.append(_format(name + '_count', labels, samples[name + '_count'][labels]['']))
+    return '\n'.join(lines + _cache_and_queue_lines()) + '\n'
+
+
+def _cache_and_queue_lines():
+    # result cache and job queue keep their own counters, exported here
+    from .jobs import admission_stats
+    from .result_cache import stats
+
+    cache = stats()
+    queue = admission_stats()
+    metrics = [
+        ('simulator_result_cache_requests_total', 'counter', 'Result cache lookups',
+         [('result="hit"', cache['hits']), ('result="miss"', cache['misses']), ('result="coalesced"', cache['coalesced'])]),
+        ('simulator_result_cache_evictions_total', 'counter', 'Entries evicted from the result cache',
+         [('', cache['evictions'])]),
+        ('simulator_result_cache_bytes', 'gauge', 'Size of the result cache', [('', cache['bytes'])]),
+        ('simulator_jobs', 'gauge', 'Jobs by state', [('state="queued"', queue['queued']),
+                                                      ('state="running"', queue['running'])]),
+        ('simulator_job_admissions_total', 'counter', 'Job submissions by outcome',
+         [('outcome="admitted"', queue['admitted']), ('outcome="rejected"', queue['rejected']),
+          ('outcome="expired"', queue['expired'])]),
+    ]
+    lines = []
+    for name, kind, help_text, values in metrics:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        lines += [_format(name, labels, value) for labels, value in values]
+    return lines
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    logfmt lines: time, level, logger, message and the extra fields of the record
+    """
+
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        fields = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields.update((key, value) for key, value in vars(record).items() if key not in self.RESERVED)
+        line = ' '.join(f'{key}={self._quote(value)}' for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+    @staticmethod
+    def _quote(value):
+        text = str(value)
+        if text == '' or any(c in text for c in ' ="'):
+            return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+        return text
@@ -1,5 +1,6 @@
 import re
 import abc
+import functools
 import pandas as pd
 import sys
 import os
@@ -12,6 +13,28 @@ from oemof.solph import Bus, Flow, Model, EnergySystem
 from oemof.solph.components import Source, Sink, Transformer
 
 
+def load_sheet(file_path, sheet_name):
+    """
+    Cell values of a workbook sheet, parsed once per file version and kept in memory
+
+    Returns:
+        tuple: (headings, rows), rows are tuples of cell values without the heading row
+    """
+    stat = os.stat(file_path)
+    return _read_sheet(os.path.abspath(file_path), sheet_name, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=32)
+def _read_sheet(file_path, sheet_name, mtime_ns, size):
+    # mtime and size are part of the cache key only: a changed workbook is parsed again
+    wb = load_workbook(filename=file_path, data_only=True, read_only=True)
+    try:
+        rows = tuple(wb[sheet_name].iter_rows(values_only=True))
+    finally:
+        wb.close()
+    return rows[0], rows[1:]
+
+
 class ModelFactory(abc.ABC):
 
     @property
@@ -256,31 +279,84 @@ class SimpleValueFactory1(ValueFactory):
 
 class ExcelModelFactory(ModelFactory, ValueFactory):
 
-    def __init__(self, file_path, sheet_name):
-        self.__wb = load_workbook(filename=file_path, data_only=True, read_only=True)
-        self.__sheet = self.__wb[sheet_name]
-
-        first_row = next(self.__sheet.iter_rows(min_row=1, max_row=1))  # get the first row
-        self.__headings = [c.value for c in first_row]  # extract the values from the cells
+    def __init__(self, file_path, sheet_name, overrides=None):
+        headings, self.__rows = load_sheet(file_path, sheet_name)  # cached, the workbook is parsed once
+        self.__headings = list(headings)
 
         self.__value_collection = ValueCollection(self)
+        self.__apply_overrides(overrides or {})
         self.__entities = {}
-        self.__model = self.__create_model()
+        self.__bindings = []   # (value id, 'flow', Flow) or (value id, 'conversion', (Transformer, Bus))
+        self.__energy_system = self.__create_energy_system()
+        self.__model = None            # built on first use, see model and component_models()
+        self.__component_models = None
 
     @property
     def value_collection(self) -> ValueCollection:
         return self.__value_collection
 
+    @property
+    def energy_system(self) -> EnergySystem:
+        return self.__energy_system
+
     @property
     def model(self) -> Model:
+        if self.__model is None:
+            self.__model = Model(energysystem=self.__energy_system)
         return self.__model
 
+    def connected_components(self) -> list:
+        """
+        Sub-networks of the energy system which share no bus
+
+        Returns:
+            list: lists of nodes, one per connected component, in the order of the nodes in the energy system
+        """
+        parent = {node: node for node in self.__energy_system.nodes}
+
+        def root(node):
+            while parent[node] is not node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        for i, o in self.__energy_system.flows():
+            parent[root(i)] = root(o)
+        components = {}
+        for node in self.__energy_system.nodes:
+            components.setdefault(root(node), []).append(node)
+        return list(components.values())
+
+    def component_models(self) -> list:
+        """
+        One model per connected component: the components are independent LPs, each can be solved on its own
+
+        Returns:
+            list: solph models, [model] if the energy system is connected
+        """
+        if self.__component_models is None:
+            components = self.connected_components()
+            if len(components) == 1:
+                self.__component_models = [self.model]
+            else:
+                self.__component_models = []
+                for nodes in components:
+                    es = EnergySystem(timeindex=self.__energy_system.timeindex, infer_last_interval=False)
+                    es.add(*nodes)
+                    self.__component_models.append(Model(energysystem=es))
+        return self.__component_models
+
     @property
     def entities(self):
         return self.__entities
 
+    @property
+    def bindings(self):
+        """Where the model uses a named value: nominal value of a flow or conversion factor of a transformer"""
+        return self.__bindings
+
     def value(self, vid) -> Value:
-        for row_cells in self.__sheet.iter_rows(min_row=2):
+        for row_cells in self.__rows:
             name_in_sheet = self.__get_value_from_cell(row_cells, 'Name').strip()  # Strip whitespace
             if name_in_sheet == vid:  # TODO only works for first line of transformer
                 value = self.__get_value_from_cell(row_cells, 'Value')
@@ -296,22 +372,30 @@ class ExcelModelFactory(ModelFactory, ValueFactory):
         # vname = 'vid_1'  # vid.replace('/','_').replace('-','_')  # does not work!
         # return FormulaValue(vname, vid, '', '', self)  # TODO unit missing here
 
+    def __apply_overrides(self, overrides):
+        # set values before the model is built, formula values change their free parameter:
+        for vid, new_value in overrides.items():
+            value = self.__value_collection.value(vid)
+            if value is None:
+                raise ValueError(f"Unknown value: {vid}")
+            value.value = new_value
+
     def __get_value_from_cell(self, row_cells, name):
         idx = self.__headings.index(name)
-        value = row_cells[idx].value
+        value = row_cells[idx] if idx < len(row_cells) else None
         if value is None:
             value = ''
         elif isinstance(value, str):
             value = value.strip()  # Strip whitespace from string values
         return value
 
-    def __create_model(self):
+    def __create_energy_system(self):
         es = EnergySystem(timeindex=pd.date_range('1/1/2021', periods=1, freq='D'))
 
         entity_name = ''
         entity_type = ''
         entity_list = []
-        for row_cells in self.__sheet.iter_rows(min_row=2):
+        for row_cells in self.__rows:
             if 'Ignore' in self.__headings and self.__get_value_from_cell(row_cells, 'Ignore') != '':
                 continue
 
@@ -340,8 +424,7 @@ class ExcelModelFactory(ModelFactory, ValueFactory):
         elif entity_type == 'Sink':
             self.__add_sink_to_model(entity_list, es)
 
-        # create the model from energy system:
-        return Model(energysystem=es)
+        return es
 
     def __add_source_to_model(self, row_list, es: EnergySystem):
         main_row = row_list[0]
@@ -367,6 +450,7 @@ class ExcelModelFactory(ModelFactory, ValueFactory):
         inputs = {}
         outputs = {}
         conv_factors = {}
+        conv_bindings = []
         tr_name = self.__get_value_from_cell(main_row, 'Name')
         for row_cells in row_list:
             is_input = False
@@ -393,8 +477,11 @@ class ExcelModelFactory(ModelFactory, ValueFactory):
                 outputs[bus] = flow
             if weight != '':
                 conv_factors[bus] = self.__get_conv_factor(weight)
+                if re.search('[a-zA-Z]', str(weight)):
+                    conv_bindings.append((weight, bus))
 
         tr = Transformer(label=tr_name, inputs=inputs, outputs=outputs, conversion_factors=conv_factors)
+        self.__bindings += [(name, 'conversion', (tr, bus)) for name, bus in conv_bindings]
         # tr.conversion_factors = conv_factors  # TODO does not work?!
         self.__entities[tr_name] = tr
         es.add(tr)
@@ -423,12 +510,14 @@ class ExcelModelFactory(ModelFactory, ValueFactory):
         free_par_name = self.__get_value_from_cell(row_cells, 'Free Parameter')
 
         if free_par_name == '':
-            return Flow(nominal_value=int(value), fix=1)
+            flow = Flow(nominal_value=int(value), fix=1)
         else:
             if value_name.endswith('_excess'):  # for 'excess' sources and sinks use high variable costs:
-                return Flow(nominal_value=int(value), max=100, variable_costs=1000)
+                flow = Flow(nominal_value=int(value), max=100, variable_costs=1000)
             else:
-                return Flow(nominal_value=int(value), max=100)
+                flow = Flow(nominal_value=int(value), max=100)
+        self.__bindings.append((value_name, 'flow', flow))
+        return flow
 
     def __get_bus(self, bus_name, es: EnergySystem):
         if self.__entities.get(bus_name) is None:
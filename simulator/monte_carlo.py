@@ -0,0 +1,344 @@
+"""
+Monte Carlo analysis of uncertain scenario inputs
+
+Simple values of the workbook (e.g. the Src_* potentials and Snk_* demands) are sampled from one
+distribution each, by Latin hypercube or plain random sampling. The formula values depending on them are
+evaluated for all samples at once (sympy lambdify over numpy arrays), which gives the input side (sources
+and sinks before optimization) without a solve. Every sample is then solved in a process pool with these
+values, on a model built once per process (see sweep.solve_values_in_process()), and the metrics of its
+loss breakdown are folded into running summaries: count, mean, standard deviation, extremes and P²
+quantile estimates (Jain & Chlamtac 1985).
+
+The samples and their propagated values are held as arrays, one number per sample and varying value, so
+they grow with the number of samples (8 bytes each, 80 MB for a million samples of ten varying values);
+the summaries of the solved samples do not.
+"""
+
+import bisect
+import logging
+import math
+import multiprocessing
+import statistics
+import time
+
+import numpy as np
+
+from .sweep import init_solve_process, solve_values_in_process
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+REPORT_INTERVAL = 5.0   # seconds between updates of the metrics of the yielded summary
+DISTRIBUTIONS = {   # name -> number of parameters
+    'uniform': 2,      # low, high
+    'normal': 2,       # mean, standard deviation
+    'triangular': 3,   # low, mode, high
+    'lognormal': 2,    # mean and standard deviation of the logarithm
+}
+
+logger = logging.getLogger(__name__)
+
+
+class Distribution:
+    """
+    One of DISTRIBUTIONS, maps probabilities in (0, 1) to values (inverse CDF)
+    """
+
+    def __init__(self, kind, *params):
+        if kind not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown distribution '{kind}', expected one of {', '.join(DISTRIBUTIONS)}")
+        if len(params) != DISTRIBUTIONS[kind]:
+            raise ValueError(f"Distribution '{kind}' takes {DISTRIBUTIONS[kind]} parameters")
+        self.kind = kind
+        self.params = params
+
+    def ppf(self, u):
+        """Values for the probabilities u (numpy array)"""
+        if self.kind == 'uniform':
+            low, high = self.params
+            return low + u * (high - low)
+        if self.kind == 'triangular':
+            low, mode, high = self.params
+            split = (mode - low) / (high - low)
+            return np.where(u < split,
+                            low + np.sqrt(u * (high - low) * (mode - low)),
+                            high - np.sqrt((1 - u) * (high - low) * (high - mode)))
+        normal = np.vectorize(statistics.NormalDist(*self.params).inv_cdf, otypes=[float])(u)
+        return np.exp(normal) if self.kind == 'lognormal' else normal
+
+    def __repr__(self):
+        return f"{self.kind}({', '.join(f'{param:g}' for param in self.params)})"
+
+
+def parse_distribution(spec):
+    """
+    Args:
+        spec: 'NAME=KIND:P1:P2[:P3]', e.g. 'Snk_Haushalte=normal:120000:8000'
+
+    Returns:
+        tuple: (name, Distribution)
+
+    Raises:
+        ValueError: malformed spec
+    """
+    name, sep, definition = spec.partition('=')
+    kind, *params = definition.split(':')
+    if not sep or not name.strip():
+        raise ValueError(f"Expected NAME=KIND:P1:P2[:P3] instead of '{spec}'")
+    return name.strip(), Distribution(kind, *(float(param) for param in params))
+
+
+def latin_hypercube(count, dimensions, rng) -> np.ndarray:
+    """
+    Probabilities (count x dimensions) with exactly one sample in each of count equal strata per dimension
+    """
+    strata = np.argsort(rng.random((dimensions, count)), axis=1).T   # independent permutation per dimension
+    return (strata + rng.random((count, dimensions))) / count
+
+
+def sample(distributions, count, method='lhs', seed=None) -> dict:
+    """
+    Args:
+        distributions: list of (name, Distribution)
+        method: 'lhs' (Latin hypercube) or 'random'
+
+    Returns:
+        dict: name -> array of count values
+    """
+    rng = np.random.default_rng(seed)
+    if method == 'lhs':
+        u = latin_hypercube(count, len(distributions), rng)
+    elif method == 'random':
+        u = rng.random((count, len(distributions)))
+    else:
+        raise ValueError(f"Unknown sampling method '{method}', expected lhs or random")
+    return {name: distribution.ppf(u[:, i]) for i, (name, distribution) in enumerate(distributions)}
+
+
+def propagate(value_collection, samples) -> dict:
+    """
+    Evaluate all formula values of a value collection for all samples at once
+
+    Args:
+        value_collection: collection of a built model (see ExcelModelFactory)
+        samples: value id -> array, these must be simple values
+
+    Returns:
+        dict: value id -> array (sampled and formula values) or float (unaffected simple values)
+
+    Raises:
+        ValueError: a sampled id is unknown or a formula value
+    """
+    from sympy import lambdify, sympify
+    from .value.value import FormulaValue
+
+    for vid in samples:
+        value = value_collection.value(vid)
+        if value is None:
+            raise ValueError(f"Unknown value: {vid}")
+        if isinstance(value, FormulaValue):
+            raise ValueError(f"{vid} is a formula value, sample its inputs instead")
+
+    evaluated = dict(samples)
+
+    def evaluate(vid):
+        if vid not in evaluated:
+            value = value_collection.value(vid)
+            if not isinstance(value, FormulaValue):
+                evaluated[vid] = float(value.value)
+            else:
+                expression = sympify(value.formula)
+                symbols = sorted(expression.free_symbols, key=lambda symbol: symbol.name)
+                function = lambdify(symbols, expression, 'numpy')
+                evaluated[vid] = function(*(evaluate(symbol.name) for symbol in symbols))
+        return evaluated[vid]
+
+    for vid in list(value_collection.values):
+        evaluate(vid)
+    return evaluated
+
+
+class P2Quantile:
+    """
+    Running estimate of the p-quantile with five markers (P² algorithm), constant memory
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []                  # marker heights, the first five observations until there are five
+        self.positions = [1, 2, 3, 4, 5]   # actual marker positions
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q, n = self.heights, self.positions
+        if len(q) < 5:
+            bisect.insort(q, x)
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:   # parabolic prediction out of order: linear
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self):
+        q = self.heights
+        if not q:
+            return math.nan
+        if len(q) < 5 or self.positions[4] == 5:   # exact as long as all observations are the markers
+            return q[min(len(q) - 1, round(self.p * (len(q) - 1)))]
+        return q[2]
+
+
+class RunningSummary:
+    """
+    Count, mean, standard deviation (Welford), minimum, maximum and quantiles of a stream of numbers
+    """
+
+    def __init__(self, quantiles=QUANTILES):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+
+    def add(self, x):
+        x = float(x)
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+        for quantile in self.quantiles:
+            quantile.add(x)
+
+    def as_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.mean if self.count else math.nan,
+            'std': math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0,
+            'min': self.min if self.count else math.nan,
+            'max': self.max if self.count else math.nan,
+            'quantiles': {f'{quantile.p:g}': quantile.value() for quantile in self.quantiles},
+        }
+
+
+def summarize_array(values, quantiles=QUANTILES) -> dict:
+    """Summary like RunningSummary.as_dict() of an array held in memory (exact quantiles)"""
+    values = np.atleast_1d(np.asarray(values, dtype=float))
+    return {
+        'count': int(values.size),
+        'mean': float(values.mean()),
+        'std': float(values.std(ddof=1)) if values.size > 1 else 0.0,
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'quantiles': {f'{p:g}': float(np.quantile(values, p)) for p in quantiles},
+    }
+
+
+def flatten(data, prefix='') -> dict:
+    """Numbers of a nested dict, keys joined with '.'"""
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = float(value)
+    return flat
+
+
+def _solve_sample(task):
+    # runs in a solve process: the loss breakdown metrics of one sample or {'error': message}
+    overrides, values = task
+    try:
+        return flatten(solve_values_in_process(overrides, values)['loss_breakdown'])
+    except Exception as e:
+        return {'error': str(e)}
+
+
+def run_monte_carlo(file_path, sheet_name, distributions, count, method='lhs', seed=None, processes=None,
+                    quantiles=QUANTILES, log_level=logging.WARNING, report_interval=REPORT_INTERVAL):
+    """
+    Sample the distributions, propagate them through the formulas and solve every sample with the
+    propagated values
+
+    Args:
+        distributions: list of (name, Distribution), see parse_distribution()
+        count: number of samples
+        processes: number of solve processes, default: number of CPUs
+        report_interval: seconds between updates of summary['metrics'], which is also updated after the
+            last sample
+
+    Returns:
+        iterator of (summary, number of samples done), the summary is updated in place:
+        {'inputs': {id: summary}, 'metrics': {loss breakdown metric: summary}, 'failed': count,
+         'errors': first error messages}
+
+    Raises:
+        ValueError: unknown or formula value sampled, unknown method
+    """
+    from .model.model_factory import ExcelModelFactory
+
+    samples = sample(distributions, count, method, seed)
+    template = ExcelModelFactory(file_path, sheet_name)   # parsed and built once, shared by the forked processes
+    inputs = propagate(template.value_collection, samples)
+    sources = sum(np.asarray(values) for vid, values in inputs.items() if vid.startswith('Src_'))
+    sinks = sum(np.asarray(values) for vid, values in inputs.items() if vid.startswith('Snk_'))
+    varying = {vid: values for vid, values in inputs.items() if np.ndim(values)}
+
+    summary = {
+        'samples': count,
+        'method': method,
+        'distributions': {name: repr(distribution) for name, distribution in distributions},
+        'inputs': dict({'sources_before': summarize_array(sources), 'sinks_before': summarize_array(sinks)},
+                       **{vid: summarize_array(values) for vid, values in varying.items()}),
+        'metrics': {},
+        'failed': 0,
+        'errors': [],
+    }
+    running = {}
+    names = [name for name, _ in distributions]
+    # per sample its parameters (for the overrides the processes build their model with) and propagated values
+    tasks = (({name: float(samples[name][i]) for name in names},
+              {vid: float(values[i]) for vid, values in varying.items()}) for i in range(count))
+    logger.info('monte carlo started', extra={'samples': count, 'method': method, 'parameters': len(names),
+                                              'varying': len(varying)})
+
+    reported = time.monotonic()
+    with multiprocessing.Pool(processes, initializer=init_solve_process,
+                              initargs=(file_path, sheet_name, log_level)) as pool:
+        for done, metrics in enumerate(pool.imap_unordered(_solve_sample, tasks, chunksize=4), 1):
+            if 'error' in metrics:
+                summary['failed'] += 1
+                if len(summary['errors']) < 10:
+                    summary['errors'].append(metrics['error'])
+            else:
+                for name, value in metrics.items():
+                    running.setdefault(name, RunningSummary(quantiles)).add(value)
+            if done == count or time.monotonic() - reported >= report_interval:
+                summary['metrics'] = {name: stats.as_dict() for name, stats in running.items()}
+                reported = time.monotonic()
+            yield summary, done
+        pool.close()   # the processes exit and write their metrics, see init_solve_process()
+        pool.join()
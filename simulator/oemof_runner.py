@@ -1,25 +1,455 @@
+import contextlib
+import functools
+import io
+import logging
+import math
 import os
-import pandas as pd
-from oemof.solph import processing
-from .model.model_factory import ExcelModelFactory
+import sys
+import threading
+from django.conf import settings
 
-def run_oemof_scenario():
+from . import metrics
+
+# oemof.solph, pyomo, pandas, openpyxl and sympy are imported on first use (inside the functions), so
+# importing this module for the defaults and the solver name keeps web processes light.
+
+logger = logging.getLogger(__name__)
+
+# Default scenario shown on the results page
+DEFAULT_WORKBOOK = os.path.join(os.path.dirname(__file__), 'data', 'KonfigurationSzenarios.xlsx')
+DEFAULT_SHEET = 'SimpleSzenarioD'
+
+ENGINES = ('oemof', 'direct', 'validate')   # see simulation_engine()
+
+# sys.stdout is shared by all threads of the process: the solver log (tee) is redirected for one run at a time
+_solver_output = threading.Lock()
+
+
+def solver_candidates():
+    """
+    Solvers to try, in order of preference
+
+    settings.SIMULATOR_SOLVER forces one solver. Otherwise Heroku uses solvers which work without system
+    packages and local development prefers CBC. None stands for oemof's default solver.
+    """
+    configured = getattr(settings, 'SIMULATOR_SOLVER', None)
+    if configured:
+        return [configured]
+    if 'DYNO' in os.environ:  # Heroku sets this environment variable
+        return ['appsi_opt', 'appsi_highs', None]
+    return _local_solver_candidates()
+
+
+@functools.lru_cache(maxsize=None)
+def _local_solver_candidates():
+    import pyomo.environ  # noqa: F401 (registers the solver plugins)
+    from pyomo.opt import SolverFactory
+    if SolverFactory('cbc').available(exception_flag=False):
+        return ['cbc', 'appsi_highs']
+    logger.warning("CBC not available locally, using alternatives")
+    return ['appsi_highs']
+
+
+def simulation_engine():
+    """
+    Engine solving the scenarios, settings.SIMULATOR_ENGINE: 'oemof' (solph model solved through pyomo),
+    'direct' (LP compiled from the energy system and solved by HiGHS in memory, see direct_lp.py) or
+    'validate' (both, the results of the direct LP are checked against those of oemof, which are used)
+    """
+    engine = getattr(settings, 'SIMULATOR_ENGINE', '') or 'oemof'
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown SIMULATOR_ENGINE '{engine}', expected one of {', '.join(ENGINES)}")
+    return engine
+
+
+def solver_name(engine=None):
+    """Name of the preferred solver of an engine (default: simulation_engine()), part of the run id"""
+    if (engine or simulation_engine()) == 'direct':
+        from .direct_lp import SOLVER
+        return SOLVER
+    return solver_candidates()[0] or 'default'
+
+
+def solve_model(model, tee=True):
+    """
+    Solve the model with the first solver of solver_candidates() that works
+
+    Returns:
+        str: name of the solver used
+    """
+    logger.debug("environment detection", extra={'heroku': 'DYNO' in os.environ})
+    error = None
+    for solver in solver_candidates():
+        label = solver or "default available solver"
+        try:
+            logger.info("attempting solver", extra={'solver': label})
+            # solph passes only solve_kwargs on to pyomo's solve()
+            if solver is None:
+                model.solve(solve_kwargs={'tee': tee})
+            else:
+                model.solve(solver=solver, solve_kwargs={'tee': tee})
+            logger.info("optimization completed", extra={'solver': label})
+            return label
+        except Exception as e:
+            logger.warning("solver failed", extra={'solver': label, 'error': e})
+            error = e
+
+    logger.error("all solver attempts failed", extra={'error': error})
+    raise Exception(f"No suitable solver found for optimization: {error}")
+
+
+def solve_models(models, tee=True):
+    """
+    Solve independent models (e.g. the connected components of one energy system) in parallel, see
+    solve_model()
+
+    Every model but the first is solved in a process forked from this one, its solution (variable values,
+    duals and reduced costs) is loaded back into the model here. pyomo keeps the temporary files of a solve
+    in process wide state, so several solves of one process cannot run in threads. A process running other
+    threads (the web server, job workers) is not forked, a lock held by another thread at the fork would
+    never be released in the child; there the models are solved one after the other. The timer thread
+    writing the metrics does not count, metrics.fork_guard() and the fork handler of metrics.py take care
+    of it. A daemonic process (of a batch, sweep or Monte Carlo run, which solve in parallel already) cannot
+    start processes, it solves the models one after the other, too. The solver log (tee) is only shown for
+    the first model.
+
+    Returns:
+        str: name of the solver used
+
+    Raises:
+        Exception: the first model which could not be solved
+    """
+    if len(models) == 1:
+        return solve_model(models[0], tee=tee)
+    import multiprocessing
+
+    if multiprocessing.current_process().daemon or \
+            any(thread is not threading.current_thread() and not metrics.flush_thread(thread)
+                for thread in threading.enumerate()):
+        return _solvers_used([solve_model(model, tee=tee and k == 0) for k, model in enumerate(models)])
+
+    context = multiprocessing.get_context('fork')
+    running = []
+    for model in models[1:]:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_solve_in_process, args=(model, sender), daemon=True)
+        with metrics.fork_guard():
+            process.start()
+        sender.close()   # the receiver sees EOF if the process dies without a solution
+        running.append((process, receiver))
+
+    try:
+        solvers = [solve_model(models[0], tee=tee)]
+        for model, (process, receiver) in zip(models[1:], running):
+            try:
+                outcome = receiver.recv()
+            except EOFError:
+                process.join()
+                outcome = Exception(f"Solve process exited with code {process.exitcode}")
+            if isinstance(outcome, Exception):
+                raise outcome
+            solvers.append(_load_solution(model, outcome))
+    finally:
+        for process, receiver in running:
+            receiver.close()
+            if process.is_alive():
+                process.kill()
+            process.join()
+    return _solvers_used(solvers)
+
+
+def _solvers_used(solvers):
+    # name of the solver of several solves, or of all solvers used
+    return solvers[0] if len(set(solvers)) == 1 else ', '.join(sorted(set(solvers)))
+
+
+def _solution_components(model):
+    # variables, constraints: the same order in the forked process and in this one
+    from pyomo.core import Constraint, Var
+    return list(model.component_data_objects(Var)), list(model.component_data_objects(Constraint, active=True))
+
+
+def _solve_in_process(model, connection):
+    # target of a solve process of solve_models(): solves the model and sends the solution
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            solver = solve_model(model, tee=False)
+        variables, constraints = _solution_components(model)
+        connection.send({
+            'solver': solver,
+            'values': [variable.value for variable in variables],
+            'dual': [model.dual.get(constraint) for constraint in constraints],
+            'rc': [model.rc.get(variable) for variable in variables],
+            'solver_results': model.solver_results,
+        })
+    except Exception as e:
+        connection.send(Exception(str(e) or e.__class__.__name__))
+    finally:
+        metrics.flush()   # the process ends by os._exit(), which skips atexit
+    connection.close()
+
+
+def _load_solution(model, solution):
+    # the solution sent by _solve_in_process() into the model, as solph's solve() leaves it
+    variables, constraints = _solution_components(model)
+    for variable, value in zip(variables, solution['values']):
+        variable.set_value(value, skip_validation=True)
+    for suffix, components in (('dual', constraints), ('rc', variables)):
+        getattr(model, suffix).update((component, value) for component, value
+                                      in zip(components, solution[suffix]) if value is not None)
+    model.solver_results = model.es.results = solution['solver_results']
+    return solution['solver']
+
+
+class ProgressWriter(io.TextIOBase):
+    """
+    Text stream passing every complete line to progress('solve', line), e.g. the solver log of tee=True
+    """
+
+    def __init__(self, progress, echo=None):
+        self.progress = progress
+        self.echo = echo   # stream which still receives everything (the original stdout)
+        self._pending = ''
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if self.echo is not None:
+            self.echo.write(text)
+        self._pending += text
+        *lines, self._pending = self._pending.split('\n')
+        for line in lines:
+            if line.strip():
+                self.progress('solve', line.rstrip())
+        return len(text)
+
+    def flush(self):
+        if self.echo is not None:
+            self.echo.flush()
+
+
+class RunContext:
+    """
+    State of one scenario run: scenario, progress callback and phase timer
+
+    A run keeps its state here and in the objects it creates (factory, value collection, model), nothing
+    module level is changed, so runs in several threads of one process do not interfere.
+    """
+
+    def __init__(self, file_path, sheet_name, overrides=None, progress=None):
+        self.file_path = file_path
+        self.sheet_name = sheet_name
+        self.overrides = dict(overrides or {})
+        self.progress = progress or (lambda phase, message='': None)
+        self.phases = metrics.PhaseTimer(workbook=os.path.basename(file_path), sheet=sheet_name)
+
+    @contextlib.contextmanager
+    def solver_output(self):
+        """
+        Pass the solver log on to progress while the block runs
+
+        Yields:
+            bool: tee for the solver, False if another run of this process has stdout already
+        """
+        if not _solver_output.acquire(blocking=False):
+            self.progress('solve', "Solver log not captured, another solve of this process is writing it")
+            yield False
+            return
+        try:
+            with contextlib.redirect_stdout(ProgressWriter(self.progress, echo=sys.stdout)):
+                yield True
+        finally:
+            _solver_output.release()
+
+
+def run_oemof_scenario(file_path=DEFAULT_WORKBOOK, sheet_name=DEFAULT_SHEET, overrides=None, progress=None,
+                       engine=None):
     """
     Run OEMOF energy system optimization scenario
     
+    Args:
+        file_path: Excel configuration workbook
+        sheet_name: sheet of the workbook describing the scenario
+        overrides: optional dict value id -> value replacing values of the workbook
+        progress: optional callable(phase, message) informed about the phases load_workbook, build_model,
+            solve (also called with every line of the solver output) and extract
+        engine: 'oemof', 'direct' or 'validate', default: simulation_engine(). A network the direct LP
+            does not support is solved with oemof.
+
+    A network solved before (same fingerprint, see fingerprint.py) is not solved again, the results of
+    its stored run are returned with this scenario.
+
     Returns:
         dict: Dictionary containing energy balance results
     """
-    # Path to your Excel config
-    file_dir = os.path.join(os.path.dirname(__file__), 'data')
-    file_path = os.path.join(file_dir, 'KonfigurationSzenarios.xlsx')
+    from .fingerprint import fingerprint
+    from .model.model_factory import ExcelModelFactory, load_sheet
+
+    context = RunContext(file_path, sheet_name, overrides, progress)
+    progress, phases = context.progress, context.phases
+    engine = engine or simulation_engine()
 
     # Build factory + model
-    model_factory = ExcelModelFactory(file_path, 'SimpleSzenarioD')
-    model = model_factory.model
+    progress('load_workbook', f"Loading {os.path.basename(file_path)}, sheet {sheet_name}")
+    phases.start('load_workbook')
+    load_sheet(file_path, sheet_name)   # cached, the factory then reads from memory
+    progress('build_model', "Building energy system model")
+    phases.start('build_model')
+    model_factory = ExcelModelFactory(file_path, sheet_name, context.overrides)
     value_collection = model_factory.value_collection
 
+    # Another workbook or sheet may describe the same network, its stored results are served instead
+    scenario_fingerprint = fingerprint(model_factory.energy_system, value_collection, solver_name(engine))
+    data = _stored_result(scenario_fingerprint)
+    if data is not None:
+        phases.stop()
+        progress('solve', "Identical network solved before, reusing its results")
+        metrics.inc('simulator_deduplicated_solves_total')
+        data["scenario"] = scenario_reference(file_path, sheet_name, context.overrides)
+        return data
+
+    # The direct LP is solved from the energy system, the solph model is not built. The oemof engine
+    # solves every network with the solver of its run id, also one the closed form of the direct LP solves.
+    direct_data = _run_direct(model_factory, context) if engine in ('direct', 'validate') else None
+    if engine == 'direct' and direct_data is not None:
+        direct_data["scenario"] = scenario_reference(file_path, sheet_name, context.overrides)
+        direct_data["fingerprint"] = scenario_fingerprint
+        return direct_data
+
+    # Solve model using best available solver for Heroku deployment, sub-networks which share no bus
+    # are solved as separate models
+    models = model_factory.component_models()
+    progress('solve', "Solving" if len(models) == 1 else f"Solving {len(models)} independent sub-networks")
+    phases.start('solve')
+    for model in models:
+        receive_duals(model)
+    with context.solver_output() as tee:
+        solver_used = solve_models(models, tee=tee)
+    phases.stop()
+    for model in models:
+        metrics.record_solve(model, solver_used)
+
+    # Get results
+    progress('extract', "Extracting results")
+    data = summarize_results(models if len(models) > 1 else models[0], value_collection, solver_used, phases)
+    data["scenario"] = scenario_reference(file_path, sheet_name, context.overrides)
+    data["fingerprint"] = scenario_fingerprint
+    if direct_data is not None:
+        _validate(data, direct_data, model_factory, context)
+    return data
+
+
+def _run_direct(model_factory, context):
+    # result of the direct LP engine, None if the network uses something it does not support
+    from .direct_lp import DirectLP
+
+    context.phases.start('solve')
+    try:
+        lp = DirectLP(model_factory.energy_system)
+    except ValueError as e:
+        context.phases.stop()
+        logger.info("direct LP not applicable", extra={'error': e})
+        context.progress('solve', f"Direct LP not applicable ({e}), solving with oemof")
+        return None
+    context.progress('solve', "All flows determined by the fixed flows, no LP to solve" if lp.determined()
+                     else "Solving the direct LP")
+    solution = lp.solve()
+    context.phases.stop()
+    metrics.inc('simulator_solves_total', solver=solution['solver'], status='ok', termination='optimal')
+    logger.info("direct LP solved", extra={'columns': len(lp.cost), 'lp_columns': solution['lp_columns']})
+
+    context.progress('extract', "Extracting results")
+    context.phases.start('extract')
+    return summarize(lp.results(solution), lp.sensitivity(solution), model_factory.value_collection,
+                     solution['solver'], context.phases)
+
+
+def _validate(data, direct_data, model_factory, context):
+    # validation mode: results of the direct LP checked against those of oemof, differences with the same
+    # objective are another optimal solution of the same LP
+    from .direct_lp import TOLERANCE, compare, objective
+
+    differences = compare(data, direct_data)
+    if not differences:
+        metrics.inc('simulator_engine_validations_total', result='match')
+        context.progress('extract', "Direct LP agrees with oemof")
+        return
+    alternative = math.isclose(
+        objective(model_factory.energy_system, data['time_series']['flows']),
+        objective(model_factory.energy_system, direct_data['time_series']['flows']),
+        rel_tol=TOLERANCE, abs_tol=TOLERANCE)
+    result = 'alternative_optimum' if alternative else 'mismatch'
+    metrics.inc('simulator_engine_validations_total', result=result)
+    logger.log(logging.INFO if alternative else logging.WARNING, "direct LP differs from oemof", extra={
+        'workbook': context.file_path, 'sheet': context.sheet_name, 'result': result,
+        'count': len(differences), 'differences': differences[:10]})
+    context.progress('extract', f"Direct LP differs from oemof in {len(differences)} value(s)" +
+                     (", another optimal solution" if alternative else ""))
+
+
+def _stored_result(scenario_fingerprint):
+    # result of a stored run with the same network fingerprint, None if there is none
+    from .run_store import load_run, run_with_fingerprint
+
+    run_id = run_with_fingerprint(scenario_fingerprint)
+    data = load_run(run_id) if run_id is not None else None
+    if data is not None:
+        logger.info("solve deduplicated", extra={'fingerprint': scenario_fingerprint, 'run_id': run_id})
+    return data
+
+
+def summarize_results(model, value_collection, solver_used, phases=None):
+    """
+    Energy balance, loss breakdown, time series and sensitivities of a solved model
+
+    Args:
+        model: solved solph model, or the list of solved models of the connected components of one
+            energy system (see ExcelModelFactory.component_models()), their results are merged
+        value_collection: values the model was built from
+        solver_used: name of the solver, part of the result
+        phases: optional metrics.PhaseTimer receiving the phases extract, resolve_values, loss_accounting
+            and time_series
+
+    Returns:
+        dict: result as returned by run_oemof_scenario, without 'scenario'
+    """
+    from oemof.solph import processing
+
+    phases = phases or metrics.PhaseTimer()
+
+    # Results of the optimization
+    phases.start('extract')
+    results = {}
+    sensitivity = {"shadow_prices": {}, "reduced_costs": {}}
+    for component_model in (model if isinstance(model, list) else [model]):
+        results.update(processing.results(component_model))
+        for key, values in extract_sensitivity(component_model).items():
+            sensitivity[key].update(values)
+    sensitivity = {key: dict(sorted(values.items())) for key, values in sensitivity.items()}
+    return summarize(results, sensitivity, value_collection, solver_used, phases)
+
+
+def summarize(results, sensitivity, value_collection, solver_used, phases=None):
+    """
+    Energy balance, loss breakdown and time series of optimization results
+
+    Args:
+        results: flow results in the form of oemof.solph.processing.results(): (node, node) ->
+            {'sequences': DataFrame with a 'flow' column per time point, 'scalars': Series}
+        sensitivity: see extract_sensitivity()
+        value_collection: values the model was built from
+        solver_used: name of the solver, part of the result
+        phases: optional metrics.PhaseTimer receiving the phases resolve_values, loss_accounting and
+            time_series
+
+    Returns:
+        dict: result as returned by run_oemof_scenario, without 'scenario'
+    """
+    phases = phases or metrics.PhaseTimer()
+
     # Calculate totals BEFORE optimization from value collection
+    phases.start('resolve_values')
     total_sources_before = 0
     total_sinks_before = 0
     
@@ -29,61 +459,6 @@ def run_oemof_scenario():
         elif value.id.startswith('Snk_'):
             total_sinks_before += value.value
 
-    # Solve model using best available solver for Heroku deployment
-    from pyomo.opt import SolverFactory
-    
-    is_heroku = 'DYNO' in os.environ  # Heroku sets this environment variable
-    print(f"Environment detection - Is Heroku: {is_heroku}")
-    
-    solver_used = None
-    try:
-        if is_heroku:
-            print("Heroku detected - using PuLP solver")
-            # On Heroku, use PuLP which is pure Python and works reliably
-            try:
-                # Try PuLP first (most reliable on Heroku)
-                print("Attempting PuLP solver")
-                model.solve(solver="appsi_opt", tee=True)  # PuLP via appsi interface
-                solver_used = "appsi_opt (PuLP)"
-            except Exception as e1:
-                print(f"PuLP failed: {e1}")
-                try:
-                    # Fallback to HiGHS
-                    print("Attempting HiGHS solver")
-                    model.solve(solver="appsi_highs", tee=True)
-                    solver_used = "appsi_highs"
-                except Exception as e2:
-                    print(f"HiGHS failed: {e2}")
-                    # Final fallback - force use of any available solver
-                    print("Using any available solver")
-                    model.solve(tee=True)
-                    solver_used = "default available solver"
-        else:
-            print("Local environment detected - using CBC solver")
-            # Local development - prefer CBC if available
-            try:
-                solver = SolverFactory('cbc')
-                if solver.available():
-                    model.solve(solver="cbc", tee=True)
-                    solver_used = "cbc"
-                else:
-                    print("CBC not available locally, trying alternatives")
-                    model.solve(solver="appsi_highs", tee=True)
-                    solver_used = "appsi_highs (local fallback)"
-            except Exception as e:
-                print(f"Local CBC failed: {e}")
-                model.solve(solver="appsi_highs", tee=True) 
-                solver_used = "appsi_highs (local fallback)"
-                
-        print(f"Optimization completed successfully using solver: {solver_used}")
-        
-    except Exception as e:
-        print(f"All solver attempts failed: {e}")
-        raise Exception(f"No suitable solver found for optimization: {e}")
-
-    # Get results
-    results = processing.results(model)
-
     # Calculate totals AFTER optimization from OEMOF results
     total_sources_after = 0
     total_sinks_after = 0
@@ -121,6 +496,7 @@ def run_oemof_scenario():
             detailed_sinks_after[str(o)] = v['sequences'].sum().sum()
 
     # Calculate detailed loss breakdown data dynamically from OEMOF results
+    phases.start('loss_accounting')
     
     # Extract actual conversion flows from OEMOF results
     electrolysis_input = 0
@@ -314,14 +690,16 @@ def run_oemof_scenario():
         }
     }
 
-    # Debug print to verify values
-    print(f"DEBUG - Backend Data:")
-    print(f"Sources Before: {total_sources_before}")
-    print(f"Sinks Before: {total_sinks_before}")
-    print(f"Sources After Raw: {total_sources_after}")
-    print(f"Usable Sources After: {usable_sources_after}")
-    print(f"Sinks After: {total_sinks_after}")
-    print(f"Conversion Losses: {conversion_losses}")
+    # Full resolution time series of all flows and storage levels (downsampled for the charts later)
+    phases.start('time_series')
+    time_series = extract_time_series(results)
+    phases.stop()
+
+    logger.debug("energy balance", extra={
+        'sources_before': total_sources_before, 'sinks_before': total_sinks_before,
+        'sources_after_raw': total_sources_after, 'sources_after': usable_sources_after,
+        'sinks_after': total_sinks_after, 'losses': conversion_losses,
+    })
 
     return {
         "sources_before": total_sources_before,    # From Excel before optimization
@@ -332,6 +710,7 @@ def run_oemof_scenario():
         "losses": conversion_losses,               # Calculated conversion losses
         "difference_before": total_sources_before - total_sinks_before,  # Difference before optimization
         "verification_correct": abs(conversion_losses - (total_sources_after - total_sinks_after)) < 0.01,
+        "solver": solver_used,                     # Solver which solved the model
         
         # Detailed breakdown data
         "detailed_sources_before": detailed_sources_before,
@@ -340,5 +719,89 @@ def run_oemof_scenario():
         "detailed_sinks_after": detailed_sinks_after,
         
         # Loss breakdown data
-        "loss_breakdown": loss_breakdown
+        "loss_breakdown": loss_breakdown,
+
+        # Time series data (one value per time step)
+        "time_series": time_series,
+
+        # Shadow prices of the bus balances and reduced costs of the source flows
+        "sensitivity": sensitivity
+    }
+
+
+def scenario_reference(file_path, sheet_name, overrides=None):
+    """
+    Workbook, sheet and overrides of a run as stored with it, workbooks in simulator/data by name only
+
+    scenario_catalog.resolve_scenario() turns it back into a workbook path.
+    """
+    from .scenario_catalog import DATA_DIR
+
+    workbook = os.path.abspath(file_path)
+    if os.path.dirname(workbook) == os.path.abspath(DATA_DIR):
+        workbook = os.path.basename(workbook)
+    return {"workbook": workbook, "sheet": sheet_name, "overrides": dict(overrides or {})}
+
+
+def receive_duals(model):
+    """Let the solver return duals and reduced costs (pyomo suffixes dual and rc of the model)"""
+    # solph's receive_duals() replaces the plain attributes dual and rc, which pyomo warns about
+    del model.dual, model.rc
+    model.receive_duals()
+
+
+def extract_sensitivity(model):
+    """
+    First order sensitivities of a solved LP
+
+    Returns:
+        dict: 'shadow_prices' (bus label: dual of the bus balance per time step, the change of the
+            objective per additional unit of demand at the bus) and 'reduced_costs' ('<source> -> <bus>':
+            reduced cost of the flow per time step, None for fixed flows, which are not part of the LP)
+    """
+    shadow_prices = {}
+    for bus, t in model.BusBlock.balance:
+        dual = model.dual.get(model.BusBlock.balance[bus, t])
+        shadow_prices.setdefault(str(bus), []).append(None if dual is None else float(dual))
+
+    reduced_costs = {}
+    for i, o, t in model.flow:
+        if str(i).startswith('Src_'):
+            variable = model.flow[i, o, t]
+            rc = None if variable.fixed else model.rc.get(variable)
+            reduced_costs.setdefault(f"{i} -> {o}", []).append(None if rc is None else float(rc))
+
+    return {
+        "shadow_prices": dict(sorted(shadow_prices.items())),
+        "reduced_costs": dict(sorted(reduced_costs.items())),
+    }
+
+
+def extract_time_series(results):
+    """
+    Extract full resolution flow and storage level sequences from OEMOF results
+
+    Returns:
+        dict: 'index' (ISO time stamps), 'flows' ('<from> -> <to>': values) and 'storage' (label: values)
+    """
+    index = None
+    flows = {}
+    storage = {}
+
+    for (i, o), v in results.items():
+        sequences = v['sequences'].dropna(how='all')  # last (implicit) interval carries no values
+        if index is None:
+            index = [ts.isoformat() for ts in sequences.index]
+
+        if o is None:
+            # component without output bus, e.g. storage level of a GenericStorage
+            if 'storage_content' in sequences:
+                storage[str(i)] = [float(x) for x in sequences['storage_content']]
+        elif 'flow' in sequences:
+            flows[f"{i} -> {o}"] = [float(x) for x in sequences['flow']]
+
+    return {
+        "index": index or [],
+        "flows": flows,
+        "storage": storage,
     }
@@ -0,0 +1,116 @@
+"""
+Server-sent events with the progress of solve jobs
+
+The solve workers record the phases of a job (load_workbook, build_model, solve with every line of the
+solver output, extract, store, done/failed) in the job database. Per event loop one hub task reads new
+events of all watched jobs once per POLL_INTERVAL and hands them to the waiting streams. An idle stream
+is only an asyncio queue, so an ASGI worker keeps thousands of them open without a thread each.
+"""
+
+import asyncio
+import json
+import weakref
+
+from asgiref.sync import sync_to_async
+
+from . import jobs
+
+POLL_INTERVAL = 0.25        # seconds between reads of new events
+KEEPALIVE_INTERVAL = 15.0   # seconds between comments on an idle stream (proxies close silent connections)
+TERMINAL_PHASES = (jobs.DONE, jobs.FAILED)
+
+_hubs = weakref.WeakKeyDictionary()   # event loop -> ProgressHub
+
+
+class ProgressHub:
+    """
+    Fans out job events to the subscribed streams of one event loop
+    """
+
+    def __init__(self):
+        self.subscribers = {}   # job id -> set of asyncio queues
+        self.last_seq = 0
+        self.task = None
+
+    def subscribe(self, job_id):
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(job_id, set()).add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._poll())
+        return queue
+
+    def unsubscribe(self, job_id, queue):
+        queues = self.subscribers.get(job_id, set())
+        queues.discard(queue)
+        if not queues:
+            self.subscribers.pop(job_id, None)
+
+    async def _poll(self):
+        # one database read per interval for all streams, the read itself runs in a thread
+        while self.subscribers:
+            events = await sync_to_async(jobs.events_since, thread_sensitive=False)(
+                self.last_seq, list(self.subscribers))
+            for event in events:
+                self.last_seq = max(self.last_seq, event['seq'])
+                for queue in self.subscribers.get(event['job_id'], ()):
+                    queue.put_nowait(event)
+            await asyncio.sleep(POLL_INTERVAL)
+
+
+def get_hub() -> ProgressHub:
+    loop = asyncio.get_running_loop()
+    if loop not in _hubs:
+        _hubs[loop] = ProgressHub()
+    return _hubs[loop]
+
+
+def format_event(event) -> str:
+    return f"id: {event['seq']}\nevent: {event['phase']}\ndata: {json.dumps({'message': event['message']})}\n\n"
+
+
+async def _ended(job_id, last_seq):
+    # terminal event of a job which ended without (another) event, None while it is queued or running
+    job = await sync_to_async(jobs.get_job, thread_sensitive=False)(job_id)
+    if job is not None and job['status'] not in TERMINAL_PHASES:
+        return None
+    return format_event({'seq': last_seq, 'phase': job['status'] if job else jobs.FAILED,
+                         'message': (job or {}).get('error') or ''})
+
+
+async def event_stream(job_id, last_seq=0):
+    """
+    Server-sent events of a job: the events recorded so far (after last_seq), then the new ones until the
+    job is done or failed
+    """
+    hub = get_hub()
+    queue = hub.subscribe(job_id)   # subscribe first, so no event is lost between history and live events
+    try:
+        history = await sync_to_async(jobs.events_since, thread_sensitive=False)(last_seq, [job_id])
+        for event in history:
+            last_seq = event['seq']
+            yield format_event(event)
+            if event['phase'] in TERMINAL_PHASES:
+                return
+        ended = await _ended(job_id, last_seq)   # e.g. created as done, the scenario was stored already
+        if ended:
+            yield ended
+            return
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                # the job may have ended without an event (e.g. timed out after its worker died)
+                ended = await _ended(job_id, last_seq)
+                yield ended or ': keepalive\n\n'
+                if ended:
+                    return
+                continue
+            if event['seq'] <= last_seq:
+                continue   # already sent as part of the history
+            last_seq = event['seq']
+            yield format_event(event)
+            if event['phase'] in TERMINAL_PHASES:
+                return
+    finally:
+        hub.unsubscribe(job_id, queue)
@@ -0,0 +1,251 @@
+"""
+Parametric analysis of an optimal LP basis
+
+An optimal basis stays optimal while the parameters move within a range: bounds (right-hand sides) move
+the basic solution linearly, the basis stays optimal as long as it stays within its bounds; coefficients
+change the basis matrix, the basis stays optimal as long as the recomputed solution is within its bounds
+and the reduced costs keep their signs. Within that range the solution, duals and reduced costs of the
+changed LP are computed from the stored basis with one dense linear solve instead of a solver call.
+validity_range() is exact, a ratio test of conditions linear in the parameter: the bounds move the basic
+values linearly, a coefficient changes one column of the LP by a rank one update (Sherman-Morrison).
+
+The LP is taken as solved by HiGHS: min cost @ x with lower <= x <= upper and row_lower <= A @ x <= row_upper.
+Row activities r = A @ x are treated as further variables, so all equations are [A, -I] @ [x, r] == 0 and
+the basis is a square submatrix of [A, -I]. Dense matrices are used, so it is meant for the small LPs of the
+workbook scenarios (see MAX_ROWS).
+"""
+
+import math
+
+import numpy as np
+
+MAX_ROWS = 2000                 # larger LPs are re-solved, the dense basis matrix would be too big
+PRIMAL_TOLERANCE = 1e-9         # relative to the bound
+DUAL_TOLERANCE = 1e-7           # relative to the cost
+
+
+class StoredBasis:
+    """
+    Constraint matrix, bounds, costs and optimal basis of an LP solved by HiGHS and the parameter values
+    the LP was built with
+
+    Args:
+        highs: highspy.Highs after an optimal solve
+        parameters: parameter -> value the LP was built with
+        effects: parameter -> list of ('bounds', column, lower slope, upper slope), the bounds of the
+            column are slope * value, or ('coefficient', row, column), the matrix entry is proportional to
+            the value
+
+    Raises:
+        ValueError: no valid basis or too many rows
+    """
+
+    def __init__(self, highs, parameters, effects):
+        import highspy
+
+        lp = highs.getLp()
+        basis = highs.getBasis()
+        n, m = lp.num_col_, lp.num_row_
+        if not basis.valid:
+            raise ValueError("The solver has no valid basis")
+        if m > MAX_ROWS:
+            raise ValueError(f"{m} rows are too many for a dense basis matrix (at most {MAX_ROWS})")
+
+        a = np.zeros((m, n))
+        start, index, value = lp.a_matrix_.start_, lp.a_matrix_.index_, lp.a_matrix_.value_
+        for column in range(n):   # column-wise (CSC) matrix of HiGHS
+            a[index[start[column]:start[column + 1]], column] = value[start[column]:start[column + 1]]
+        self.matrix = np.hstack([a, -np.eye(m)])
+        self.lower = np.concatenate([lp.col_lower_, lp.row_lower_])
+        self.upper = np.concatenate([lp.col_upper_, lp.row_upper_])
+        self.cost = np.concatenate([lp.col_cost_, np.zeros(m)])
+        self.offset = lp.offset_
+        self.columns = n
+
+        status = list(basis.col_status) + list(basis.row_status)
+        self.basic = np.array([s == highspy.HighsBasisStatus.kBasic for s in status])
+        self.at_upper = np.array([s == highspy.HighsBasisStatus.kUpper for s in status])
+        self.at_zero = np.array([s == highspy.HighsBasisStatus.kZero for s in status])   # free, nonbasic
+        if self.basic.sum() != m:
+            raise ValueError("The basis of the solver is not square")
+
+        self.parameters = dict(parameters)
+        self.effects = effects
+
+    def data(self, parameters):
+        """
+        Matrix and bounds of the LP with changed parameter values
+
+        Returns:
+            tuple: (matrix, lower, upper), None if a coefficient changes from 0 (no entry to scale)
+        """
+        matrix, lower, upper = self.matrix, self.lower.copy(), self.upper.copy()
+        for parameter, value in parameters.items():
+            stored = self.parameters[parameter]
+            if value == stored:
+                continue
+            for effect in self.effects[parameter]:
+                if effect[0] == 'bounds':
+                    _, column, lower_slope, upper_slope = effect
+                    lower[column] = lower_slope * value
+                    upper[column] = upper_slope * value
+                elif stored == 0:
+                    return None
+                else:
+                    _, row, column = effect
+                    if matrix is self.matrix:
+                        matrix = matrix.copy()
+                    matrix[row, column] *= value / stored
+        return matrix, lower, upper
+
+    def __nonbasic_values(self, lower, upper):
+        values = np.where(self.at_upper, upper, lower)
+        values[self.at_zero | self.basic] = 0.0
+        return values
+
+    def solve(self, parameters):
+        """
+        Solution of the LP with changed parameter values from the stored basis
+
+        Args:
+            parameters: parameter -> value, unchanged parameters may be missing
+
+        Returns:
+            dict: 'values' and 'reduced_costs' per column, 'activities' and 'duals' per row and
+                'objective', None if the basis is not optimal for these values
+        """
+        data = self.data(parameters)
+        if data is None:
+            return None
+        matrix, lower, upper = data
+        basis = matrix[:, self.basic]
+        values = self.__nonbasic_values(lower, upper)
+        try:
+            values[self.basic] = np.linalg.solve(basis, -matrix @ values)
+            duals = np.linalg.solve(basis.T, self.cost[self.basic])
+        except np.linalg.LinAlgError:
+            return None
+
+        # primal feasibility of the basic variables
+        basic = values[self.basic]
+        lower_b, upper_b = lower[self.basic], upper[self.basic]
+        if np.any(basic < lower_b - PRIMAL_TOLERANCE * np.maximum(1.0, np.abs(lower_b))) or \
+                np.any(basic > upper_b + PRIMAL_TOLERANCE * np.maximum(1.0, np.abs(upper_b))):
+            return None
+
+        # dual feasibility (minimization): nonbasic variables must not improve the objective
+        reduced_costs = self.cost - matrix.T @ duals
+        tolerance = DUAL_TOLERANCE * np.maximum(1.0, np.abs(self.cost))
+        movable = ~self.basic & (lower < upper)
+        if np.any(movable & ~self.at_upper & (reduced_costs < -tolerance)) or \
+                np.any(movable & self.at_upper & (reduced_costs > tolerance)) or \
+                np.any(movable & self.at_zero & (np.abs(reduced_costs) > tolerance)):
+            return None
+
+        n = self.columns
+        return {
+            'values': values[:n],
+            'reduced_costs': reduced_costs[:n],
+            'activities': values[n:],
+            'duals': duals,
+            'objective': float(self.cost[:n] @ values[:n] + self.offset),
+        }
+
+    def validity_range(self, parameter):
+        """
+        Range of one parameter, all others unchanged, in which the stored basis stays optimal
+
+        Returns:
+            tuple: (low, high), -inf/inf if unbounded; (value, value) for a coefficient which is 0 or which
+                is an entry of several columns (a change of higher rank, its range is not computed)
+        """
+        if all(effect[0] == 'bounds' for effect in self.effects[parameter]):
+            low, high = self.__bounds_range(parameter)
+        else:
+            low, high = self.__coefficient_range(parameter)
+        # rounding of the linear solves: an edge within the primal tolerance of 0 is 0
+        zero = PRIMAL_TOLERANCE * max(1.0, abs(self.parameters[parameter]))
+        return tuple(0.0 if abs(edge) <= zero else edge for edge in (low, high))
+
+    def __bounds_range(self, parameter):
+        # bounds move the basic solution linearly: ratio test of the basic variables against their bounds
+        stored = self.parameters[parameter]
+        lower_slope, upper_slope = np.zeros(len(self.lower)), np.zeros(len(self.upper))
+        for _, column, lower_factor, upper_factor in self.effects[parameter]:
+            lower_slope[column], upper_slope[column] = lower_factor, upper_factor
+
+        basis = self.matrix[:, self.basic]
+        values = self.__nonbasic_values(self.lower, self.upper)
+        slopes = self.__nonbasic_values(lower_slope, upper_slope)
+        values[self.basic] = np.linalg.solve(basis, -self.matrix @ values)
+        slopes[self.basic] = np.linalg.solve(basis, -self.matrix @ slopes)
+
+        # value + t * slope >= lower + t * lower slope and value + t * slope <= upper + t * upper slope
+        basic = self.basic
+        factors = np.concatenate([(lower_slope - slopes)[basic], (slopes - upper_slope)[basic]])
+        limits = np.concatenate([(values - self.lower)[basic], (self.upper - values)[basic]])
+        limits = np.maximum(limits, 0.0)   # rounding of variables at their bound
+        finite = np.isfinite(limits)
+        tolerance = 1e-12 * np.maximum(1.0, np.abs(factors).max(initial=0.0))
+        up, down = finite & (factors > tolerance), finite & (factors < -tolerance)
+        high = (limits[up] / factors[up]).min(initial=math.inf)
+        low = (limits[down] / factors[down]).max(initial=-math.inf)
+        return stored + low, stored + high
+
+    def __coefficient_range(self, parameter):
+        # the entries w of one column scale with the value, value = stored * (1 + t): a rank one change of the
+        # LP. Basic column: by Sherman-Morrison the basic values, duals and reduced costs change by terms
+        # linear in t divided by 1 + t * beta (beta = (B^-1 w)[p], p its position in the basis), which is
+        # positive while the basis stays regular, so each condition is linear in t after multiplying with it.
+        # Nonbasic column: the basis is unchanged, the basic values and its reduced cost are linear in t.
+        effects = self.effects[parameter]
+        stored = self.parameters[parameter]
+        if stored == 0 or any(effect[0] != 'coefficient' for effect in effects) or \
+                len({effect[2] for effect in effects}) != 1:
+            return stored, stored
+        k = effects[0][2]
+        w = np.zeros(self.matrix.shape[0])
+        for _, row, _ in effects:
+            w[row] = self.matrix[row, k]
+
+        basis = self.matrix[:, self.basic]
+        values = self.__nonbasic_values(self.lower, self.upper)
+        values[self.basic] = np.linalg.solve(basis, -self.matrix @ values)
+        duals = np.linalg.solve(basis.T, self.cost[self.basic])
+        reduced_costs = self.cost - self.matrix.T @ duals
+        u = np.linalg.solve(basis, w)
+        omega = w @ duals
+        movable = ~self.basic & (self.lower < self.upper)
+        not_negative = movable & ~self.at_upper                  # reduced costs which must stay >= 0
+        not_positive = movable & (self.at_upper | self.at_zero)  # and <= 0 (both for free columns at zero)
+        basic = values[self.basic]
+        lower, upper = basic - self.lower[self.basic], self.upper[self.basic] - basic
+        # the slack of an infinite bound never binds (its alpha is dropped below), 0 in gamma instead of inf * 0
+        finite_lower = np.where(np.isfinite(lower), lower, 0.0)
+        finite_upper = np.where(np.isfinite(upper), upper, 0.0)
+
+        # conditions alpha + t * gamma >= 0
+        if self.basic[k]:
+            p = np.count_nonzero(self.basic[:k])
+            beta = u[p]
+            e_p = np.zeros(len(basic))
+            e_p[p] = 1.0
+            slopes = (self.matrix.T @ np.linalg.solve(basis.T, e_p)) * omega   # of the reduced costs
+            alpha = [lower, upper, reduced_costs[not_negative], -reduced_costs[not_positive], [1.0]]
+            gamma = [finite_lower * beta - u * values[k], finite_upper * beta + u * values[k],
+                     (reduced_costs * beta + slopes)[not_negative], -(reduced_costs * beta + slopes)[not_positive],
+                     [beta]]
+        else:
+            slopes = np.zeros(len(reduced_costs))
+            slopes[k] = -omega   # of the reduced costs, only that of the column changes
+            alpha = [lower, upper, reduced_costs[not_negative], -reduced_costs[not_positive]]
+            gamma = [-u * values[k], u * values[k], slopes[not_negative], -slopes[not_positive]]
+        alpha, gamma = np.concatenate(alpha), np.concatenate(gamma)
+        alpha = np.maximum(alpha, 0.0)   # rounding of variables at their bound and of zero reduced costs
+        finite = np.isfinite(alpha)
+        tolerance = 1e-12 * max(1.0, np.abs(gamma[finite]).max(initial=0.0))
+        up, down = finite & (gamma < -tolerance), finite & (gamma > tolerance)
+        high = (alpha[up] / -gamma[up]).min(initial=math.inf)
+        low = (-alpha[down] / gamma[down]).max(initial=-math.inf)
+        edges = stored * (1 + low), stored * (1 + high)
+        return edges if stored > 0 else edges[::-1]
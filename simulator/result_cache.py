@@ -0,0 +1,242 @@
+"""
+Result cache around run_oemof_scenario shared by all worker processes
+
+The results are the runs of the run store (run_store.py), so a scenario solved by one gunicorn worker is
+a hit for all others and a result is stored once. The cache keeps an index of the runs it stored in a
+SQLite database (settings.SIMULATOR_RESULT_CACHE['PATH']) and bounds them by number and total size: the
+least recently used runs are removed from the store first, except the run just stored. The scenario of
+an evicted run is kept (see evicted_scenario()), so it is solved again when requested. Hits, misses and
+evictions are counted in the same database.
+
+The key is the run id (workbook content, sheet, solver, overrides and code version, see
+run_store.make_run_id). The region is not part of it: it only labels the scenario, regions sharing a
+workbook sheet get the same result and share its entry.
+
+Identical concurrent solves are coalesced (single flight): on a miss the caller takes a per-key lock, a
+thread lock within the process and an flock on one of LOCK_FILES lock files shared by all processes
+(chosen by the key, keys sharing a file wait for each other). Whoever gets the lock first solves,
+everybody else waits and then finds the result in the cache.
+"""
+
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULTS = {
+    'MAX_ENTRIES': 256,
+    'MAX_BYTES': 256 * 1024 * 1024,
+}
+LOCK_FILES = 64   # lock files of the single flights, a fixed set instead of one file per key
+EVICTED_KEPT = 4096   # scenarios of evicted runs kept, the oldest are forgotten
+
+_key_locks = {}   # key -> [thread lock, number of threads using it]
+_key_locks_lock = threading.Lock()
+_schemas = set()   # index databases whose tables exist, created once per process
+_schemas_lock = threading.Lock()
+
+
+def _config() -> dict:
+    config = dict(DEFAULTS)
+    config['PATH'] = os.path.join(settings.SIMULATOR_RUN_DIR, 'result_cache.sqlite3')
+    config.update(getattr(settings, 'SIMULATOR_RESULT_CACHE', {}))
+    return config
+
+
+def _connect():
+    path = _config()['PATH']
+    if path in _schemas:
+        return sqlite3.connect(path, timeout=30, isolation_level=None)
+    with _schemas_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        con = sqlite3.connect(path, timeout=30, isolation_level=None)
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('DROP TABLE IF EXISTS entries')   # results stored before the run store backed the cache
+        con.execute('''CREATE TABLE IF NOT EXISTS runs (
+                           key TEXT PRIMARY KEY,
+                           size INTEGER NOT NULL,
+                           last_access REAL NOT NULL)''')
+        con.execute('CREATE INDEX IF NOT EXISTS runs_last_access ON runs (last_access)')
+        con.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        con.execute('''CREATE TABLE IF NOT EXISTS evicted (
+                           key TEXT PRIMARY KEY,
+                           scenario TEXT NOT NULL,
+                           evicted REAL NOT NULL)''')
+        _schemas.add(path)
+    return con
+
+
+def _count(con, name, increment=1):
+    con.execute('''INSERT INTO counters (name, value) VALUES (?, ?)
+                   ON CONFLICT(name) DO UPDATE SET value = value + excluded.value''', (name, increment))
+
+
+def get(key, counter='hits'):
+    """
+    Cached result for key, marks the entry as recently used
+
+    Args:
+        counter: counter incremented on a hit (misses are only counted for 'hits')
+
+    Returns:
+        dict: result or None on a miss
+    """
+    from .run_store import load_run, run_size
+
+    data = load_run(key)
+    con = _connect()
+    try:
+        if data is None:
+            if counter == 'hits':
+                _count(con, 'misses')
+            return None
+        # runs stored without the cache (e.g. by batch.py) are indexed on their first hit
+        con.execute('''INSERT INTO runs (key, size, last_access) VALUES (?, ?, ?)
+                       ON CONFLICT(key) DO UPDATE SET last_access = excluded.last_access''',
+                    (key, run_size(key), time.time()))
+        _count(con, counter)
+    finally:
+        con.close()
+    return data
+
+
+def put(key, data: dict):
+    """
+    Store a result in the run store and evict least recently used runs beyond MAX_ENTRIES / MAX_BYTES
+    """
+    from .run_store import delete_run, load_section, run_size, save_run
+
+    config = _config()
+    save_run(key, data)
+    con = _connect()
+    try:
+        con.execute('BEGIN IMMEDIATE')
+        con.execute('INSERT OR REPLACE INTO runs (key, size, last_access) VALUES (?, ?, ?)',
+                    (key, run_size(key), time.time()))
+        con.execute('DELETE FROM evicted WHERE key = ?', (key,))
+        # LRU eviction, newest first: keep MAX_ENTRIES runs whose sizes add up to at most MAX_BYTES, but never
+        # the run just stored, its id is returned to the caller (even if it alone is larger)
+        evicted = [row[0] for row in con.execute('''SELECT key FROM (
+                                                        SELECT key,
+                                                               ROW_NUMBER() OVER (ORDER BY last_access DESC) AS n,
+                                                               SUM(size) OVER (ORDER BY last_access DESC) AS total
+                                                        FROM runs)
+                                                    WHERE (n > ? OR total > ?) AND key != ?''',
+                                                 (config['MAX_ENTRIES'], config['MAX_BYTES'], key))]
+        con.executemany('DELETE FROM runs WHERE key = ?', [(evicted_key,) for evicted_key in evicted])
+        for evicted_key in evicted:   # remembered to solve it again when it is requested
+            section = load_section(evicted_key, 'scenario') or {}
+            if 'scenario' in section:
+                con.execute('INSERT OR REPLACE INTO evicted (key, scenario, evicted) VALUES (?, ?, ?)',
+                            (evicted_key, json.dumps(section['scenario']), time.time()))
+        if evicted:
+            _count(con, 'evictions', len(evicted))
+            con.execute('''DELETE FROM evicted
+                           WHERE key NOT IN (SELECT key FROM evicted ORDER BY evicted DESC LIMIT ?)''', (EVICTED_KEPT,))
+        con.execute('COMMIT')
+    except Exception:
+        con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
+    for evicted_key in evicted:
+        delete_run(evicted_key)
+
+
+def evicted_scenario(key):
+    """
+    Scenario reference of a run evicted from the cache, as stored with the run (see scenario_reference())
+
+    Returns:
+        dict: None if the run was not evicted, or too long ago
+    """
+    con = _connect()
+    try:
+        row = con.execute('SELECT scenario FROM evicted WHERE key = ?', (key,)).fetchone()
+    finally:
+        con.close()
+    return json.loads(row[0]) if row is not None else None
+
+
+def stats() -> dict:
+    """Hit/miss/eviction counters and current size of the cache"""
+    con = _connect()
+    try:
+        counters = dict(con.execute('SELECT name, value FROM counters').fetchall())
+        entries, size = con.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM runs').fetchone()
+    finally:
+        con.close()
+    hits = counters.get('hits', 0)
+    misses = counters.get('misses', 0)
+    config = _config()
+    return {
+        "hits": hits,
+        "misses": misses,
+        "coalesced": counters.get('coalesced', 0),
+        "evictions": counters.get('evictions', 0),
+        "hit_ratio": hits / (hits + misses) if hits + misses > 0 else 0,
+        "entries": entries,
+        "bytes": size,
+        "max_entries": config['MAX_ENTRIES'],
+        "max_bytes": config['MAX_BYTES'],
+    }
+
+
+def _lock_path(key):
+    # one of LOCK_FILES files, by a hash of the key
+    lock_dir = os.path.join(os.path.dirname(_config()['PATH']), 'locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    return os.path.join(lock_dir, f'result-{zlib.crc32(key.encode()) % LOCK_FILES:02d}.lock')
+
+
+@contextmanager
+def single_flight(key):
+    """
+    Exclusive section per key across the threads of this process and across processes
+    """
+    with _key_locks_lock:
+        entry = _key_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:   # threads of this process queue up here and do not hold a file descriptor each
+            with open(_lock_path(key), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)   # released on close, also if the process dies
+                yield
+    finally:
+        with _key_locks_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _key_locks[key]
+
+
+def cached_run_oemof_scenario(file_path, sheet_name, overrides=None, progress=None):
+    """
+    run_oemof_scenario with the result cache in front, identical concurrent calls solve only once
+
+    The result is stored in the run store under the returned key.
+
+    Returns:
+        tuple: (cache key = run id, result dict)
+    """
+    from .admission import solve_slot
+    from .oemof_runner import run_oemof_scenario, solver_name
+    from .run_store import make_run_id
+
+    key = make_run_id(file_path, sheet_name, solver_name(), overrides)
+    data = get(key)
+    if data is None:
+        with single_flight(key):
+            data = get(key, counter='coalesced')   # solved while we waited for the lock
+            if data is None:
+                with solve_slot():   # bounded number of solves per process and host
+                    data = run_oemof_scenario(file_path, sheet_name, overrides, progress)
+                if progress is not None:
+                    progress('store', "Storing results")
+                put(key, data)
+    return key, data
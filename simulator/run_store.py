@@ -0,0 +1,257 @@
+"""
+File based store for optimization results
+
+Every run is stored in its own directory below settings.SIMULATOR_RUN_DIR, one JSON file per result
+section (see SECTION_KEYS). Pages and API endpoints can therefore load only the section they need
+instead of parsing the full result. Run ids are derived from the scenario inputs, so the same scenario
+always maps to the same run id. Runs are also indexed by the fingerprint of their network (see
+fingerprint.py), so a scenario of another workbook or sheet describing the same network is not solved again.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+from django.conf import settings
+
+# result keys stored together in one section file, keys not listed here get a section of their own name
+SECTION_KEYS = {
+    "summary": ["sources_before", "sinks_before", "sources_after_raw", "sources_after", "sinks_after",
+                "losses", "difference_before", "verification_correct", "solver"],
+    "sources": ["detailed_sources_before", "detailed_sources_after"],
+    "sinks": ["detailed_sinks_before", "detailed_sinks_after"],
+    "losses": ["loss_breakdown"],
+    "timeseries": ["time_series"],
+    "sensitivity": ["sensitivity"],
+    "scenario": ["scenario", "fingerprint"],
+}
+
+RUN_ID_PATTERN = re.compile(r'^[0-9a-f]{16,64}$')
+
+_workbook_hashes = {}   # (path, mtime, size) -> sha256 of workbook content
+_code_version = None
+
+
+def run_dir() -> str:
+    return str(getattr(settings, 'SIMULATOR_RUN_DIR', os.path.join(settings.BASE_DIR, 'runs')))
+
+
+def workbook_hash(file_path) -> str:
+    """
+    SHA-256 of the workbook content, cached as long as modification time and size do not change
+    """
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    if key not in _workbook_hashes:
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                sha.update(chunk)
+        _workbook_hashes[key] = sha.hexdigest()
+    return _workbook_hashes[key]
+
+
+def code_version() -> str:
+    """
+    Version of the simulation code and templates
+
+    Uses settings.SIMULATOR_CODE_VERSION (e.g. the git commit of the deployment) if set, otherwise a
+    hash over the sources of the simulator app and the templates, computed once per process.
+    """
+    global _code_version
+    configured = getattr(settings, 'SIMULATOR_CODE_VERSION', None)
+    if configured:
+        return str(configured)
+    if _code_version is None:
+        sha = hashlib.sha256()
+        roots = [os.path.dirname(os.path.abspath(__file__)), os.path.join(settings.BASE_DIR, 'templates')]
+        for root in roots:
+            for dir_path, dir_names, file_names in sorted(os.walk(root)):
+                dir_names.sort()
+                for name in sorted(file_names):
+                    if name.endswith(('.py', '.html')):
+                        path = os.path.join(dir_path, name)
+                        sha.update(os.path.relpath(path, root).encode())
+                        with open(path, 'rb') as f:
+                            sha.update(f.read())
+        _code_version = sha.hexdigest()[:12]
+    return _code_version
+
+
+def make_run_id(file_path, sheet_name, solver, overrides=None) -> str:
+    """
+    Run id of a scenario, derived from workbook content, sheet name, solver, value overrides and code
+    version (regions sharing a workbook sheet share their runs, see scenario_catalog.py)
+
+    The same inputs always give the same result, so everything served under a run id is immutable.
+    The run id is also the key of the result cache.
+    """
+    sha = hashlib.sha256()
+    overrides = json.dumps(sorted((overrides or {}).items()), default=to_json)
+    for part in (workbook_hash(file_path), sheet_name, solver, overrides, code_version()):
+        sha.update(str(part).encode() + b'\0')
+    return sha.hexdigest()[:32]
+
+
+def split_sections(data: dict) -> dict:
+    """
+    Split a result dict of run_oemof_scenario into its sections
+    """
+    sections = {}
+    assigned = set()
+    for section, keys in SECTION_KEYS.items():
+        sections[section] = {k: data[k] for k in keys if k in data}
+        assigned.update(keys)
+    for key, value in data.items():
+        if key not in assigned:
+            sections[key] = {key: value}
+    return sections
+
+
+def section_names(run_id) -> list:
+    path = _run_path(run_id)
+    if path is None or not os.path.isdir(path):
+        return []
+    return sorted(f[:-5] for f in os.listdir(path) if f.endswith('.json'))
+
+
+def save_run(run_id, data: dict):
+    """
+    Store all sections of a result, each file is replaced atomically
+
+    The summary is written last, it marks the run as complete (see run_exists).
+    """
+    path = _run_path(run_id)
+    if path is None:
+        raise ValueError(f"Invalid run id: {run_id}")
+    os.makedirs(path, exist_ok=True)
+
+    sections = split_sections(data)
+    for section in sorted(sections, key=lambda name: name == 'summary'):
+        content = sections[section]
+        fd, tmp_path = tempfile.mkstemp(dir=path, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(content, f, default=to_json)
+        os.replace(tmp_path, os.path.join(path, section + '.json'))
+
+    if RUN_ID_PATTERN.match(str(data.get('fingerprint', ''))):
+        _write_atomic(_fingerprint_path(data['fingerprint']), run_id)
+
+
+def run_with_fingerprint(fingerprint):
+    """
+    Stored run with the given network fingerprint
+
+    Returns:
+        str: run id, None if no complete run has this fingerprint
+    """
+    if not RUN_ID_PATTERN.match(str(fingerprint)):
+        return None
+    try:
+        with open(_fingerprint_path(fingerprint), encoding='utf-8') as f:
+            run_id = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return run_id if run_exists(run_id) else None
+
+
+def load_section(run_id, section):
+    """
+    Load one section of a stored run
+
+    Returns:
+        dict: section content or None if run or section do not exist
+    """
+    path = _run_path(run_id)
+    if path is None or not re.match(r'^[a-z_]+$', section):
+        return None
+    try:
+        with open(os.path.join(path, section + '.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def load_run(run_id):
+    """
+    Load the complete result of a stored run (all sections merged)
+
+    Returns:
+        dict: result as returned by run_oemof_scenario or None if run does not exist
+    """
+    names = section_names(run_id)
+    if not names:
+        return None
+    data = {}
+    for section in names:
+        data.update(load_section(run_id, section) or {})
+    return data
+
+
+def run_exists(run_id) -> bool:
+    path = _run_path(run_id)
+    return path is not None and os.path.isfile(os.path.join(path, 'summary.json'))
+
+
+def run_size(run_id) -> int:
+    """Bytes of the section files of a run, 0 if it does not exist"""
+    path = _run_path(run_id)
+    if path is None or not os.path.isdir(path):
+        return 0
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.name.endswith('.json'))
+
+
+def delete_run(run_id):
+    """
+    Remove a stored run, e.g. evicted from the result cache; the summary first, so the run is incomplete
+    (see run_exists) before its other sections disappear
+    """
+    path = _run_path(run_id)
+    if path is None:
+        return
+    try:
+        os.remove(os.path.join(path, 'summary.json'))
+    except FileNotFoundError:
+        pass
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def run_mtime(run_id):
+    """
+    Time (seconds since epoch) a run was stored, None if it does not exist
+    """
+    path = _run_path(run_id)
+    if path is None:
+        return None
+    try:
+        return os.path.getmtime(os.path.join(path, 'summary.json'))
+    except OSError:
+        return None
+
+
+def _fingerprint_path(fingerprint):
+    return os.path.join(run_dir(), 'fingerprints', fingerprint)
+
+
+def _write_atomic(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _run_path(run_id):
+    if not RUN_ID_PATTERN.match(str(run_id)):   # run ids end up in file paths
+        return None
+    return os.path.join(run_dir(), run_id)
+
+
+def to_json(value):
+    """json.dump default: numpy scalars (e.g. int64 from pandas sums) are not JSON serializable"""
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
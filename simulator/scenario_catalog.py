@@ -0,0 +1,107 @@
+"""
+Scenario catalog: which workbook sheet describes the energy system of a region
+
+settings.SIMULATOR_REGIONS maps a region to [workbook, sheet], relative workbook paths are resolved in
+simulator/data. Regions sharing a sheet share their runs (the run id depends on the scenario, not on the
+region). The sheets of all regions are parsed and their models built at boot (worker_pool.preload) and
+their results solved ahead of time (prebuild(), also 'manage.py build_catalog'), so switching the region
+is a lookup in the run store.
+"""
+
+import os
+
+from django.conf import settings
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+DEFAULT_REGION = 'Germany'   # preselected on the home page
+
+
+def regions() -> dict:
+    """
+    Returns:
+        dict: region -> {'workbook': absolute path, 'sheet': sheet name}, in the order of the settings
+    """
+    from .oemof_runner import DEFAULT_WORKBOOK, DEFAULT_SHEET
+
+    configured = getattr(settings, 'SIMULATOR_REGIONS', None) or {DEFAULT_REGION: [DEFAULT_WORKBOOK, DEFAULT_SHEET]}
+    return {region: {'workbook': os.path.join(DATA_DIR, workbook), 'sheet': sheet}   # join keeps absolute paths
+            for region, (workbook, sheet) in configured.items()}
+
+
+def scenario_for(region):
+    """
+    Workbook and sheet of a region
+
+    Returns:
+        dict: {'workbook': ..., 'sheet': ...}
+
+    Raises:
+        KeyError: unknown region
+    """
+    return regions()[region]
+
+
+def scenarios() -> list:
+    """Distinct (workbook, sheet) pairs of all regions"""
+    return list(dict.fromkeys((scenario['workbook'], scenario['sheet']) for scenario in regions().values()))
+
+
+def prebuild():
+    """
+    Solve and store the results of all regions which are not stored yet
+
+    Returns:
+        list: (region, run id, True if it was solved now) for all regions
+    """
+    from .oemof_runner import solver_name
+    from .result_cache import cached_run_oemof_scenario
+    from .run_store import make_run_id, run_exists
+
+    built = []
+    for region, scenario in regions().items():
+        run_id = make_run_id(scenario['workbook'], scenario['sheet'], solver_name())
+        solved = not run_exists(run_id)
+        if solved:   # stored by the result cache
+            run_id, _ = cached_run_oemof_scenario(scenario['workbook'], scenario['sheet'])
+        built.append((region, run_id, solved))
+    return built
+
+
+def resolve_scenario(reference) -> dict:
+    """
+    Workbook path, sheet and overrides of a scenario reference as stored with a run
+
+    Args:
+        reference: {'workbook': name in simulator/data or absolute path, 'sheet': ..., 'overrides': ...}
+
+    Returns:
+        dict: {'workbook': absolute path, 'sheet': ..., 'overrides': dict}
+    """
+    return {'workbook': os.path.join(DATA_DIR, reference['workbook']), 'sheet': reference['sheet'],
+            'overrides': dict(reference.get('overrides') or {})}
+
+
+def scenario_of_run(run_id):
+    """
+    Scenario a stored run was solved from
+
+    Runs evicted from the result cache are found by the scenario it kept, runs stored before the scenario
+    was stored with them among the region scenarios.
+
+    Returns:
+        dict: see resolve_scenario(), None for an unknown run
+    """
+    from .oemof_runner import solver_name
+    from .result_cache import evicted_scenario
+    from .run_store import load_section, make_run_id
+
+    section = load_section(run_id, 'scenario')
+    if section is not None:
+        return resolve_scenario(section['scenario'])
+    reference = evicted_scenario(run_id)
+    if reference is not None:
+        return resolve_scenario(reference)
+    for workbook, sheet in scenarios():
+        if make_run_id(workbook, sheet, solver_name()) == run_id:
+            return {'workbook': workbook, 'sheet': sheet, 'overrides': {}}
+    return None
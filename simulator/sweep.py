@@ -0,0 +1,345 @@
+"""
+Parameter sweeps: solve a scenario for every point of a grid of parameter values
+
+The parameters are values of the workbook (usually those with a 'Free Parameter'). The sheet is parsed
+and the model built once in the calling process (validating the parameters and fixing the flow columns)
+before the solve processes are forked, so they share the parsed sheet and the imported solver stack.
+Every solve process builds the model once more as a what_if.RetainedModel and solves each of its points
+by changing only the bounds and coefficients of the swept values, answered from the stored basis or by
+a warm-started re-solve.
+
+Every point becomes one row of a CSV file: the parameter values, the energy totals and the total of every
+flow. Rows are written as they are solved, in completion order, and a sweep which finds its output file
+already started solves the missing and the failed points only. When all points are solved, the rows are
+also written column by column, ordered by point, to a .npz file next to the CSV (numpy.load() gives an
+array per column). With batch > 1 each solve process solves that many points as one LP of freshly built
+models instead (see batching.py).
+"""
+
+import collections
+import contextlib
+import csv
+import itertools
+import logging
+import multiprocessing
+import os
+import tempfile
+
+TOTALS = ['sources_before', 'sinks_before', 'sources_after_raw', 'sinks_after', 'losses']
+STATUS_COLUMNS = ['status', 'solver', 'error']
+
+logger = logging.getLogger(__name__)
+
+# scenario of a solve process, set by init_solve_process, its model, built on the first point, and the numbers
+# of the values of that model's scenario
+_scenario = None
+_retained = None
+_scenario_values = None
+_devnull = None
+
+_Value = collections.namedtuple('_Value', 'id value')
+
+
+def parse_parameter(spec):
+    """
+    Values of one sweep parameter
+
+    Args:
+        spec: 'NAME=START:STOP:COUNT' (COUNT evenly spaced values including START and STOP),
+            'NAME=V1,V2,...' or 'NAME=VALUE'
+
+    Returns:
+        tuple: (name, list of float values)
+
+    Raises:
+        ValueError: malformed spec
+    """
+    name, sep, values = spec.partition('=')
+    if not sep or not name.strip():
+        raise ValueError(f"Expected NAME=START:STOP:COUNT or NAME=V1,V2,... instead of '{spec}'")
+    if ':' in values:
+        start, stop, count = values.split(':')
+        start, stop, count = float(start), float(stop), int(count)
+        if count < 1:
+            raise ValueError(f"COUNT must be at least 1 in '{spec}'")
+        if count == 1:
+            return name.strip(), [start]
+        return name.strip(), [start + (stop - start) * i / (count - 1) for i in range(count)]
+    return name.strip(), [float(value) for value in values.split(',')]
+
+
+def grid(parameters):
+    """
+    All points of the grid in a fixed order, the point number is the position in this order
+
+    Args:
+        parameters: list of (name, values)
+
+    Returns:
+        iterator of (point number, {name: value})
+    """
+    names = [name for name, _ in parameters]
+    for index, values in enumerate(itertools.product(*(values for _, values in parameters))):
+        yield index, dict(zip(names, values))
+
+
+def grid_size(parameters) -> int:
+    size = 1
+    for _, values in parameters:
+        size *= len(values)
+    return size
+
+
+def build_template(file_path, sheet_name, parameters):
+    """
+    Parse the sheet and build the model once with the first point of the grid
+
+    Returns:
+        list: flow column names ('<from> -> <to>'), identical for all points of the sheet
+
+    Raises:
+        ValueError: a parameter is not a value of the sheet
+    """
+    from .model.model_factory import ExcelModelFactory
+
+    _, first_point = next(grid(parameters))
+    model = ExcelModelFactory(file_path, sheet_name, first_point).model
+    return sorted(f"{i} -> {o}" for i, o in model.flows)
+
+
+def columns(parameters, flows) -> list:
+    return ['point'] + [name for name, _ in parameters] + STATUS_COLUMNS + TOTALS + flows
+
+
+def solved_points(output, header, parameters) -> set:
+    """
+    Point numbers solved in output; cuts off a row left incomplete by an interrupted sweep and removes the
+    rows of failed points, which are solved again
+
+    Raises:
+        ValueError: output belongs to a different sweep
+    """
+    if not os.path.exists(output) or os.path.getsize(output) == 0:
+        return set()
+    with open(output, 'rb+') as f:
+        content = f.read()
+        if not content.endswith(b'\n'):
+            f.truncate(content.rfind(b'\n') + 1)
+
+    points = dict(grid(parameters))
+    status = header.index('status')
+    solved, failed = set(), 0
+    with open(output, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        if next(reader, None) != header:
+            raise ValueError(f"{output} has other columns, it was written by a different sweep")
+        for row in reader:
+            index = int(row[0])
+            expected = points.get(index)
+            if expected is None or [float(value) for value in row[1:1 + len(expected)]] != list(expected.values()):
+                raise ValueError(f"Point {index} of {output} has other parameter values, it was written by a "
+                                 f"different sweep")
+            if row[status] == 'ok':
+                solved.add(index)
+            else:
+                failed += 1
+    if failed:
+        _keep_rows(output, lambda row: row[status] == 'ok')
+        logger.info('failed points solved again', extra={'points': failed, 'output': output})
+    return solved
+
+
+def _keep_rows(output, keep):
+    # rewrite output with the header and the rows for which keep(row) is true, replaced atomically
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output)), suffix='.tmp')
+    with open(output, newline='', encoding='utf-8') as source, os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+        reader, writer = csv.reader(source), csv.writer(f)
+        writer.writerow(next(reader))
+        writer.writerows(row for row in reader if keep(row))
+    os.replace(tmp_path, output)
+
+
+def columnar_path(output) -> str:
+    return os.path.splitext(output)[0] + '.npz'
+
+
+def write_columns(output, header):
+    """
+    Write the rows of output column by column, ordered by point, to columnar_path(output)
+
+    Numeric columns become float arrays (nan where a failed point has no value), the status columns
+    string arrays.
+
+    Returns:
+        str: path of the .npz file
+    """
+    import numpy as np
+
+    with open(output, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader)
+        rows = sorted(reader, key=lambda row: int(row[0]))
+    values = {}
+    for position, name in enumerate(header):
+        column = [row[position] for row in rows]
+        if name in STATUS_COLUMNS:
+            values[name] = np.array(column, dtype=str)
+        elif name == 'point':
+            values[name] = np.array(column, dtype=np.int64)
+        else:
+            values[name] = np.array([float(value) if value != '' else np.nan for value in column])
+    path = columnar_path(output)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.npz')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, **values)
+    os.replace(tmp_path, path)
+    return path
+
+
+def init_solve_process(file_path, sheet_name, log_level):
+    """
+    Initializer of the processes of a pool running solve_in_process()
+
+    The metrics of the process are written when it exits, which the pool must let it do (close() and join()
+    instead of terminate()): pool processes end by os._exit(), which skips atexit.
+    """
+    global _scenario, _devnull
+    from multiprocessing.util import Finalize
+    from . import metrics
+
+    _scenario = (file_path, sheet_name)
+    _devnull = open(os.devnull, 'w')
+    logging.getLogger('simulator').setLevel(log_level)
+    Finalize(None, metrics.flush, exitpriority=0)
+
+
+def _retained_model(overrides):
+    # model of the pool process, built with the values of its first (feasible) point
+    global _retained, _scenario_values
+    from .what_if import RetainedModel
+
+    if _retained is None:
+        file_path, sheet_name = _scenario
+        _retained = RetainedModel({'workbook': file_path, 'sheet': sheet_name, 'overrides': overrides})
+        _scenario_values = {vid: float(value.value) for vid, value in _retained.factory.value_collection.values.items()}
+    return _retained
+
+
+def solve_in_process(overrides):
+    """
+    Results of a point (see summarize_results()) from the model of the pool process, built with the values
+    of its first (feasible) point and changed to the values of each further point, without the solver log
+    """
+    with contextlib.redirect_stdout(_devnull):   # the solver log of thousands of points is not wanted
+        retained = _retained_model(overrides)
+        value_collection = retained.value_collection(overrides)
+        retained.apply(value_collection)
+        return retained.solve_from_basis(value_collection) or retained.solve(value_collection)
+
+
+class _Values:
+    """
+    Stands in for the ValueCollection of a point in summarize(): the numbers of its values, no formulas
+    """
+
+    def __init__(self, values):
+        self.values = {vid: _Value(vid, value) for vid, value in values.items()}
+
+
+def solve_values_in_process(overrides, values):
+    """
+    solve_in_process() with the formula values evaluated already (e.g. by monte_carlo.propagate()), they are
+    not evaluated again per point
+
+    Args:
+        overrides: simple values of the point, the model of the process is built with them on its first point
+        values: value id -> number of every value of the point which differs from those of the scenario
+    """
+    with contextlib.redirect_stdout(_devnull):
+        retained = _retained_model(overrides)
+        values = dict(_scenario_values, **values)
+        retained.apply_values(values)
+        value_collection = _Values(values)
+        return retained.solve_from_basis(value_collection) or retained.solve(value_collection)
+
+
+def _row(index, overrides, data):
+    # one row of the output from the result of a point or the exception solving it raised
+    row = dict(point=index, **overrides)
+    if isinstance(data, Exception):
+        return dict(row, status='failed', error=str(data))
+    row.update((total, data[total]) for total in TOTALS)
+    row.update((flow, sum(values)) for flow, values in data['time_series']['flows'].items())
+    return dict(row, status='ok', solver=data['solver'])
+
+
+def _solve_point(task):
+    # runs in a solve process: one row of the output
+    index, overrides = task
+    try:
+        data = solve_in_process(overrides)
+    except Exception as e:
+        data = e
+    return _row(index, overrides, data)
+
+
+def _solve_points(tasks):
+    # runs in a solve process: the rows of several points solved as one LP (see batching.py)
+    from .batching import solve_batch
+
+    with contextlib.redirect_stdout(_devnull):
+        outcomes = solve_batch([(*_scenario, overrides) for _, overrides in tasks])
+    return [_row(index, overrides, data) for (index, overrides), data in zip(tasks, outcomes)]
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def run_sweep(file_path, sheet_name, parameters, output, processes=None, log_level=logging.WARNING, batch=1):
+    """
+    Solve all points of the grid which are not solved in output yet and append them to output, then write
+    the columns of all points (see write_columns())
+
+    Args:
+        parameters: list of (name, values), see parse_parameter()
+        output: CSV file, created or continued
+        processes: number of solve processes, default: number of CPUs
+        log_level: level of the simulator loggers in the solve processes
+        batch: number of points solved together as one LP (see batching.py), 1: every point on its own
+
+    Returns:
+        iterator of (row dict, number of points done, number of points), one item per solved point
+
+    Raises:
+        ValueError: unknown parameter or output of a different sweep
+    """
+    flows = build_template(file_path, sheet_name, parameters)
+    header = columns(parameters, flows)
+    solved = solved_points(output, header, parameters)
+    total = grid_size(parameters)
+    todo = ((index, point) for index, point in grid(parameters) if index not in solved)
+    logger.info('sweep started', extra={'points': total, 'solved': len(solved), 'output': output})
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, header, restval='')
+        if f.tell() == 0:
+            writer.writeheader()
+        done = len(solved)
+        with multiprocessing.Pool(processes, initializer=init_solve_process,
+                                  initargs=(file_path, sheet_name, log_level)) as pool:
+            if batch > 1:
+                rows = itertools.chain.from_iterable(pool.imap_unordered(_solve_points, _chunks(todo, batch)))
+            else:
+                rows = pool.imap_unordered(_solve_point, todo, chunksize=4)
+            for row in rows:
+                writer.writerow(row)
+                f.flush()   # a row written is a point solved, also after an interruption
+                done += 1
+                yield row, done, total
+            pool.close()   # the processes exit and write their metrics, see init_solve_process()
+            pool.join()
+    write_columns(output, header)
@@ -1,3 +1,1045 @@
-from django.test import TestCase
+import contextlib
+import io
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.test import Client, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from . import metrics
+
+HEADINGS = ('Ignore', 'Type', 'Name', 'Value', 'Unit', 'Free Parameter', 'Input', 'Output', 'Weight')
+
+# two sub-networks which share no bus: a transformer chain whose demand is topped up by a costly excess
+# source, and a fixed source feeding a fixed sink with the surplus going to an excess sink
+# (type, name, value, free parameter, input, output, weight)
+TWO_COMPONENTS = [
+    ('Source', 'Src_A', 500, None, None, 'b_a', None),
+    ('Transformer', 'Tr_A', None, None, 'b_a', None, None),
+    (None, None, None, None, None, 'b_dem', 0.8),
+    ('Sink', 'Snk_Dem', 600, None, 'b_dem', None, None),
+    ('Source', 'Src_b_dem_excess', 1000, 'Src_b_dem_excess', None, 'b_dem', None),
+    ('Sink', 'Snk_b_dem_excess', 1000, 'Snk_b_dem_excess', 'b_dem', None, None),
+    ('Source', 'Src_B', 100, None, None, 'b_b', None),
+    ('Sink', 'Snk_B', 50, None, 'b_b', None, None),
+    ('Sink', 'Snk_b_b_excess', 1000, 'Snk_b_b_excess', 'b_b', None, None),
+]
+TWO_COMPONENTS_FLOWS = {
+    'Src_A -> b_a': 500, 'b_a -> Tr_A': 500, 'Tr_A -> b_dem': 400, 'b_dem -> Snk_Dem': 600,
+    'Src_b_dem_excess -> b_dem': 200, 'b_dem -> Snk_b_dem_excess': 0,
+    'Src_B -> b_b': 100, 'b_b -> Snk_B': 50, 'b_b -> Snk_b_b_excess': 50,
+}
+
+
+def write_workbook(path, sheets):
+    """
+    Write a scenario workbook
+
+    Args:
+        path: xlsx file to write
+        sheets: dict sheet name -> rows (type, name, value, free parameter, input, output, weight)
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    wb.remove(wb.active)
+    for title, rows in sheets.items():
+        ws = wb.create_sheet(title)
+        ws.append(HEADINGS)
+        for entity_type, name, value, free, bus_in, bus_out, weight in rows:
+            ws.append((None, entity_type, name, value, 'GWh' if value is not None else None, free, bus_in, bus_out,
+                       weight))
+    wb.save(path)
+
+
+def quiet(function, *args, **kwargs):
+    # function(*args, **kwargs) without the solver log on stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+class TempRunDirTestCase(SimpleTestCase):
+    """Run store, job queue, caches and metrics in a temporary directory, workbooks written there, too"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        settings = override_settings(
+            SIMULATOR_RUN_DIR=self.tmp, SIMULATOR_JOB_DB=os.path.join(self.tmp, 'jobs.sqlite3'),
+            SIMULATOR_METRICS_DB=os.path.join(self.tmp, 'metrics.sqlite3'),
+            SIMULATOR_RESULT_CACHE={'PATH': os.path.join(self.tmp, 'result_cache.sqlite3')})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.addCleanup(metrics.flush)   # into this directory, before it is removed
+
+    def workbook(self, sheets):
+        path = os.path.join(self.tmp, f'workbook_{len(os.listdir(self.tmp))}.xlsx')
+        write_workbook(path, sheets)
+        return path
+
+    def assertFlows(self, data, expected, places=6):
+        flows = data['time_series']['flows']
+        for flow, value in expected.items():
+            self.assertAlmostEqual(flows[flow][0], value, places=places, msg=flow)
+
+
+class ComponentModelsTests(TempRunDirTestCase):
+
+    def test_one_model_per_component(self):
+        from .model.model_factory import ExcelModelFactory
+
+        factory = ExcelModelFactory(self.workbook({'Zwei': TWO_COMPONENTS}), 'Zwei')
+        self.assertEqual([{str(node) for node in nodes} for nodes in factory.connected_components()], [
+            {'Src_A', 'b_a', 'Tr_A', 'b_dem', 'Snk_Dem', 'Src_b_dem_excess', 'Snk_b_dem_excess'},
+            {'Src_B', 'b_b', 'Snk_B', 'Snk_b_b_excess'}])
+        self.assertEqual(len(factory.component_models()), 2)
+
+    def test_components_solved_in_processes(self):
+        # also while the timer thread writing the metrics runs
+        from . import oemof_runner
+
+        metrics.inc('simulator_solves_total', solver='test', status='ok', termination='optimal')
+        with mock.patch.object(oemof_runner, '_load_solution', wraps=oemof_runner._load_solution) as loaded:
+            data = quiet(oemof_runner.run_oemof_scenario, self.workbook({'Zwei': TWO_COMPONENTS}), 'Zwei',
+                         engine='oemof')
+        self.assertEqual(loaded.call_count, 1)   # the solution of the second component from its process
+        self.assertFlows(data, TWO_COMPONENTS_FLOWS)
+        self.assertAlmostEqual(data['sensitivity']['shadow_prices']['b_dem'][0], 24000)
+
+    def test_components_solved_in_sequence_by_threaded_process(self):
+        # a process with other threads (web server, job workers) is not forked
+        from .oemof_runner import run_oemof_scenario
+
+        path = self.workbook({'Zwei': TWO_COMPONENTS})
+        outcome = {}
+
+        def solve():
+            outcome.update(quiet(run_oemof_scenario, path, 'Zwei', engine='oemof'))
+
+        thread = threading.Thread(target=solve)
+        with mock.patch('simulator.oemof_runner._load_solution') as loaded:
+            thread.start()
+            thread.join()
+        loaded.assert_not_called()
+        self.assertFlows(outcome, TWO_COMPONENTS_FLOWS)
+
+    def test_components_solved_in_sequence_by_daemonic_process(self):
+        # e.g. a process of a batch run, which cannot start processes
+        from .oemof_runner import run_oemof_scenario
+
+        path = self.workbook({'Zwei': TWO_COMPONENTS})
+        with mock.patch('multiprocessing.current_process', return_value=mock.Mock(daemon=True)), \
+                mock.patch('simulator.oemof_runner._load_solution') as loaded:
+            data = quiet(run_oemof_scenario, path, 'Zwei', engine='oemof')
+        loaded.assert_not_called()
+        self.assertFlows(data, TWO_COMPONENTS_FLOWS)
+
+
+class DirectLPTests(TempRunDirTestCase):
+
+    def test_bundled_scenarios_match_oemof(self):
+        # flows, bus duals, reduced costs and totals of every bundled scenario sheet, within direct_lp.TOLERANCE
+        from .batch import batch_tasks
+        from .direct_lp import SOLVER, CLOSED_FORM, TOLERANCE, compare, objective
+        from .model.model_factory import ExcelModelFactory
+        from .oemof_runner import run_oemof_scenario
+        from .scenario_catalog import DATA_DIR
+
+        for workbook, sheet in batch_tasks([os.path.join(DATA_DIR, '*.xlsx')]):
+            with self.subTest(workbook=os.path.basename(workbook), sheet=sheet):
+                expected = quiet(run_oemof_scenario, workbook, sheet, engine='oemof')
+                actual = run_oemof_scenario(workbook, sheet, engine='direct')
+                self.assertIn(actual['solver'], (SOLVER, CLOSED_FORM))
+                differences = compare(expected, actual)
+                if differences:   # cost free cycles: another optimal solution, same objective, duals and totals
+                    energy_system = ExcelModelFactory(workbook, sheet).energy_system
+                    self.assertTrue(math.isclose(objective(energy_system, expected['time_series']['flows']),
+                                                 objective(energy_system, actual['time_series']['flows']),
+                                                 rel_tol=TOLERANCE))
+                    self.assertEqual([difference for difference in differences
+                                      if not difference.startswith(('time_series.flows.', 'loss_breakdown.'))], [])
+
+    def test_free_flows_solved_by_highs(self):
+        from .direct_lp import SOLVER, compare
+        from .oemof_runner import run_oemof_scenario
+
+        path = self.workbook({'Zwei': TWO_COMPONENTS})
+        expected = quiet(run_oemof_scenario, path, 'Zwei', engine='oemof')
+        actual = run_oemof_scenario(path, 'Zwei', engine='direct')
+        self.assertEqual(actual['solver'], SOLVER)
+        self.assertFlows(actual, TWO_COMPONENTS_FLOWS)
+        self.assertEqual(compare(expected, actual), [])
+
+
+# every flow determined by the fixed flows: two fixed sources, a transformer with two outputs, two fixed sinks
+DETERMINED = [
+    ('Source', 'Src_Test', 500, None, None, 'b_test_src', None),
+    ('Source', 'Src_Zwei', 100, None, None, 'b_test_src', None),
+    ('Transformer', 'Tr_Test', None, None, 'b_test_src', None, None),
+    (None, None, None, None, None, 'b_test', 0.8),
+    (None, None, None, None, None, 'b_wrm', 0.15),
+    ('Sink', 'Snk_Test', 480, None, 'b_test', None, None),
+    ('Sink', 'Snk_Wrm', 90, None, 'b_wrm', None, None),
+]
+
+
+class PropagationTests(TempRunDirTestCase):
+
+    def test_determined_network_needs_no_lp(self):
+        from .direct_lp import CLOSED_FORM, DirectLP, compare
+        from .model.model_factory import ExcelModelFactory
+        from .oemof_runner import run_oemof_scenario
+
+        path = self.workbook({'Det': DETERMINED})
+        lp = DirectLP(ExcelModelFactory(path, 'Det').energy_system)
+        self.assertTrue(lp.determined())
+        self.assertEqual(lp.solve()['lp_columns'], 0)
+
+        expected = quiet(run_oemof_scenario, path, 'Det', engine='oemof')
+        actual = run_oemof_scenario(path, 'Det', engine='direct')
+        self.assertEqual(actual['solver'], CLOSED_FORM)
+        self.assertFlows(actual, {'Src_Test -> b_test_src': 500, 'b_test_src -> Tr_Test': 600,
+                                  'Tr_Test -> b_test': 480, 'Tr_Test -> b_wrm': 90})
+        self.assertEqual(compare(expected, actual), [])
+
+    def test_partly_determined_network(self):
+        # the sub-network of Src_B is determined, the excess source and sink of b_dem go to HiGHS
+        from .direct_lp import DirectLP
+        from .model.model_factory import ExcelModelFactory
+
+        lp = DirectLP(ExcelModelFactory(self.workbook({'Zwei': TWO_COMPONENTS}), 'Zwei').energy_system)
+        self.assertFalse(lp.determined())
+        self.assertEqual(lp.solve()['lp_columns'], 2)
+
+    def test_infeasible_fixed_flows(self):
+        from .oemof_runner import run_oemof_scenario
+
+        path = self.workbook({'Det': DETERMINED})
+        with self.assertRaisesRegex(ValueError, 'Infeasible'):
+            run_oemof_scenario(path, 'Det', {'Snk_Wrm': 89}, engine='direct')
+
+
+class ImportBudgetTests(SimpleTestCase):
+
+    def test_parse_importtime(self):
+        from .management.commands.check_import_budget import parse_importtime
+
+        report = ('import time: self [us] | cumulative | imported package\n'
+                  'import time:       120 |        120 |   _io\n'
+                  'import time:      2048 |       5000 | config.asgi\n'
+                  'some other line\n')
+        self.assertEqual(parse_importtime(report), [('_io', 120, 120), ('config.asgi', 2048, 5000)])
+
+    def test_startup_without_optimization_stack(self):
+        # a budget of 0 ms fails only after the check of the heavy modules passed
+        from django.core.management import CommandError, call_command
+
+        out = io.StringIO()
+        with self.assertRaisesRegex(CommandError, 'exceeds the budget'):
+            call_command('check_import_budget', budget_ms=0, stdout=out)
+        self.assertIn('modules imported in', out.getvalue())
+        self.assertNotRegex(out.getvalue(), r'\b(numpy|pandas|oemof|pyomo|sympy|openpyxl|highspy)\b')
+
+    def test_optimization_stack_at_startup_fails(self):
+        from django.core.management import CommandError, call_command
+
+        with mock.patch('simulator.management.commands.check_import_budget.STARTUP_CODE', 'import numpy'), \
+                self.assertRaisesRegex(CommandError, 'Optimization stack imported at startup: numpy'):
+            call_command('check_import_budget', stdout=io.StringIO())
+
+
+class DownsamplingTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(26)
+        self.y = np.cumsum(rng.normal(size=8760))   # hourly values of a year
+        self.y[1234] = 500   # spikes the chart must not lose
+        self.y[5678] = -500
+
+    def test_lttb_keeps_endpoints_and_count(self):
+        from .downsampling import lttb_indices
+
+        indices = lttb_indices(self.y, 600)
+        self.assertEqual(len(indices), 600)
+        self.assertEqual((indices[0], indices[-1]), (0, len(self.y) - 1))
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        self.assertIn(1234, indices)
+        self.assertIn(5678, indices)
+
+    def test_points_per_chart_width(self):
+        from .downsampling import downsample_series
+
+        index = [f't{k}' for k in range(len(self.y))]
+        payload = downsample_series(index, self.y.tolist(), width=800)
+        self.assertEqual(payload['points'], 800)
+        self.assertEqual((payload['x'][0], payload['x'][-1]), (index[0], index[-1]))
+        self.assertFalse(payload['full_resolution'])
+
+        short = downsample_series(index[:100], self.y[:100].tolist(), width=800)
+        self.assertTrue(short['full_resolution'])
+        self.assertEqual(short['y'], self.y[:100].tolist())
+
+    def test_min_max_envelope(self):
+        from .downsampling import min_max_envelope
+
+        starts, minima, maxima = min_max_envelope(self.y, 300)
+        self.assertEqual(len(starts), 300)
+        for start, stop, low, high in zip(starts, list(starts[1:]) + [len(self.y)], minima, maxima):
+            self.assertEqual((low, high), (self.y[start:stop].min(), self.y[start:stop].max()))
+        self.assertEqual((minima.min(), maxima.max()), (self.y.min(), self.y.max()))
+
+
+class FormatNumberTests(SimpleTestCase):
+
+    def test_german_notation(self):
+        from .value.value import format_number
+
+        cases = [
+            (0, {}, '0,00'),
+            (0.004, {}, '0,00'),
+            (-0.004, {}, '0,00'),
+            (0.125, {'decimals': 3}, '0,125'),
+            (12.5, {}, '12,50'),
+            (-12.5, {}, '-12,50'),
+            (1234.5, {}, '1.234,50'),
+            (-1234567.891, {}, '-1.234.567,89'),
+            (2.5e9, {'decimals': 0}, '2.500.000.000'),
+            ('7', {}, '7,00'),
+        ]
+        for number, options, expected in cases:
+            with self.subTest(number=number, **options):
+                self.assertEqual(format_number(number, **options), expected)
+
+
+class FingerprintTests(TempRunDirTestCase):
+
+    @staticmethod
+    def entities(rows):
+        # rows grouped per entity, a transformer with its output rows
+        entities = []
+        for row in rows:
+            if row[0] is None:
+                entities[-1].append(row)
+            else:
+                entities.append([row])
+        return entities
+
+    def fingerprint(self, rows, overrides=None):
+        from .fingerprint import fingerprint
+        from .model.model_factory import ExcelModelFactory
+
+        factory = ExcelModelFactory(self.workbook({'Sheet': rows}), 'Sheet', overrides)
+        return fingerprint(factory.energy_system, factory.value_collection, 'cbc')
+
+    def test_invariant_to_order(self):
+        for rows in (TWO_COMPONENTS, DETERMINED):
+            entities = self.entities(rows)
+            reordered = [row for entity in reversed(entities) for row in entity]
+            # the output rows of a transformer in the opposite order
+            swapped = [row for entity in entities for row in [entity[0]] + entity[:0:-1]]
+            self.assertEqual(self.fingerprint(reordered), self.fingerprint(rows))
+            self.assertEqual(self.fingerprint(swapped), self.fingerprint(rows))
+
+    def test_changes_with_values(self):
+        base = self.fingerprint(TWO_COMPONENTS)
+        self.assertNotEqual(self.fingerprint(TWO_COMPONENTS, {'Snk_B': 60}), base)
+        weight = [row[:6] + (0.7,) if row[5] == 'b_dem' and row[0] is None else row for row in TWO_COMPONENTS]
+        self.assertNotEqual(self.fingerprint(weight), base)
+        self.assertEqual(self.fingerprint(TWO_COMPONENTS), base)
+
+    def test_changes_with_solver(self):
+        from .fingerprint import fingerprint
+        from .model.model_factory import ExcelModelFactory
+
+        factory = ExcelModelFactory(self.workbook({'Zwei': TWO_COMPONENTS}), 'Zwei')
+        self.assertNotEqual(fingerprint(factory.energy_system, factory.value_collection, 'cbc'),
+                            fingerprint(factory.energy_system, factory.value_collection, 'highs'))
+
+
+@override_settings(SIMULATOR_ENGINE='oemof')
+class BatchingTests(TempRunDirTestCase):
+
+    def test_batch_equals_single_solves(self):
+        from .batching import solve_batch
+        from .direct_lp import compare
+        from .oemof_runner import DEFAULT_SHEET, DEFAULT_WORKBOOK, run_oemof_scenario
+
+        path = self.workbook({'Zwei': TWO_COMPONENTS, 'Det': DETERMINED})
+        scenarios = [(path, 'Zwei', {}), (DEFAULT_WORKBOOK, DEFAULT_SHEET, {'Snk_Personenverkehr': 120000}),
+                     (path, 'Det', {}), (path, 'Zwei', {'Snk_B': 80}), (DEFAULT_WORKBOOK, DEFAULT_SHEET, {})]
+        outcomes = quiet(solve_batch, scenarios)
+        for scenario, outcome in zip(scenarios, outcomes):
+            with self.subTest(sheet=scenario[1], overrides=scenario[2]):
+                expected = quiet(run_oemof_scenario, *scenario)
+                self.assertEqual(outcome['scenario'], expected['scenario'])
+                self.assertEqual(outcome['fingerprint'], expected['fingerprint'])
+                self.assertEqual(compare(expected, outcome), [])
+        self.assertFlows(outcomes[3], {'b_b -> Snk_B': 80, 'b_b -> Snk_b_b_excess': 20})
+
+    def test_infeasible_scenario_solved_on_its_own(self):
+        # one infeasible scenario makes the batch LP infeasible, the others are still solved
+        from .batching import solve_batch
+
+        path = self.workbook({'Zwei': TWO_COMPONENTS, 'Det': DETERMINED})
+        outcomes = quiet(solve_batch, [(path, 'Zwei', {}), (path, 'Det', {'Snk_Wrm': 89}), (path, 'Det', {})])
+        self.assertFlows(outcomes[0], TWO_COMPONENTS_FLOWS)
+        self.assertIsInstance(outcomes[1], Exception)
+        self.assertFlows(outcomes[2], {'Tr_Test -> b_wrm': 90})
+
+    def test_identical_networks_solved_once(self):
+        from .batching import solve_batch
+
+        path = self.workbook({'Zwei': TWO_COMPONENTS, 'Kopie': TWO_COMPONENTS})
+        first, second = quiet(solve_batch, [(path, 'Zwei', {}), (path, 'Kopie', {})])
+        self.assertEqual(first['fingerprint'], second['fingerprint'])
+        self.assertEqual(second['scenario']['sheet'], 'Kopie')
+        self.assertFlows(second, TWO_COMPONENTS_FLOWS)
+
+
+class BatchRunTests(TempRunDirTestCase):
+
+    def statuses(self, tasks, **options):
+        from .batch import run_batch
+
+        return {row['sheet']: row['status'] for row, _, _ in run_batch(tasks, jobs=1, **options)}
+
+    def test_row_statuses(self):
+        infeasible = [row[:2] + (200,) + row[3:] if row[1] == 'Snk_B' else row for row in TWO_COMPONENTS]
+        path = self.workbook({'Zwei': TWO_COMPONENTS, 'Kopie': TWO_COMPONENTS, 'Zuviel': infeasible})
+        tasks = [(path, 'Zwei'), (path, 'Kopie'), (path, 'Zuviel')]
+        self.assertEqual(self.statuses(tasks), {'Zwei': 'solved', 'Kopie': 'deduplicated', 'Zuviel': 'failed'})
+        self.assertEqual(self.statuses(tasks), {'Zwei': 'cached', 'Kopie': 'cached', 'Zuviel': 'failed'})
+
+    def test_identical_networks_of_one_lp_deduplicated(self):
+        path = self.workbook({'Zwei': TWO_COMPONENTS, 'Kopie': TWO_COMPONENTS})
+        self.assertEqual(self.statuses([(path, 'Zwei'), (path, 'Kopie')], batch=2),
+                         {'Zwei': 'solved', 'Kopie': 'deduplicated'})
+
+    def test_timeout(self):
+        path = self.workbook({'Zwei': TWO_COMPONENTS})
+        with mock.patch('simulator.batch._solve_and_store', side_effect=lambda tasks, connection: time.sleep(10)):
+            self.assertEqual(self.statuses([(path, 'Zwei')], timeout=0.5), {'Zwei': 'timeout'})
+
+
+# a choice between two transformers: the demand not covered by Src_A comes from the costly gas source through
+# Tr_B (cost per unit of demand 1 / COP_B) rather than from the even costlier excess source of b_dem
+CHOICE = [
+    ('Parameter', 'ETA_A', 0.8, None, None, None, None),
+    ('Parameter', 'COP_B', 1.5, None, None, None, None),
+    ('Source', 'Src_A', 500, None, None, 'b_a', None),
+    ('Transformer', 'Tr_A', None, None, 'b_a', None, None),
+    (None, None, None, None, None, 'b_dem', 'ETA_A'),
+    ('Source', 'Src_Gas_excess', 300, 'Src_Gas_excess', None, 'b_gas', None),
+    ('Transformer', 'Tr_B', None, None, 'b_gas', None, None),
+    (None, None, None, None, None, 'b_dem', 'COP_B'),
+    ('Sink', 'Snk_Dem', 600, None, 'b_dem', None, None),
+    ('Source', 'Src_b_dem_excess', 1000, 'Src_b_dem_excess', None, 'b_dem', None),
+    ('Sink', 'Snk_b_dem_excess', 1000, 'Snk_b_dem_excess', 'b_dem', None, None),
+]
+
+
+class StoredBasisTests(TempRunDirTestCase):
+
+    def setUp(self):
+        from .what_if import RetainedModel
+
+        super().setUp()
+        self.retained = quiet(RetainedModel, {'workbook': self.workbook({'Choice': CHOICE}), 'sheet': 'Choice',
+                                              'overrides': {}})
+        if self.retained.base_basis is None:
+            self.skipTest('appsi HiGHS (highspy) is not available')
+        self.ranges = {entry['value']: entry for entry in self.retained.validity_ranges()}
+
+    def solutions(self, overrides):
+        # results from the stored basis (None if not optimal) and of a re-solve
+        value_collection = self.retained.value_collection(overrides)
+        self.retained.apply(value_collection)
+        predicted = self.retained.solve_from_basis(value_collection)
+        return predicted, quiet(self.retained.solve, value_collection)
+
+    def test_exact_ranges(self):
+        # Src_A covers the demand up to ETA_A = 1.2, below COP_B = 1 the excess source is cheaper
+        expected = {'ETA_A': (0.0, 1.2), 'COP_B': (1.0, None), 'Snk_Dem': (400.0, 400 + 300 * 100 * 1.5),
+                    'Src_A': (0.0, 750.0)}
+        for vid, (low, high) in expected.items():
+            with self.subTest(value=vid):
+                self.assertAlmostEqual(self.ranges[vid]['low'], low, places=9)
+                if high is None:
+                    self.assertIsNone(self.ranges[vid]['high'])
+                else:
+                    self.assertAlmostEqual(self.ranges[vid]['high'], high, places=9)
+
+    def test_inside_equals_resolve(self):
+        from .direct_lp import compare, objective
+
+        for vid, value in (('ETA_A', 0.3), ('ETA_A', 1.1), ('COP_B', 1.05), ('COP_B', 4), ('Snk_Dem', 450),
+                           ('Snk_Dem', 5000), ('Src_A', 100), ('Src_A', 700)):
+            with self.subTest(value=vid, what_if=value):
+                predicted, resolved = self.solutions({vid: value})
+                self.assertIsNotNone(predicted)
+                self.assertEqual(predicted['solver'], 'stored basis')
+                self.assertEqual(compare(resolved, predicted), [])
+                energy_system = self.retained.factory.energy_system
+                self.assertAlmostEqual(objective(energy_system, predicted['time_series']['flows']),
+                                       objective(energy_system, resolved['time_series']['flows']), places=3)
+
+    def test_outside_needs_a_solve(self):
+        # just beyond the edges of the ranges the stored basis is not optimal
+        basis = self.retained.base_basis
+        for parameter, inside, outside in ((('ETA_A', 'conversion'), 1.1999, 1.2001),
+                                           (('COP_B', 'conversion'), 1.0001, 0.9999),
+                                           (('Snk_Dem', 'flow'), 401, 399), (('Src_A', 'flow'), 749, 751)):
+            with self.subTest(parameter=parameter):
+                self.assertIsNotNone(basis.solve({parameter: inside}))
+                self.assertIsNone(basis.solve({parameter: outside}))
+
+
+class ScenarioCatalogTests(TempRunDirTestCase):
+
+    def test_regions_resolved_in_data_dir(self):
+        from .scenario_catalog import DATA_DIR, regions, scenario_for, scenarios
+
+        path = self.workbook({'Two': TWO_COMPONENTS})
+        with override_settings(SIMULATOR_REGIONS={'Nord': [path, 'Two'], 'Sued': [path, 'Two'],
+                                                  'West': ['D.xlsx', 'SzenarioD']}):
+            self.assertEqual(list(regions()), ['Nord', 'Sued', 'West'])
+            self.assertEqual(scenario_for('West'), {'workbook': os.path.join(DATA_DIR, 'D.xlsx'), 'sheet': 'SzenarioD'})
+            self.assertEqual(scenarios(), [(path, 'Two'), (os.path.join(DATA_DIR, 'D.xlsx'), 'SzenarioD')])
+            with self.assertRaises(KeyError):
+                scenario_for('Ost')
+
+    def test_regions_sharing_a_sheet_share_their_run(self):
+        from .scenario_catalog import prebuild, scenario_of_run
+
+        path = self.workbook({'Two': TWO_COMPONENTS})
+        with override_settings(SIMULATOR_REGIONS={'Nord': [path, 'Two'], 'Sued': [path, 'Two']}):
+            (_, nord, solved_nord), (_, sued, solved_sued) = quiet(prebuild)
+            self.assertEqual((nord, solved_nord, solved_sued), (sued, True, False))
+            self.assertEqual(scenario_of_run(nord), {'workbook': path, 'sheet': 'Two', 'overrides': {}})
+
+            response = Client().get(reverse('results'), {'region': 'Sued'})   # a lookup in the run store
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['ETag'], f'"{nord}"')
+            self.assertEqual(quiet(prebuild), [('Nord', nord, False), ('Sued', nord, False)])
+
+
+class RunCachingTests(TempRunDirTestCase):
+
+    def setUp(self):
+        from .result_cache import cached_run_oemof_scenario
+
+        super().setUp()
+        self.run_id, _ = quiet(cached_run_oemof_scenario, self.workbook({'Two': TWO_COMPONENTS}), 'Two')
+        self.client = Client()
+
+    def test_revalidated_by_run_id(self):
+        for url in (reverse('results_run', args=[self.run_id]), reverse('api_run', args=[self.run_id]),
+                    reverse('api_run_section', args=[self.run_id, 'summary'])):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['ETag'], f'"{self.run_id}"')
+                self.assertEqual(response['Cache-Control'], 'public, max-age=3600')   # runs may be evicted
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_section_etag_depends_on_query(self):
+        url = reverse('api_run_section', args=[self.run_id, 'timeseries'])
+        narrow, wide = self.client.get(url, {'width': 10}), self.client.get(url, {'width': 20})
+        self.assertNotEqual(narrow['ETag'], wide['ETag'])
+        self.assertEqual(self.client.get(url, {'width': 10}, HTTP_IF_NONE_MATCH=narrow['ETag']).status_code, 304)
+
+
+class SensitivityTests(TempRunDirTestCase):
+
+    def setUp(self):
+        from . import what_if
+        from .result_cache import cached_run_oemof_scenario
+
+        super().setUp()
+        self.run_id, _ = quiet(cached_run_oemof_scenario, self.workbook({'Choice': CHOICE}), 'Choice')
+        self.addCleanup(what_if._retained.clear)
+        self.client = Client()
+
+    def test_duals_and_reduced_costs(self):
+        sensitivity = self.client.get(reverse('api_run_section', args=[self.run_id, 'sensitivity'])).json()
+        prices = {bus: values[0] for bus, values in sensitivity['sensitivity']['shadow_prices'].items()}
+        self.assertAlmostEqual(prices['b_a'], 0.8 * prices['b_dem'])   # ETA_A
+        self.assertAlmostEqual(prices['b_gas'], 1.5 * prices['b_dem'])   # COP_B
+        reduced_costs = {flow: values[0] for flow, values in sensitivity['sensitivity']['reduced_costs'].items()}
+        self.assertIsNone(reduced_costs['Src_A -> b_a'])   # fixed flow, no LP variable
+        self.assertEqual(reduced_costs['Src_Gas_excess -> b_gas'], 0)   # basic
+        self.assertGreater(reduced_costs['Src_b_dem_excess -> b_dem'], 0)   # costlier than the gas path
+
+    def test_what_if_within_range_without_solve(self):
+        ranges = self.client.get(reverse('api_run_validity_ranges', args=[self.run_id])).json()['ranges']
+        src_a = next(entry for entry in ranges if entry['value'] == 'Src_A')
+        self.assertEqual((src_a['base'], src_a['low'], src_a['high']), (500, 0, 750))
+
+        url = reverse('api_run_what_if', args=[self.run_id])
+        for value, solver in ((700, 'stored basis'), (800, 'appsi_highs')):
+            with self.subTest(Src_A=value):
+                response = quiet(self.client.post, url, {'overrides': {'Src_A': value}},
+                                 content_type='application/json')
+                self.assertEqual(response.json()['solver'], solver)
+                # Src_A and the gas covering the rest of the demand through Tr_B, none beyond 750
+                delta = value + max(0, 600 - 0.8 * value) / 1.5 - (500 + 200 / 1.5)
+                self.assertAlmostEqual(response.json()['diff']['sources_after_raw']['delta'], delta)
+
+
+@override_settings(SIMULATOR_JOB_WORKERS=0)
+class WhatIfTests(TempRunDirTestCase):
+    RUN_ID = 'a1' * 8
+
+    def setUp(self):
+        from . import what_if
+        from .run_store import save_run
+
+        super().setUp()
+        save_run(self.RUN_ID, {'scenario': {'workbook': self.workbook({'Choice': CHOICE}), 'sheet': 'Choice',
+                                            'overrides': {}}})
+        self.addCleanup(what_if._retained.clear)
+        self.client = Client(enforce_csrf_checks=True)
+        self.url = reverse('api_run_what_if', args=[self.RUN_ID])
+
+    def post(self, overrides, token=True):
+        headers = {}
+        if token:
+            ranges = self.client.get(reverse('api_run_validity_ranges', args=[self.RUN_ID]))
+            headers['HTTP_X_CSRFTOKEN'] = ranges.cookies['csrftoken'].value
+        return quiet(self.client.post, self.url, {'overrides': overrides}, content_type='application/json',
+                     **headers)
+
+    def test_needs_csrf_token(self):
+        self.assertEqual(self.post({'ETA_A': 1.1}, token=False).status_code, 403)
+        response = self.post({'ETA_A': 1.1})
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(response.json()['diff']['sources_after_raw']['delta'], -100, places=6)
+
+    @override_settings(SIMULATOR_JOB_QUEUE_LIMIT=1)
+    def test_rejected_if_queue_full(self):
+        from .jobs import admission_stats, submit_job
+
+        self.post({'ETA_A': 1.1})   # retains the model while the queue is empty
+        submit_job({'workbook': self.workbook({'Two': TWO_COMPONENTS}), 'sheet': 'Two'})
+        response = self.post({'COP_B': 0.5})   # outside the validity range: needs a solve
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(admission_stats()['rejected'], 1)
+
+    def test_rejected_without_free_slot(self):
+        from .admission import solve_slot
+
+        with mock.patch('simulator.what_if.SLOT_WAIT', 0.1), solve_slot():   # another solve holds the slot
+            response = self.post({'ETA_A': 1.1})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+
+@override_settings(SIMULATOR_JOB_WORKERS=0)
+class JobQueueTests(TempRunDirTestCase):
+
+    def params(self):
+        return {'workbook': self.workbook({'Two': TWO_COMPONENTS}), 'sheet': 'Two'}
+
+    def test_identical_submissions_coalesce(self):
+        from .jobs import QUEUED, admission_stats, get_job, submit_job
+
+        params = self.params()
+        job_id = submit_job(params)
+        self.assertEqual(submit_job(dict(params)), job_id)
+        self.assertNotEqual(submit_job(dict(params, overrides={'Src_A': 400})), job_id)
+        self.assertEqual(get_job(job_id)['status'], QUEUED)
+        self.assertEqual(admission_stats()['admitted'], 2)
+
+    def test_coalesced_job_is_solved_once(self):
+        from .jobs import DONE, get_job, submit_job, work_off_queue
+        from .run_store import load_run
+
+        params = self.params()
+        job_id = submit_job(params)
+        submit_job(params)
+        self.assertEqual(quiet(work_off_queue), 1)
+        job = get_job(job_id)
+        self.assertEqual(job['status'], DONE)
+        self.assertFlows(load_run(job['run_id']), TWO_COMPONENTS_FLOWS)
+        self.assertEqual(get_job(submit_job(params))['status'], DONE)   # stored: done at once
+
+    @override_settings(SIMULATOR_JOB_TIMEOUT=60)
+    def test_stuck_jobs_expire_without_claims(self):
+        from .jobs import FAILED, claim_next_job, expire_jobs, get_job, submit_job
+
+        job_id = submit_job(self.params())
+        self.assertEqual(claim_next_job()['id'], job_id)
+        self.assertEqual(expire_jobs(), 0)
+        with mock.patch('time.time', return_value=get_job(job_id)['started'] + 61):
+            self.assertEqual(expire_jobs(), 1)
+        job = get_job(job_id)
+        self.assertEqual(job['status'], FAILED)
+        self.assertEqual(job['error'], 'Solve timed out or worker died')
+
+
+@override_settings(SIMULATOR_JOB_WORKERS=0)
+class WorkerPoolTests(TempRunDirTestCase):
+
+    def test_spawned_worker_executes_job(self):
+        # a spawned worker reads its settings from the environment, not from override_settings
+        from .jobs import DONE, get_job, submit_job
+        from .worker_pool import WorkerPool
+
+        job_id = submit_job({'workbook': self.workbook({'Two': TWO_COMPONENTS}), 'sheet': 'Two'})
+        environment = {'SIMULATOR_RUN_DIR': self.tmp, 'SIMULATOR_JOB_DB': os.path.join(self.tmp, 'jobs.sqlite3'),
+                       'SIMULATOR_METRICS_DB': os.path.join(self.tmp, 'metrics.sqlite3'),
+                       'SIMULATOR_RESULT_CACHE_PATH': os.path.join(self.tmp, 'result_cache.sqlite3'),
+                       'SIMULATOR_LOG_LEVEL': 'WARNING'}
+        pool = WorkerPool(1, poll_interval=0.1, max_tasks=1)
+        with mock.patch.dict(os.environ, environment):
+            pool.supervise()
+        self.addCleanup(pool.terminate)
+        worker = pool.processes[0]
+        worker.join(120)
+        self.assertEqual(type(worker).__name__, 'SpawnProcess')
+        self.assertEqual(worker.exitcode, 0)   # exited after its one task
+        self.assertEqual(get_job(job_id)['status'], DONE)
+
+
+class PreloadTests(TempRunDirTestCase):
+
+    def when_ready(self):
+        # the when_ready hook of gunicorn.conf.py, which gunicorn calls in the master before forking the workers
+        import importlib.util
+        from django.conf import settings
+
+        path = os.path.join(settings.BASE_DIR, 'gunicorn.conf.py')
+        spec = importlib.util.spec_from_file_location('gunicorn_conf', path)
+        module = importlib.util.module_from_spec(spec)
+        with mock.patch.dict(os.environ), mock.patch('gc.freeze'):   # the test process keeps collecting
+            spec.loader.exec_module(module)
+            server = mock.Mock()
+            module.when_ready(server)
+        self.assertIn('Cold start', server.log.info.call_args[0][0])
+
+    def parsed(self, path, sheet):
+        # whether the sheet is parsed already: loading it again is a hit of the sheet cache
+        from .model.model_factory import _read_sheet, load_sheet
+
+        hits = _read_sheet.cache_info().hits
+        load_sheet(path, sheet)
+        return _read_sheet.cache_info().hits > hits
+
+    def test_preloads_scenarios(self):
+        path = self.workbook({'Two': TWO_COMPONENTS})
+        with override_settings(SIMULATOR_PRELOAD=True, SIMULATOR_PRELOAD_SCENARIOS=[(path, 'Two')]):
+            self.when_ready()
+        self.assertTrue(self.parsed(path, 'Two'))
+
+    def test_nothing_preloaded_when_disabled(self):
+        path = self.workbook({'Two': TWO_COMPONENTS})
+        with override_settings(SIMULATOR_PRELOAD=False, SIMULATOR_PRELOAD_SCENARIOS=[(path, 'Two')]):
+            self.when_ready()
+        self.assertFalse(self.parsed(path, 'Two'))
+
+
+class ProgressEventTests(TempRunDirTestCase):
+
+    def setUp(self):
+        from . import jobs
+
+        super().setUp()
+        self.addCleanup(jobs._event_buffers.clear)
+
+    def phases(self, job_id):
+        from .jobs import events_since
+        return [(event['phase'], event['message']) for event in events_since(0, [job_id])]
+
+    def test_lines_of_a_phase_are_batched(self):
+        from .jobs import record_event
+
+        record_event('job', 'solve', 'Solving')
+        record_event('job', 'solve', 'line 1')
+        record_event('job', 'solve', 'line 2')
+        self.assertEqual(self.phases('job'), [('solve', 'Solving')])   # a new phase is written at once
+        record_event('job', 'extract', 'Extracting results')
+        self.assertEqual(self.phases('job'), [('solve', 'Solving'), ('solve', 'line 1'), ('solve', 'line 2'),
+                                              ('extract', 'Extracting results')])
+
+    def test_buffered_lines_written_when_finished(self):
+        from .jobs import DONE, finish_job, record_event
+
+        record_event('job', 'solve', 'Solving')
+        record_event('job', 'solve', 'line 1')
+        finish_job('job')
+        self.assertEqual(self.phases('job'), [('solve', 'Solving'), ('solve', 'line 1'), (DONE, '')])
+
+    def test_lines_written_after_the_flush_interval(self):
+        from .jobs import EVENT_FLUSH_INTERVAL, record_event
+
+        record_event('job', 'solve', 'Solving')
+        record_event('job', 'solve', 'line 1')
+        with mock.patch('time.time', return_value=time.time() + EVENT_FLUSH_INTERVAL):
+            record_event('job', 'solve', 'line 2')
+        self.assertEqual(len(self.phases('job')), 3)
+
+
+@override_settings(SIMULATOR_JOB_WORKERS=0, SIMULATOR_JOB_QUEUE_LIMIT=1)
+class AdmissionTests(TempRunDirTestCase):
+
+    def test_full_queue_answers_503(self):
+        from .jobs import admission_stats, submit_job
+
+        submit_job({'workbook': self.workbook({'Two': TWO_COMPONENTS}), 'sheet': 'Two'})
+        with self.assertLogs('django.request', 'ERROR'):
+            response = self.client.post(reverse('submit_job'))
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(admission_stats()['rejected'], 1)
+
+    @override_settings(SIMULATOR_JOB_QUEUE_DEADLINE=60)
+    def test_expired_jobs_do_not_count(self):
+        from .jobs import FAILED, get_job, submit_job
+
+        job_id = submit_job({'workbook': self.workbook({'Two': TWO_COMPONENTS}), 'sheet': 'Two'})
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(self.client.post(reverse('submit_job')).status_code, 302)
+        self.assertEqual(get_job(job_id)['status'], FAILED)
+
+
+class MetricsTests(TempRunDirTestCase):
+
+    def stored(self):
+        import sqlite3
+        from .metrics import metrics_db
+
+        if not os.path.exists(metrics_db()):
+            return 0
+        with contextlib.closing(sqlite3.connect(metrics_db())) as con:
+            return con.execute('SELECT COUNT(*) FROM samples').fetchone()[0]
+
+    def test_samples_buffered_until_flushed(self):
+        for seconds in (0.003, 0.2, 0.3, 100):
+            metrics.observe('simulator_phase_seconds', seconds, phase='render')
+        metrics.inc('simulator_solves_total', solver='cbc', status='ok', termination='optimal')
+        self.assertEqual(self.stored(), 0)
+        metrics.flush()
+        self.assertEqual(self.stored(), 7)   # 4 buckets, _sum, _count and the counter
+
+    def test_rendered_with_unflushed_samples(self):
+        for seconds in (0.003, 0.2, 0.3, 100):
+            metrics.observe('simulator_phase_seconds', seconds, phase='render')
+        lines = metrics.render_prometheus().splitlines()
+        self.assertIn('simulator_phase_seconds_bucket{phase="render",le="0.005"} 1', lines)
+        self.assertIn('simulator_phase_seconds_bucket{phase="render",le="0.5"} 3', lines)
+        self.assertIn('simulator_phase_seconds_bucket{phase="render",le="+Inf"} 4', lines)
+        self.assertIn('simulator_phase_seconds_count{phase="render"} 4', lines)
+
+    def test_flushed_by_the_timer(self):
+        with mock.patch.object(metrics, 'FLUSH_INTERVAL', 0.05):
+            metrics.inc('simulator_deduplicated_solves_total')
+            timer = metrics._flush_timer
+        timer.join(5)
+        self.assertEqual(self.stored(), 1)
+
+
+class ResultCacheTests(TempRunDirTestCase):
+
+    @staticmethod
+    def result(number):
+        return {'sources_before': number, 'sinks_before': number, 'solver': 'cbc'}
+
+    @override_settings(SIMULATOR_RESULT_CACHE={'MAX_ENTRIES': 2})
+    def test_least_recently_used_evicted(self):
+        from . import result_cache
+        from .run_store import run_exists
+
+        keys = ['0a' * 16, '0b' * 16, '0c' * 16]
+        result_cache.put(keys[0], self.result(0))
+        result_cache.put(keys[1], self.result(1))
+        self.assertEqual(result_cache.get(keys[0])['sources_before'], 0)   # keys[1] is used least recently
+        result_cache.put(keys[2], self.result(2))
+        self.assertEqual([run_exists(key) for key in keys], [True, False, True])
+        self.assertIsNone(result_cache.get(keys[1]))
+        stats = result_cache.stats()
+        self.assertEqual((stats['entries'], stats['evictions'], stats['hits'], stats['misses']), (2, 1, 1, 1))
+
+    def test_bounded_by_size(self):
+        from . import result_cache
+        from .run_store import run_exists, run_size
+
+        result_cache.put('0a' * 16, self.result(0))
+        with override_settings(SIMULATOR_RESULT_CACHE={'MAX_BYTES': run_size('0a' * 16) * 3 // 2}):
+            result_cache.put('0b' * 16, self.result(1))
+        self.assertFalse(run_exists('0a' * 16))
+        self.assertTrue(run_exists('0b' * 16))
+
+    @override_settings(SIMULATOR_RESULT_CACHE={'MAX_BYTES': 1})
+    def test_run_just_stored_kept(self):
+        from . import result_cache
+        from .run_store import run_exists
+
+        result_cache.put('0a' * 16, self.result(0))
+        self.assertTrue(run_exists('0a' * 16))   # larger than the cache, but its id is handed out
+        result_cache.put('0b' * 16, self.result(1))
+        self.assertEqual([run_exists('0a' * 16), run_exists('0b' * 16)], [False, True])
+
+    @override_settings(SIMULATOR_JOB_WORKERS=0)
+    def test_evicted_run_solved_again(self):
+        from . import result_cache
+        from .jobs import get_job
+
+        path = self.workbook({'Two': TWO_COMPONENTS})
+        run_id, _ = quiet(result_cache.cached_run_oemof_scenario, path, 'Two')
+        with override_settings(SIMULATOR_RESULT_CACHE={'MAX_ENTRIES': 1}):
+            result_cache.put('0a' * 16, self.result(0))
+        self.assertEqual(result_cache.evicted_scenario(run_id), {'workbook': path, 'sheet': 'Two', 'overrides': {}})
+
+        client = Client()
+        response = client.get(reverse('results_run', args=[run_id]))
+        self.assertEqual(response.status_code, 302)
+        job_id = response['Location'].rstrip('/').rsplit('/', 1)[1]
+        self.assertEqual(response['Location'], reverse('job', args=[job_id]))
+        self.assertEqual(get_job(job_id)['run_id'], run_id)
+        self.assertEqual(client.get(reverse('api_run', args=[run_id]))['Location'],
+                         reverse('job_status', args=[job_id]))   # coalesced with the queued job
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(client.get(reverse('results_run', args=['0b' * 16])).status_code, 404)
+
+    def test_stored_in_the_run_store(self):
+        from .result_cache import cached_run_oemof_scenario
+        from .run_store import load_run
+
+        run_id, data = quiet(cached_run_oemof_scenario, self.workbook({'Two': TWO_COMPONENTS}), 'Two')
+        self.assertFlows(load_run(run_id), TWO_COMPONENTS_FLOWS)
+
+
+class SingleFlightTests(TempRunDirTestCase):
+
+    def test_concurrent_identical_solves_coalesce(self):
+        from . import oemof_runner, result_cache
+
+        solve, started = oemof_runner.run_oemof_scenario, threading.Event()
+        calls = []
+
+        def slow_solve(*args, **kwargs):
+            calls.append(args)
+            started.set()
+            time.sleep(0.3)   # the other thread arrives while this one solves
+            return solve(*args, **kwargs)
+
+        path = self.workbook({'Two': TWO_COMPONENTS})
+        results = []
+        run = lambda: results.append(result_cache.cached_run_oemof_scenario(path, 'Two'))
+        with mock.patch.object(oemof_runner, 'run_oemof_scenario', slow_solve), \
+                contextlib.redirect_stdout(io.StringIO()):
+            first = threading.Thread(target=run)
+            first.start()
+            started.wait(5)
+            second = threading.Thread(target=run)
+            second.start()
+            first.join()
+            second.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results[0][0], results[1][0])
+        self.assertEqual(result_cache.stats()['coalesced'], 1)
+
+    def test_fixed_set_of_lock_files(self):
+        from . import result_cache
+
+        for number in range(3 * result_cache.LOCK_FILES):
+            with result_cache.single_flight(f'{number:032x}'):
+                pass
+        lock_dir = os.path.join(self.tmp, 'locks')
+        self.assertLessEqual(len(os.listdir(lock_dir)), result_cache.LOCK_FILES)
+
+
+class SweepTests(TempRunDirTestCase):
+
+    def sweep(self, output, parameters):
+        from .sweep import run_sweep
+
+        return [row for row, _, _ in run_sweep(self.path, 'Two', parameters, output, processes=1)]
+
+    def setUp(self):
+        super().setUp()
+        self.path = self.workbook({'Two': TWO_COMPONENTS})
+        self.output = os.path.join(self.tmp, 'sweep.csv')
+
+    def test_points_solved_on_one_model(self):
+        rows = {row['point']: row for row in self.sweep(self.output, [('Src_A', [100, 300, 500])])}
+        for point, value in enumerate((100, 300, 500)):
+            with self.subTest(Src_A=value):
+                row = rows[point]
+                self.assertEqual(row['status'], 'ok')
+                self.assertIn(row['solver'], ('appsi_highs', 'stored basis'))
+                self.assertAlmostEqual(row['Tr_A -> b_dem'], 0.8 * value, places=6)
+                self.assertAlmostEqual(row['Src_b_dem_excess -> b_dem'], 600 - 0.8 * value, places=6)
+
+    def test_columns_ordered_by_point(self):
+        from .sweep import columnar_path
+
+        self.sweep(self.output, [('Src_A', [100, 300, 500]), ('Snk_B', [50, 200])])   # Snk_B 200: infeasible
+        columns = np.load(columnar_path(self.output))
+        self.assertEqual(list(columns['point']), list(range(6)))
+        self.assertEqual(list(columns['status']), ['ok', 'failed'] * 3)
+        np.testing.assert_allclose(columns['Src_A -> b_a'][::2], [100, 300, 500])
+        self.assertTrue(np.isnan(columns['Src_A -> b_a'][1::2]).all())
+
+    def test_metrics_of_solve_processes_written(self):
+        import sqlite3
+
+        self.sweep(self.output, [('Src_A', [100, 300, 500])])
+        with contextlib.closing(sqlite3.connect(metrics.metrics_db())) as con:   # without a flush of this process
+            (extracted,) = con.execute('SELECT value FROM samples WHERE name = ? AND labels = ?',
+                                       ('simulator_phase_seconds_count', 'phase="extract"')).fetchone()
+        self.assertGreaterEqual(extracted, 3)
+
+    def test_resume_solves_failed_points_again(self):
+        import csv
+
+        parameters = [('Snk_B', [50, 200])]
+        self.sweep(self.output, parameters)
+        rows = self.sweep(self.output, parameters)
+        self.assertEqual([(row['point'], row['status']) for row in rows], [(1, 'failed')])
+        with open(self.output, newline='', encoding='utf-8') as f:
+            points = sorted((int(row['point']), row['status']) for row in csv.DictReader(f))
+        self.assertEqual(points, [(0, 'ok'), (1, 'failed')])   # the failed row replaced, not duplicated
+
+
+class MonteCarloTests(TempRunDirTestCase):
+
+    def test_p2_quantile_close_to_numpy(self):
+        from .monte_carlo import P2Quantile
+
+        values = np.random.default_rng(7).normal(100, 15, 10000)
+        for p in (0.05, 0.25, 0.5, 0.75, 0.95):
+            estimate = P2Quantile(p)
+            for value in values:
+                estimate.add(value)
+            with self.subTest(p=p):
+                self.assertAlmostEqual(estimate.value(), np.quantile(values, p), delta=0.05 * 15)
+
+    def test_p2_quantile_exact_for_few_observations(self):
+        from .monte_carlo import P2Quantile
+
+        values = [3.0, 1.0, 2.0]
+        for p in (0, 0.5, 1):
+            estimate = P2Quantile(p)
+            for value in values:
+                estimate.add(value)
+            self.assertEqual(estimate.value(), np.quantile(values, p))
+
+    def test_propagated_values_solved(self):
+        from .monte_carlo import parse_distribution, run_monte_carlo
+
+        path = self.workbook({'Two': TWO_COMPONENTS})
+        *_, (summary, done) = run_monte_carlo(path, 'Two', [parse_distribution('Src_A=uniform:100:500')], 8,
+                                              seed=1, processes=1)
+        self.assertEqual((done, summary['failed']), (8, 0))
+        # Src_A + Src_B + the excess source filling the demand, 600 - 0.8 * Src_A (flows rounded per sample)
+        self.assertAlmostEqual(summary['metrics']['total_sources']['mean'],
+                               700 + 0.2 * summary['inputs']['Src_A']['mean'], delta=0.5)
@@ -1,10 +1,23 @@
 import abc
 import enum
-import locale
 
 from sympy import Symbol, solve, sympify, Equality
 
 
+def format_number(number, decimals=2) -> str:
+    """
+    Number in German notation (1.234,50), independent of the process locale
+
+    locale.setlocale() changes the whole process and is not thread-safe, so the separators are swapped
+    explicitly instead.
+    """
+    number = float(number)
+    if round(number, decimals) == 0:
+        number = 0.0   # no -0,00 for small negative numbers
+    text = f'{number:,.{decimals}f}'
+    return text.replace(',', '\0').replace('.', ',').replace('\0', '.')
+
+
 class Unit(enum.Enum):
     kWh = 'kWh'
     MWh = 'MWh'
@@ -74,20 +87,14 @@ class Value(abc.ABC):
         return self.value != self.orig_value
 
     def __str__(self):
-        try:
-            locale.setlocale(locale.LC_ALL, 'de')
-        except locale.Error:
-            # If German locale is not available, use default locale
-            locale.setlocale(locale.LC_ALL, '')
         mark = ''
         if self.has_changed:
             mark = ' (!)'
 
         if self.unit == Unit.noUnit:
-            return self.id + ' = ' + locale.format('%.2f', self.value, True) + mark
+            return self.id + ' = ' + format_number(self.value) + mark
         else:
-            return self.id + ' = ' + locale.format('%.2f', self.value, True) \
-                                   + " " + str(self.unit.value) + mark
+            return self.id + ' = ' + format_number(self.value) + " " + str(self.unit.value) + mark
 
 
 class SimpleValue(Value):
@@ -148,6 +155,10 @@ class FormulaValue(Value):
         val_free_id = solve(eq, Symbol(self.free_id))[0]      # uniquely solve equality --> use 1st (and only) result
         self.value_factory.value(self.free_id).value = val_free_id  # set new value in value collection
 
+    @property
+    def formula(self) -> str:
+        return self.__formula
+
     def contains_id(self, vid) -> bool:
         if self.id == vid:
             return True
@@ -1,10 +1,270 @@
-from django.shortcuts import render
-from .oemof_runner import run_oemof_scenario
+import datetime
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import condition, require_POST
+from . import metrics, result_cache
+from .progress import event_stream
+from .jobs import submit_job, get_job, queue_position, admission_stats, QueueFull, QUEUED, DONE, FAILED
+from .oemof_runner import solver_name
+from .run_store import make_run_id, load_section, section_names, run_mtime, run_exists
+from .scenario_catalog import regions, scenario_for, scenario_of_run, DEFAULT_REGION
+from .what_if import what_if, validity_ranges
+
+# content under a run id never changes, but the result cache may evict the run: cached for a while, then
+# revalidated by its ETag (the run id)
+RUN_MAX_AGE = 3600
+
+
+def _region(request):
+    region = request.POST.get("region") or request.GET.get("region") or DEFAULT_REGION
+    if region not in regions():
+        raise Http404(f"Unknown region: {region}")
+    return region
+
+def _default_run_id(request, *args, **kwargs):
+    # run of the region's scenario; cheap: the workbook hash is cached as long as the file does not change
+    scenario = scenario_for(_region(request))
+    return make_run_id(scenario["workbook"], scenario["sheet"], solver_name())
+
+def _default_etag(request, *args, **kwargs):
+    # only if the run is stored, the page fetches its sections from the store
+    run_id = _default_run_id(request)
+    return run_id if run_mtime(run_id) is not None else None
+
+def _default_last_modified(request, *args, **kwargs):
+    return _run_last_modified(request, _default_run_id(request))
+
+def _run_etag(request, run_id, *args, **kwargs):
+    return run_id if run_mtime(run_id) is not None else None
+
+def _run_last_modified(request, run_id, *args, **kwargs):
+    mtime = run_mtime(run_id)
+    return datetime.datetime.fromtimestamp(mtime, tz=datetime.timezone.utc) if mtime is not None else None
+
+def _cacheable_run(response):
+    if response.status_code == 200:
+        patch_cache_control(response, public=True, max_age=RUN_MAX_AGE)
+    return response
+
+
+def _busy(error: QueueFull):
+    # load shedding: answer at once instead of queueing, clients and proxies retry later
+    response = HttpResponse(f"The simulator is busy, please retry in {error.retry_after} s.",
+                            status=503, content_type="text/plain; charset=utf-8")
+    response["Retry-After"] = str(error.retry_after)
+    return response
+
+def _solve_again(run_id, status=False):
+    """
+    Response for a run which is not stored: a run evicted from the result cache (or of a region) is solved
+    again by a job, the client is redirected to the job page (status=True: to its JSON status)
+    """
+    scenario = scenario_of_run(run_id)
+    if scenario is None:
+        raise Http404(f"Unknown run: {run_id}")
+    try:
+        job_id = submit_job(scenario)
+    except QueueFull as e:
+        return _busy(e)
+    return redirect('job_status' if status else 'job', job_id=job_id)
+
+def _render_results(request, summary, run_id):
+    # template rendering is timed as phase 'render' of the phase histogram
+    phases = metrics.PhaseTimer(run_id=run_id)
+    phases.start('render')
+    response = render(request, "results.html", {"data": summary, "run_id": run_id})
+    phases.stop()
+    return response
+
+def _scenario_params(request):
+    # scenario of the region selected in the home page form
+    region = _region(request)
+    return dict(scenario_for(region), region=region)
+
 
 def home(request):
     """Home page - Page 1"""
-    return render(request, "home.html")
+    return render(request, "home.html", {"regions": list(regions()), "default_region": DEFAULT_REGION})
+
+@require_POST
+def submit(request):
+    """Show the results of the region of the home page form, solved by a job if they are not stored yet"""
+    run_id = _default_run_id(request)
+    if run_exists(run_id):   # prebuilt (see scenario_catalog.prebuild) or solved before
+        return redirect('results_run', run_id=run_id)
+    try:
+        job_id = submit_job(_scenario_params(request))
+    except QueueFull as e:
+        return _busy(e)
+    return redirect('job', job_id=job_id)
+
+def job_detail(request, job_id):
+    """Job page, polls the job status and forwards to the results page when done"""
+    job = get_job(job_id)
+    if job is None:
+        raise Http404(f"Unknown job: {job_id}")
+    if job["status"] == DONE:
+        return redirect('results_run', run_id=job["run_id"])
+    return render(request, "job.html", {"job": job})
 
+@never_cache
+def job_status(request, job_id):
+    """Status of a job as JSON: queued, running, done or failed"""
+    job = get_job(job_id)
+    if job is None:
+        raise Http404(f"Unknown job: {job_id}")
+    status = {"id": job["id"], "status": job["status"], "run_id": job["run_id"]}
+    if job["status"] == QUEUED:
+        status["position"] = queue_position(job_id)
+    elif job["status"] == DONE:
+        status["result_url"] = reverse('results_run', args=[job["run_id"]])
+    elif job["status"] == FAILED:
+        status["error"] = job["error"]
+    return JsonResponse(status)
+
+async def job_events(request, job_id):
+    """
+    Progress of a job as server-sent events (phases and solver output), served asynchronously under ASGI
+    """
+    if await sync_to_async(get_job, thread_sensitive=False)(job_id) is None:
+        raise Http404(f"Unknown job: {job_id}")
+    last_event_id = request.headers.get("Last-Event-ID", "")   # sent by EventSource on reconnect
+    response = StreamingHttpResponse(event_stream(job_id, int(last_event_id) if last_event_id.isdigit() else 0),
+                                     content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"   # no buffering in proxies
+    return response
+
+@condition(etag_func=_default_etag, last_modified_func=_default_last_modified)
 def results(request):
-    data = run_oemof_scenario()   # This now runs the real OEMOF model
-    return render(request, "results.html", {"data": data})
+    """
+    Results page - Page 2 for the scenario of a region (?region=, default region if not given)
+
+    The ETag is the run id, which changes with workbook, sheet, solver and code. A reload with an
+    unchanged scenario is answered with 304 before the store or the template engine are touched.
+    A scenario which is not stored yet is solved by a job.
+    """
+    run_id = _default_run_id(request)
+    summary = load_section(run_id, 'summary')
+    if summary is None:
+        # not solved yet: solve in the job pool instead of blocking this request
+        try:
+            return redirect('job', job_id=submit_job(_scenario_params(request)))
+        except QueueFull as e:
+            return _busy(e)
+    response = _render_results(request, summary, run_id)
+    response['ETag'] = quote_etag(run_id)
+    response['Last-Modified'] = http_date(run_mtime(run_id))
+    patch_cache_control(response, no_cache=True)   # always revalidate, the scenario may change
+    return response
+
+@condition(etag_func=_run_etag, last_modified_func=_run_last_modified)
+def results_run(request, run_id):
+    """
+    Results page of a stored run, renders only the summary, all other sections are fetched on demand
+
+    A run evicted from the result cache is solved again by a job.
+    """
+    summary = load_section(run_id, 'summary')
+    if summary is None:
+        return _solve_again(run_id)
+    return _cacheable_run(_render_results(request, summary, run_id))
+
+@condition(etag_func=_run_etag, last_modified_func=_run_last_modified)
+def api_run(request, run_id):
+    """Index of the sections of a stored run, for an evicted run the status of the job solving it again"""
+    names = section_names(run_id)
+    if not names:
+        return _solve_again(run_id, status=True)
+    sections = {name: reverse('api_run_section', args=[run_id, name]) for name in names}
+    return _cacheable_run(JsonResponse({"run_id": run_id, "sections": sections}))
+
+def _section_etag(request, run_id, section, *args, **kwargs):
+    # the time series payload depends on width, range and series
+    etag = _run_etag(request, run_id)
+    if etag is not None and request.GET:
+        etag += '-' + hashlib.sha1(request.GET.urlencode().encode()).hexdigest()[:12]
+    return etag
+
+@condition(etag_func=_section_etag, last_modified_func=_run_last_modified)
+def api_run_section(request, run_id, section):
+    """One section of a stored run as JSON, the time series are downsampled to the chart width"""
+    content = load_section(run_id, section)
+    if content is None and not run_exists(run_id):
+        return _solve_again(run_id, status=True)
+    if content is None:
+        raise Http404(f"Unknown section '{section}' of run {run_id}")
+
+    if section == 'timeseries':
+        from .downsampling import downsample_time_series   # numpy is only needed here
+
+        names = request.GET.getlist("series") or None
+        content = downsample_time_series(content.get("time_series"), request.GET.get("width"),
+                                         request.GET.get("start"), request.GET.get("end"), names)
+    return _cacheable_run(JsonResponse(content))
+
+@condition(etag_func=_run_etag, last_modified_func=_run_last_modified)
+def api_run_chain(request, run_id, chain):
+    """Loss accounting of one sector chain (e.g. power_to_hydrogen) of a stored run"""
+    content = load_section(run_id, 'losses')
+    if content is None and not run_exists(run_id):
+        return _solve_again(run_id, status=True)
+    breakdown = (content or {}).get("loss_breakdown", {})
+    if not isinstance(breakdown.get(chain), dict):
+        raise Http404(f"Unknown chain '{chain}' of run {run_id}")
+    return _cacheable_run(JsonResponse(breakdown[chain]))
+
+@require_POST
+def api_run_what_if(request, run_id):
+    """
+    Re-solve a stored run with changed values, body {"overrides": {value id: number}}, see what_if()
+
+    Like every POST the request needs the CSRF token (X-CSRFToken header and csrftoken cookie, the cookie
+    is set by the validity ranges of the run).
+    """
+    try:
+        overrides = {str(vid): float(value) for vid, value in json.loads(request.body)["overrides"].items()}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({"error": 'Expected {"overrides": {value id: number}}'}, status=400)
+    try:
+        return JsonResponse(what_if(run_id, overrides))
+    except KeyError:
+        raise Http404(f"Unknown run: {run_id}")
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except QueueFull as e:
+        return _busy(e)
+
+@ensure_csrf_cookie
+def api_run_validity_ranges(request, run_id):
+    """Ranges of the values of a stored run within which what-ifs are answered without a solver call"""
+    try:
+        return JsonResponse(validity_ranges(run_id))
+    except KeyError:
+        raise Http404(f"Unknown run: {run_id}")
+    except QueueFull as e:
+        return _busy(e)
+
+@never_cache
+def api_cache_stats(request):
+    """Hit/miss counters and size of the shared result cache"""
+    return JsonResponse(result_cache.stats())
+
+@never_cache
+def api_admission_stats(request):
+    """Queue depth, running solves and admitted/rejected/expired jobs"""
+    return JsonResponse(admission_stats())
+
+@never_cache
+def metrics_view(request):
+    """Phase durations, solves, model sizes, cache and queue in the Prometheus text format"""
+    return HttpResponse(metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
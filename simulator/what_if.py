@@ -0,0 +1,399 @@
+"""
+What-if analysis of stored runs: change some values of a run's scenario and answer the differences
+
+The model of a run is built once and kept in memory, least recently used first, together with a persistent
+HiGHS instance. A what-if changes only the bounds and coefficients depending on the changed values (flow
+nominal values and transformer conversion factors, see ExcelModelFactory.bindings). If the basis of the last
+solve stays optimal for the changed values (see ranging.StoredBasis), the results are computed from it
+without a solver call; otherwise the model is re-solved, and HiGHS keeps the basis of the previous solve,
+so the re-solve is a warm start of a few simplex iterations instead of building, writing and solving the
+LP from scratch. Without appsi/highspy the model is always re-solved with the solver of solve_model().
+
+appsi has no public accessors for the HiGHS instance and the column and row of a pyomo component, which the
+stored basis needs; they are read from its private attributes (pyomo is pinned in requirements.txt) and if
+a pyomo version lacks them, no basis is stored and every what-if is a warm-started re-solve.
+
+The differences are taken to the base scenario solved by the same retained model, so alternative optima of
+another solver do not show up as changes.
+"""
+
+import collections
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+
+from .admission import solve_slot
+from .jobs import admit
+
+logger = logging.getLogger(__name__)
+
+SLOT_WAIT = 5.0   # seconds a what-if waits for a solve slot before it is rejected (503, see jobs.QueueFull)
+
+# run id -> RetainedModel, least recently used first
+_retained = collections.OrderedDict()
+_retained_lock = threading.Lock()
+
+RESULT_KEYS = ['sources_before', 'sinks_before', 'sources_after_raw', 'sinks_after', 'losses',
+               'detailed_sources_after', 'detailed_sinks_after', 'loss_breakdown']
+
+
+def retained_models() -> int:
+    """Number of models kept in memory per process"""
+    return getattr(settings, 'SIMULATOR_WHAT_IF_MODELS', 4)
+
+
+def _persistent_solver():
+    # HiGHS through pyomo's appsi interface, None if highspy is not installed
+    try:
+        from pyomo.contrib.appsi.solvers import Highs
+    except ImportError:
+        return None
+    solver = Highs()
+    # fixed flows stay columns with equal bounds (instead of constants of the rows), see ranging.StoredBasis
+    solver.update_config.treat_fixed_vars_as_params = False
+    solver.config.load_solution = False   # loaded after the termination condition is checked
+    return solver if solver.available() else None
+
+
+def _pyomo_version():
+    import pyomo.version
+    return pyomo.version.version
+
+
+def _appsi_internals(solver):
+    # highspy.Highs instance, pyomo variable id -> column and constraint -> row of a solved appsi Highs solver,
+    # private attributes of pyomo 6.9 (there are no public accessors), None if this pyomo version lacks them
+    try:
+        import highspy
+    except ImportError:
+        return None
+    highs = getattr(solver, '_solver_model', None)
+    columns = getattr(solver, '_pyomo_var_to_solver_var_map', None)
+    rows = getattr(solver, '_pyomo_con_to_solver_con_map', None)
+    if not isinstance(highs, highspy.Highs) or not isinstance(columns, dict) or not isinstance(rows, dict):
+        logger.warning('appsi internals not found, what-ifs are re-solved', extra={'pyomo': _pyomo_version()})
+        return None
+    return highs, columns, rows
+
+
+class RetainedModel:
+    """
+    Built and solved model of a scenario which is re-solved with changed values
+    """
+
+    def __init__(self, scenario):
+        from .model.model_factory import ExcelModelFactory
+        from .oemof_runner import receive_duals
+
+        self.scenario = scenario
+        self.factory = ExcelModelFactory(scenario['workbook'], scenario['sheet'], scenario['overrides'])
+        self.model = self.factory.model
+        flow_keys = {id(flow): key for key, flow in self.model.flows.items()}
+        # (value id, 'flow', (input, output)) or (value id, 'conversion', (Transformer, Bus))
+        self.bindings = [(vid, kind, flow_keys[id(target)] if kind == 'flow' else target)
+                         for vid, kind, target in self.factory.bindings]
+        self.applied = self.__values(self.factory.value_collection)   # value id -> value the model has now
+        self.base_values = dict(self.applied)   # value id -> value of the base scenario
+        self.solver = _persistent_solver()
+        self.basis = None   # ranging.StoredBasis of the last solve
+        self.__lp_maps = None   # column and row maps of the LP of the stored basis
+        self.lock = threading.Lock()   # one what-if of this model at a time
+        receive_duals(self.model)
+        self.base = self.solve(self.factory.value_collection)
+        self.base_basis = self.basis
+        self.__ranges = None
+
+    def value_collection(self, overrides):
+        """
+        Values of the scenario with overrides on top of the scenario's own overrides
+
+        Raises:
+            ValueError: unknown value
+        """
+        from .value.value_collection import ValueCollection
+
+        value_collection = ValueCollection(self.factory)
+        for vid, new_value in dict(self.scenario['overrides'], **overrides).items():
+            value = value_collection.value(vid)
+            if value is None:
+                raise ValueError(f"Unknown value: {vid}")
+            value.value = new_value
+        return value_collection
+
+    def __values(self, value_collection):
+        return {vid: float(value_collection.value(vid).value) for vid, _, _ in self.bindings}
+
+    def apply(self, value_collection) -> list:
+        """
+        Change the bounds and coefficients of the values which differ from those of the model
+
+        Returns:
+            list: {'value': id, 'base': value of the base scenario, 'what_if': new value} per changed value
+        """
+        return self.apply_values(self.__values(value_collection))
+
+    def apply_values(self, values) -> list:
+        """
+        apply() for values evaluated already, e.g. by monte_carlo.propagate()
+
+        Args:
+            values: value id -> number, for every value bound in the model
+        """
+        from oemof.solph import sequence
+
+        values = {vid: float(values[vid]) for vid, _, _ in self.bindings}
+        changed = {vid for vid, value in values.items() if value != self.applied[vid]}
+        for vid, kind, target in self.bindings:
+            if vid not in changed:
+                continue
+            if kind == 'flow':
+                self.__set_nominal_value(target, int(values[vid]))
+            else:
+                transformer, bus = target
+                transformer.conversion_factors[bus] = sequence(values[vid])
+                self.__rebuild_relations(transformer)
+        self.applied.update(values)
+        return [{'value': vid, 'base': self.base_values[vid], 'what_if': value}
+                for vid, value in values.items() if value != self.base_values[vid]]
+
+    def __parameters(self, values):
+        # parameters of the LP per binding, flows have integer nominal values
+        return {(vid, kind): int(values[vid]) if kind == 'flow' else values[vid] for vid, kind, _ in self.bindings}
+
+    @staticmethod
+    def __bound_factors(flow, t):
+        # same bounds as solph's SimpleFlowBlock: fixed flows fix * nominal value, others min/max * nominal value
+        if flow.fix[t] is not None:
+            return flow.fix[t], flow.fix[t]
+        return flow.min[t], flow.max[t]
+
+    def __set_nominal_value(self, key, nominal_value):
+        flow = self.model.flows[key]
+        flow.nominal_value = nominal_value
+        for t in self.model.TIMESTEPS:
+            variable = self.model.flow[key[0], key[1], t]
+            lower, upper = self.__bound_factors(flow, t)
+            if flow.fix[t] is not None:
+                variable.fix(upper * nominal_value)
+            else:
+                variable.setub(upper * nominal_value)
+                variable.setlb(lower * nominal_value)
+
+    def __rebuild_relations(self, transformer):
+        # input * factor(output) == output * factor(input), see solph's ConverterBlock
+        relation = self.model.ConverterBlock.relation
+        for n, i, o, t in relation:
+            if n is transformer:
+                relation[n, i, o, t].set_value(
+                    self.model.flow[i, n, t] * n.conversion_factors[o][t] ==
+                    self.model.flow[n, o, t] * n.conversion_factors[i][t])
+
+    def solve(self, value_collection) -> dict:
+        """Solve the model as it is and summarize the results (see summarize_results())"""
+        from .oemof_runner import solve_model, summarize_results
+
+        if self.solver is None:
+            solver_used = solve_model(self.model, tee=False)
+        else:
+            from pyomo.contrib.appsi.base import TerminationCondition
+
+            result = self.solver.solve(self.model)
+            if result.termination_condition != TerminationCondition.optimal:
+                raise ValueError(f"No optimal solution: {result.termination_condition.name}")
+            result.solution_loader.load_vars()
+            self.model.dual.clear()
+            self.model.dual.update(self.solver.get_duals())
+            self.model.rc.clear()
+            self.model.rc.update(self.solver.get_reduced_costs())
+            solver_used = 'appsi_highs'
+            self.basis = self.__store_basis()
+        return summarize_results(self.model, value_collection, solver_used)
+
+    def solve_from_basis(self, value_collection):
+        """
+        Results of the model as it is from the basis of the last solve, without a solver call
+
+        Returns:
+            dict: see summarize_results(), None if the basis is not optimal for the current values
+        """
+        from pyomo.environ import Var
+        from .oemof_runner import summarize_results
+
+        solution = self.basis.solve(self.__parameters(self.applied)) if self.basis is not None else None
+        if solution is None:
+            return None
+        columns, rows = self.__lp_maps
+        self.model.dual.clear()
+        self.model.rc.clear()
+        for variable in self.model.component_data_objects(Var):
+            column = columns.get(id(variable))
+            if column is not None:
+                if not variable.fixed:
+                    variable.set_value(float(solution['values'][column]), skip_validation=True)
+                self.model.rc[variable] = float(solution['reduced_costs'][column])
+        for constraint, row in rows.items():
+            self.model.dual[constraint] = float(solution['duals'][row])
+        return summarize_results(self.model, value_collection, 'stored basis')
+
+    def validity_ranges(self) -> list:
+        """
+        Range of every binding in which the basis of the base scenario stays optimal, one value changed at
+        a time; what-ifs within them are answered without a solver call
+
+        Returns:
+            list: {'value': id, 'binding': 'flow' or 'conversion', 'base', 'low', 'high'} (high None if
+                unbounded), empty without a stored basis
+        """
+        if self.__ranges is None:
+            self.__ranges = []
+            parameters = self.base_basis.parameters if self.base_basis is not None else {}
+            for (vid, kind), value in parameters.items():
+                low, high = self.base_basis.validity_range((vid, kind))
+                low = max(float(low), 0.0)   # nominal values and conversion factors are not negative
+                self.__ranges.append({'value': vid, 'binding': kind, 'base': value, 'low': low,
+                                      'high': float(high) if math.isfinite(high) else None})
+        return self.__ranges
+
+    def __store_basis(self):
+        from .ranging import StoredBasis
+
+        internals = _appsi_internals(self.solver)
+        if internals is None:
+            return None
+        highs, columns, rows = internals
+        try:
+            basis = StoredBasis(highs, self.__parameters(self.applied), self.__effects(columns, rows))
+        except (ValueError, KeyError) as e:
+            logger.info('basis not stored', extra={'error': e})
+            return None
+        self.__lp_maps = columns, rows
+        return basis
+
+    def __effects(self, columns, rows):
+        # columns and matrix entries of the LP depending on each parameter, see ranging.StoredBasis
+        relation = self.model.ConverterBlock.relation
+        effects = {}
+        for vid, kind, target in self.bindings:
+            effect = effects.setdefault((vid, kind), [])
+            if kind == 'flow':
+                flow = self.model.flows[target]
+                for t in self.model.TIMESTEPS:
+                    column = columns.get(id(self.model.flow[target[0], target[1], t]))
+                    if column is not None:
+                        effect.append(('bounds', column, *self.__bound_factors(flow, t)))
+            else:
+                # input flows are multiplied with the factor of the output and vice versa
+                transformer, bus = target
+                for n, i, o, t in relation:
+                    if n is not transformer or (o is not bus and i is not bus):
+                        continue
+                    variable = self.model.flow[i, n, t] if o is bus else self.model.flow[n, o, t]
+                    effect.append(('coefficient', rows[relation[n, i, o, t]], columns[id(variable)]))
+        return effects
+
+
+def _retain(run_id) -> RetainedModel:
+    # retained model of a run, built and solved on first use
+    from .scenario_catalog import scenario_of_run
+
+    with _retained_lock:
+        retained = _retained.get(run_id)
+        if retained is not None:
+            _retained.move_to_end(run_id)
+            return retained
+
+    scenario = scenario_of_run(run_id)
+    if scenario is None:
+        raise KeyError(run_id)
+    admit()
+    with solve_slot(timeout=SLOT_WAIT):
+        retained = RetainedModel(scenario)
+    logger.info('what-if model retained', extra={'run_id': run_id, 'bindings': len(retained.bindings)})
+
+    with _retained_lock:
+        retained = _retained.setdefault(run_id, retained)   # another thread may have been faster
+        _retained.move_to_end(run_id)
+        while len(_retained) > retained_models():
+            _retained.popitem(last=False)
+    return retained
+
+
+def _numbers(data, prefix='') -> dict:
+    # numbers of a nested dict, keys joined with '.'
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(_numbers(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = float(value)
+    return flat
+
+
+def diff(base, result) -> dict:
+    """
+    Numbers of RESULT_KEYS which differ between two summaries
+
+    Returns:
+        dict: '<key>[.<sub key>...]' -> {'base': ..., 'what_if': ..., 'delta': ...}
+    """
+    base = _numbers({key: base[key] for key in RESULT_KEYS if key in base})
+    result = _numbers({key: result[key] for key in RESULT_KEYS if key in result})
+    changes = {}
+    for key in sorted(base.keys() | result.keys()):
+        before, after = base.get(key, 0.0), result.get(key, 0.0)
+        if abs(after - before) > 1e-9 * max(1.0, abs(before)):
+            changes[key] = {'base': before, 'what_if': after, 'delta': after - before}
+    return changes
+
+
+def what_if(run_id, overrides) -> dict:
+    """
+    Re-solve the scenario of a stored run with changed values
+
+    Args:
+        overrides: value id -> new value, on top of the overrides of the run
+
+    Returns:
+        dict: run_id, overrides, changed (values which differ from the run), solver ('stored basis' if
+            answered without a solver call), seconds (of the re-solve) and diff (see diff())
+
+    Raises:
+        KeyError: unknown run
+        ValueError: unknown value or no optimal solution
+        QueueFull: the job queue is at its limit or no solve slot became free within SLOT_WAIT seconds
+    """
+    retained = _retain(run_id)
+    with retained.lock:
+        value_collection = retained.value_collection(overrides)
+        started = time.perf_counter()
+        changed = retained.apply(value_collection)
+        result = retained.solve_from_basis(value_collection)
+        if result is None:
+            admit()
+            with solve_slot(timeout=SLOT_WAIT):
+                result = retained.solve(value_collection)
+        seconds = time.perf_counter() - started
+
+    return {
+        'run_id': run_id,
+        'overrides': overrides,
+        'changed': changed,
+        'solver': result['solver'],
+        'seconds': seconds,
+        'diff': diff(retained.base, result),
+    }
+
+
+def validity_ranges(run_id) -> dict:
+    """
+    Validity ranges of the values of a stored run, see RetainedModel.validity_ranges()
+
+    Raises:
+        KeyError: unknown run
+        QueueFull: see what_if()
+    """
+    retained = _retain(run_id)
+    with retained.lock:
+        return {'run_id': run_id, 'ranges': retained.validity_ranges()}
@@ -0,0 +1,201 @@
+"""
+Pool of long-lived, pre-warmed solve worker processes
+
+Every worker imports oemof.solph, pyomo and sympy and builds the preloaded scenarios once when
+it starts (the parsed workbook stays in memory), then executes queued jobs (see jobs.py) one after another.
+The workers are spawned, not forked: the web process runs threads (server, metrics timer, the supervisor of
+the pool), a lock one of them holds at a fork would never be released in the worker. They are not daemonic,
+so they can fork the solve processes of solve_models(); the pool terminates them when the web process exits.
+The web process wakes the workers through a local pipe when a job is submitted, a worker which is not
+woken up polls the queue. A worker exits after settings.SIMULATOR_JOB_MAX_TASKS jobs or when its memory
+exceeds settings.SIMULATOR_JOB_MAX_MEMORY_MB, always between two jobs, and is replaced by the pool.
+"""
+
+import atexit
+import gc
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+from django.conf import settings
+
+SUPERVISE_INTERVAL = 1.0   # seconds between checks for exited workers
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def rss_mb() -> float:
+    """Resident memory of the current process in MB"""
+    try:
+        with open('/proc/self/statm') as statm:   # Linux: current value
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        import resource   # peak value, in kB on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def preload_scenarios():
+    """(workbook, sheet) pairs to build at start, settings.SIMULATOR_PRELOAD_SCENARIOS or those of all regions"""
+    from .scenario_catalog import scenarios
+
+    return [tuple(scenario) for scenario in getattr(settings, 'SIMULATOR_PRELOAD_SCENARIOS', None) or scenarios()]
+
+
+def warm_up():
+    """
+    Import the solver stack and build the preloaded scenarios once, so the first job does not pay for it
+    """
+    import sympy  # noqa: F401
+    import pyomo.environ  # noqa: F401
+    from .model.model_factory import ExcelModelFactory
+    from .oemof_runner import solver_name
+
+    for workbook, sheet in preload_scenarios():
+        ExcelModelFactory(workbook, sheet)   # parses and caches the workbook sheet
+    solver_name()   # checks the solver availability once
+
+
+def preload():
+    """
+    warm_up() and the results of all regions (settings.SIMULATOR_PREBUILD_RESULTS) in the web process
+    before the workers are forked (gunicorn --preload)
+
+    The imported modules and parsed workbooks are then shared copy-on-write by all workers. gc.freeze()
+    keeps the garbage collector from touching (and thereby copying) these objects in the workers.
+    """
+    start = time.perf_counter()
+    warm_up()
+    if getattr(settings, 'SIMULATOR_PREBUILD_RESULTS', False):
+        from .scenario_catalog import prebuild
+        solved = sum(1 for _, _, was_solved in prebuild() if was_solved)
+        logger.info('Prebuilt region results, %d scenario(s) solved', solved)
+    gc.freeze()
+    logger.info('Preloaded %d scenario(s) in %.2f s, RSS %.0f MB',
+                len(preload_scenarios()), time.perf_counter() - start, rss_mb())
+
+
+def worker_main(wake, poll_interval, max_tasks=0, max_memory_mb=0):
+    """
+    Main loop of a worker process: execute queued jobs until a limit is reached (0: no limit)
+
+    Args:
+        wake: multiprocessing queue, an item is put for every submitted job
+        poll_interval: seconds to wait for a wake up before checking the queue anyway
+    """
+    from . import metrics
+    from .jobs import init_worker, claim_next_job, execute_job
+
+    # started by a web worker: do not keep its signal handlers, which would ignore the shutdown
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    parent = os.getppid()
+
+    init_worker()
+    warm_up()
+    tasks = 0
+    try:
+        while os.getppid() == parent:   # the pool's process is gone (e.g. killed): stop, do not run old code
+            job = claim_next_job()
+            if job is None:
+                try:
+                    wake.get(timeout=poll_interval)
+                except queue.Empty:
+                    pass
+                continue
+
+            execute_job(job)
+            metrics.flush()   # at once, not only at the end of the worker
+            tasks += 1
+            if max_tasks and tasks >= max_tasks:
+                return
+            if max_memory_mb and rss_mb() > max_memory_mb:
+                return
+    finally:
+        metrics.flush()   # also when leaving by an error; multiprocessing exits without atexit handlers
+
+
+class WorkerPool:
+    """
+    Fixed number of worker processes, exited workers are replaced
+    """
+
+    def __init__(self, size, poll_interval=1.0, max_tasks=0, max_memory_mb=0):
+        self.size = max(1, size)
+        self.poll_interval = poll_interval
+        self.max_tasks = max_tasks
+        self.max_memory_mb = max_memory_mb
+        self.context = multiprocessing.get_context('spawn')
+        self.wake = self.context.Queue()
+        self.processes = []
+        atexit.register(self.terminate)   # before multiprocessing waits for its non-daemonic processes
+
+    def _start_worker(self):
+        process = self.context.Process(target=worker_main,
+                                       args=(self.wake, self.poll_interval, self.max_tasks, self.max_memory_mb))
+        process.start()
+        return process
+
+    def terminate(self):
+        """Stop the workers, a running job is left to expire (see jobs.expire_jobs())"""
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+    def supervise(self):
+        """Start missing workers, returns the number of workers started"""
+        alive = [process for process in self.processes if process.is_alive()]
+        started = self.size - len(alive)
+        self.processes = alive + [self._start_worker() for _ in range(started)]
+        return started
+
+    def run_forever(self):
+        """Keep the pool at its size and expire stuck jobs (blocks)"""
+        from .jobs import expire_jobs
+
+        while True:
+            self.supervise()
+            try:
+                expire_jobs()
+            except Exception as e:   # e.g. the job database is locked, retried next time
+                logger.warning('expiring jobs failed', extra={'error': e})
+            time.sleep(SUPERVISE_INTERVAL)
+
+    def start(self):
+        """Keep the pool at its size from a daemon thread of this process"""
+        self.supervise()
+        threading.Thread(target=self.run_forever, name='solve-worker-pool', daemon=True).start()
+
+    def notify(self):
+        """Wake up one idle worker"""
+        self.wake.put(None)
+
+
+def pool_from_settings():
+    return WorkerPool(getattr(settings, 'SIMULATOR_JOB_WORKERS', 1),
+                      max_tasks=getattr(settings, 'SIMULATOR_JOB_MAX_TASKS', 0),
+                      max_memory_mb=getattr(settings, 'SIMULATOR_JOB_MAX_MEMORY_MB', 0))
+
+
+def get_pool():
+    """
+    Worker pool of this web process, started on first use
+
+    Returns:
+        WorkerPool: or None if the jobs are executed by 'manage.py solve_worker' (SIMULATOR_JOB_WORKERS = 0)
+    """
+    global _pool
+    if getattr(settings, 'SIMULATOR_JOB_WORKERS', 1) <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = pool_from_settings()
+            _pool.start()
+    return _pool